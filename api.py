@@ -1,10 +1,31 @@
-from flask_restful import Resource, reqparse, fields, marshal_with, abort
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask_restful import Resource, fields, marshal_with, abort
+from sqlalchemy import or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 
 from app_setup import db
 from models import UserModel
 from models import *
-from datetime import datetime
+from serializers import Serializer
+from validation import Schema, Field, iso_datetime
+from geo import CORRIDOR_DETOUR_KM, cells_in_radius, haversine_km
+from matching import (MAX_CANDIDATES, MAX_WINDOW_HOURS, candidate_order, corridor_conditions, rank_rides,
+                      rating_column)
+from pagination import paginate
+from ratings import record_rating
+from reservations import ReservationError, reserve_seat, release_seat, ride_modified
+from transactions import retry_on_locked
+from lifecycle import cancel_ride, complete_ride, start_ride
+from places import KINDS, MAX_SUGGESTIONS, match_expression, suggest_query
+from stats import FINISHED, record_rides, user_stats, user_stats_query
+from passwords import hash_password, verify_password, needs_rehash
+from search_cache import SearchCache, search_cache, invalidate_ride_searches
+from etags import (version_etag, digest_etag, conditional_get, if_match_versions, check_version,
+                   precondition_failed)
+from bulk import MAX_BATCH, create_rides, add_participants
+from events import (EventStream, HubFull, event_hub, parse_ride_ids, publish_ride_event, ride_state,
+                    ride_state_query)
+from datetime import datetime, timedelta
 import enum
 
 class EnumField(fields.Raw):
@@ -13,12 +34,13 @@ class EnumField(fields.Raw):
             return value.value
         return value
 
-user_args = reqparse.RequestParser()
-user_args.add_argument('username', type=str, required=True, help="Username cannot be blank")
-user_args.add_argument('email', type=str, required=True, help="Email cannot be blank")
-user_args.add_argument('password', type=str, required=True, help="Password cannot be blank")
-user_args.add_argument('student_id', type=str, required=False)
-user_args.add_argument('university', type=str, required=False)
+user_args = Schema(
+    username=Field(str, required=True, help="Username cannot be blank"),
+    email=Field(str, required=True, help="Email cannot be blank"),
+    password=Field(str, required=True, help="Password cannot be blank"),
+    student_id=Field(str),
+    university=Field(str)
+)
 
 userFields = {
     'id': fields.Integer,
@@ -27,12 +49,16 @@ userFields = {
     'student_id': fields.String,
     'university': fields.String,
     'average_rating': fields.Float,
-    'created_at': fields.DateTime(dt_format='iso8601')
+    'created_at': fields.DateTime(dt_format='iso8601'),
+    'version': fields.Integer
 }
 
-login_user_args = reqparse.RequestParser()
-login_user_args.add_argument('email', type=str, required=True, help="Email cannot be blank")
-login_user_args.add_argument('password', type=str, required=True, help="Password cannot be blank") 
+user_serializer = Serializer(userFields, UserModel)
+
+login_user_args = Schema(
+    email=Field(str, required=True, help="Email cannot be blank"),
+    password=Field(str, required=True, help="Password cannot be blank")
+)
 
 
 rideFields = {
@@ -51,36 +77,68 @@ rideFields = {
     'price_per_seat': fields.Float,
     'seats_available': fields.Integer,
     'status': EnumField,
-    'created_at': fields.DateTime(dt_format='iso8601')
+    'created_at': fields.DateTime(dt_format='iso8601'),
+    'version': fields.Integer
 }
 
-ride_args = reqparse.RequestParser()
-ride_args.add_argument('driver_id', type=int, required=True, help="Driver ID cannot be blank")
-ride_args.add_argument('from_address', type=str, required=True, help="From address cannot be blank")
-ride_args.add_argument('from_lat', type=float, required=True, help="From latitude cannot be blank")
-ride_args.add_argument('from_lng', type=float, required=True, help="From longitude cannot be blank")
-ride_args.add_argument('to_address', type=str, required=True, help="To address cannot be blank")
-ride_args.add_argument('to_lat', type=float, required=True, help="To latitude cannot be blank")
-ride_args.add_argument('to_lng', type=float, required=True, help="To longitude cannot be blank")
-ride_args.add_argument('departure_time', type=str, required=True, help="Departure time cannot be blank (use ISO format)")
-ride_args.add_argument('price_per_seat', type=float, required=True, help="Price per seat cannot be blank")
-ride_args.add_argument('seats_available', type=int, required=True, help="Seats available cannot be blank")
-ride_args.add_argument('start_city', type=str, required=False)
-ride_args.add_argument('end_city', type=str, required=False)
-ride_args.add_argument('status', type=str, required=False, choices=('planned', 'in_progress', 'completed', 'cancelled'))
-#ride_args.add_argument('status', type=str, required=False, choices=('PLANNED', 'IN_PROGRESS', 'COMPLETED', 'CANCELLED'))
+ride_serializer = Serializer(rideFields, RideModel,
+                             columns={'driver_name': UserModel.username},
+                             joins=[(UserModel, UserModel.id == RideModel.driver_id)])
+
+ride_args = Schema(
+    driver_id=Field(int, required=True, help="Driver ID cannot be blank"),
+    from_address=Field(str, required=True, help="From address cannot be blank"),
+    from_lat=Field(float, required=True, help="From latitude cannot be blank"),
+    from_lng=Field(float, required=True, help="From longitude cannot be blank"),
+    to_address=Field(str, required=True, help="To address cannot be blank"),
+    to_lat=Field(float, required=True, help="To latitude cannot be blank"),
+    to_lng=Field(float, required=True, help="To longitude cannot be blank"),
+    departure_time=Field(iso_datetime, required=True, help="Departure time cannot be blank (use ISO format)",
+                         invalid="Invalid date format. Use ISO format (YYYY-MM-DDTHH:MM:SS)"),
+    price_per_seat=Field(float, required=True, help="Price per seat cannot be blank"),
+    seats_available=Field(int, required=True, help="Seats available cannot be blank"),
+    start_city=Field(str),
+    end_city=Field(str),
+    status=Field(str, choices=('planned', 'in_progress', 'completed', 'cancelled'))
+)
+
+ride_id_args = Schema(id=Field(int, required=True, help="Ride ID is required"))
+passenger_args = Schema(passenger_id=Field(int, required=True, help="Passenger ID is required"))
+driver_args = Schema(driver_id=Field(int, required=True, help="Driver ID is required"))
+ride_start_args = Schema(
+    driver_id=Field(int, required=True, help="Driver ID is required"),
+    participant_ids=Field(int, required=True, many=True, help="List of participant IDs in the vehicle")
+)
+
+
+def user_etag(id):
+    version = db.session.execute(select(UserModel.version).filter_by(id=id)).scalar()
+    return version_etag('user', id, version) if version is not None else None
+
+def commit_versioned():
+    # The ORM UPDATE or DELETE only matches the version it loaded (version_id_col), the
+    # one If-Match was checked against; a write in between makes it match nothing.
+    try:
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        precondition_failed()
 
+def driver_ride_buckets(driver_id):
+    # Cached ride searches embed the driver's username.
+    rides = db.session.execute(
+        select(RideModel.start_city, RideModel.end_city, RideModel.departure_time).filter_by(driver_id=driver_id)
+    ).all()
+    return set().union(*(SearchCache.buckets_for(*ride) for ride in rides))
 
 class Users(Resource):
-    @marshal_with(userFields)
     def get(self):
-        users = UserModel.query.all() 
-        return users 
+        return paginate(user_serializer.select(), [UserModel.id], user_serializer)
     
     @marshal_with(userFields)
     def post(self):
-        args = user_args.parse_args()
-        password_hash = generate_password_hash(args['password'])
+        args = user_args.parse()
+        password_hash = hash_password(args['password'])
         
         user = UserModel(
             username=args['username'],
@@ -95,54 +153,62 @@ class Users(Resource):
         return users, 201
     
 class User(Resource):
-    @marshal_with(userFields)
     def get(self, id):
-        user = UserModel.query.filter_by(id=id).first() 
+        etag, not_modified = conditional_get(lambda: user_etag(id))
+        if not_modified:
+            return not_modified
+
+        user = user_serializer.fetch_one(user_serializer.select().where(UserModel.id == id))
         if not user: 
             abort(404, message="User not found")
-        return user 
+        return user, 200, {'ETag': version_etag('user', id, user['version'])}
     
     @marshal_with(userFields)
     def patch(self, id):
-        args = user_args.parse_args()
+        args = user_args.parse()
         user = UserModel.query.filter_by(id=id).first()
         if not user:
             abort(404, message="User not found")
+        check_version(user.version, if_match_versions('user', id))
+        renamed = args['username'] and args['username'] != user.username
         
         if args['username']:
             user.username = args['username']
         if args['email']:
             user.email = args['email']
         if args['password']:
-            user.password_hash = generate_password_hash(args['password'])
+            user.password_hash = hash_password(args['password'])
         if args.get('student_id') is not None:
             user.student_id = args['student_id']
         if args.get('university') is not None:
             user.university = args['university']
         
-        db.session.commit()
-        return user
+        commit_versioned()
+        if renamed:
+            invalidate_ride_searches(driver_ride_buckets(id))
+        return user, 200, {'ETag': version_etag('user', user.id, user.version)}
     
     @marshal_with(userFields)
     def delete(self, id):
         user = UserModel.query.filter_by(id=id).first() 
         if not user: 
             abort(404, message="User not found")
+        check_version(user.version, if_match_versions('user', id))
         db.session.delete(user)
-        db.session.commit()
+        commit_versioned()
         users = UserModel.query.all()
         return users
 
 class Register(Resource):
     def post(self):
-        args = user_args.parse_args()
+        args = user_args.parse()
 
         if UserModel.query.filter_by(username=args['username']).first():
             abort(400, message="Username already exist")
         if UserModel.query.filter_by(email=args['email']).first():
             abort(400, message="Email already exists")
         
-        password_hash = generate_password_hash(args['password'])
+        password_hash = hash_password(args['password'])
 
         user = UserModel(
             username = args['username'],
@@ -157,13 +223,20 @@ class Register(Resource):
     
 class Login(Resource):
     def post(self):
-        args = login_user_args.parse_args()
+        args = login_user_args.parse()
 
         user = UserModel.query.filter_by(email=args['email']).first()
         if not user:
             abort(404, message="User not found")
-        if not check_password_hash(user.password_hash, args['password']):
+        if not verify_password(user.password_hash, args['password']):
             abort(401, message="Wrong email or password")
+        if needs_rehash(user.password_hash):
+            user.password_hash = hash_password(args['password'])
+            try:
+                db.session.commit()
+            except StaleDataError:
+                # Changed meanwhile; the next login upgrades the hash.
+                db.session.rollback()
         return{
             "id" : user.id,
             "email" : user.email,
@@ -171,46 +244,83 @@ class Login(Resource):
         }, 200
         
 
+RIDE_ORDER = [RideModel.departure_time, RideModel.id]
+
+def ride_search_params(args):
+    origin = normalize_city(args.get('origin')) or None
+    destination = normalize_city(args.get('destination')) or None
+    date = args.get('date')  # YYYY-MM-DD
+    try:
+        day_start = datetime.strptime(date, '%Y-%m-%d') if date else None
+    except ValueError:
+        day_start = None
+    return origin, destination, day_start
+
+def ride_search_cache_key(cache, args):
+    origin, destination, day_start = ride_search_params(args)
+    page = f"{args.get('limit', '')}:{args.get('cursor', '')}"
+    return cache.key(origin, destination, day_start and day_start.date(), page)
+
+def ride_search_query(origin, destination, day_start):
+    query = ride_serializer.select()
+    
+    # Compare against the precomputed *_norm columns and a plain datetime range so
+    # the ride search indexes (ix_ride_search and the single-city / date ones) can be used.
+    if origin:
+        query = query.where(RideModel.start_city_norm == origin)
+    
+    if destination:
+        query = query.where(RideModel.end_city_norm == destination)
+    
+    if day_start:
+        query = query.where(RideModel.departure_time >= day_start,
+                            RideModel.departure_time < day_start + timedelta(days=1))
+    return query
+
+def user_rides_condition(id):
+    participant_rides_ids = select(RideParticipantModel.ride_id).filter_by(passenger_id=id)
+    return or_(RideModel.driver_id == id, RideModel.id.in_(participant_rides_ids))
+
+def user_rides_etag_query(id):
+    return (select(RideModel.id, RideModel.version, UserModel.version)
+            .join(UserModel, UserModel.id == RideModel.driver_id)
+            .filter(user_rides_condition(id))
+            .order_by(RideModel.id))
+
+def ride_participants_query(ride_id):
+    return (ride_participant_serializer.select()
+            .where(RideParticipantModel.ride_id == ride_id)
+            .order_by(RideParticipantModel.id))
+
+def ride_participants_etag_queries(ride_id):
+    ride_version = select(RideModel.version).filter_by(id=ride_id)
+    passengers = (select(RideParticipantModel.passenger_id, UserModel.version)
+                  .join(UserModel, UserModel.id == RideParticipantModel.passenger_id)
+                  .filter(RideParticipantModel.ride_id == ride_id)
+                  .order_by(RideParticipantModel.passenger_id))
+    return ride_version, passengers
+
 class Rides(Resource):
-    @marshal_with(rideFields)
     def get(self):
         from flask import request
-        from sqlalchemy import func
-        
-        origin = request.args.get('origin')
-        destination = request.args.get('destination')
-        date = request.args.get('date')  # YYYY-MM-DD
-        
-        query = RideModel.query
-        
-        if origin:
-            query = query.filter(func.lower(RideModel.start_city) == func.lower(origin))
-        
-        if destination:
-            query = query.filter(func.lower(RideModel.end_city) == func.lower(destination))
-        
-        if date:
-            try:
-                filter_date = datetime.strptime(date, '%Y-%m-%d').date()
-                query = query.filter(func.date(RideModel.departure_time) == filter_date)
-            except ValueError:
-                pass
+
+        stream = request.args.get('stream')
+        if not stream:
+            cache = search_cache()
+            cache_key = ride_search_cache_key(cache, request.args)
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return tuple(cached)
         
-        rides = query.all()
-        for ride in rides:
-            driver = UserModel.query.get(ride.driver_id)
-            ride.driver_name = driver.username if driver else None
-        return rides 
+        query = ride_search_query(*ride_search_params(request.args))
+        result = paginate(query, RIDE_ORDER, ride_serializer)
+        if not stream:
+            cache.set(cache_key, list(result))
+        return result
     
     @marshal_with(rideFields)
     def post(self):
-        args = ride_args.parse_args()
-
-        try:
-            departure_time = datetime.fromisoformat(args['departure_time'])
-        except ValueError:
-            return {'message': 'Invalid date format. Use ISO format (YYYY-MM-DDTHH:MM:SS)'}, 400
-
+        args = ride_args.parse()
         
         ride = RideModel(
             driver_id=args['driver_id'],
@@ -222,63 +332,196 @@ class Rides(Resource):
             to_lng=args['to_lng'],
             start_city=args.get('start_city'),
             end_city=args.get('end_city'),
-            departure_time=departure_time,
+            departure_time=args['departure_time'],
             price_per_seat=args['price_per_seat'],
             seats_available=args['seats_available'],
             status=(args.get('status') or 'planned').upper()
         )
+        buckets = SearchCache.ride_buckets(ride)
         db.session.add(ride)
+        db.session.flush()
+        if RideStatus[ride.status] in FINISHED:
+            record_rides(db.session, [ride.id])
         db.session.commit()
-        rides = UserModel.query.all()
-        return rides, 201
+        invalidate_ride_searches(buckets)
+        return ride, 201
     
     def delete(self):
-        parser = reqparse.RequestParser()
-        parser.add_argument('id', type=int, required=True, help="Ride ID is required")
-        args = parser.parse_args()
+        args = ride_id_args.parse()
 
         ride = RideModel.query.get(args['id'])
         if not ride:
             return {'message': 'Ride not found'}, 404
+        check_version(ride.version, if_match_versions('ride', args['id']))
 
+        buckets = SearchCache.ride_buckets(ride)
+        if ride.status in FINISHED:
+            record_rides(db.session, [ride.id], sign=-1)
         db.session.delete(ride)
-        db.session.commit()
+        commit_versioned()
+        invalidate_ride_searches(buckets)
         return {'message': f'Ride with id {args["id"]} deleted successfully'}, 200
 
-class RideJoin(Resource):
-    def post(self, ride_id):
-        parser = reqparse.RequestParser()
-        parser.add_argument('passenger_id', type=int, required=True, help="Passenger ID is required")
-        args = parser.parse_args()
+def bulk_items(key):
+    from flask import request
 
-        ride = RideModel.query.get(ride_id)
-        if not ride:
-            return {'message': 'Ride not found'}, 404
+    payload = request.get_json(silent=True)
+    items = payload.get(key) if isinstance(payload, dict) else payload
+    if not isinstance(items, list):
+        abort(400, message=f"Request body must be a JSON list or an object with a '{key}' list")
+    if len(items) > MAX_BATCH:
+        abort(413, message=f"At most {MAX_BATCH} items per request")
+    return items
 
-        if ride.status != RideStatus.PLANNED:
-            return {'message': 'Cannot join ride that is not in PLANNED status'}, 400
+class RidesBulk(Resource):
+    def post(self):
+        created, errors = create_rides(bulk_items('rides'), ride_args)
+        return {'created': created, 'errors': errors}, 201 if created else 400
 
-        if ride.seats_available <= 0:
-            return {'message': 'No seats available'}, 400
-        
-        if ride.driver_id == args['passenger_id']:
-            return {'message': 'Driver cannot join'}, 400
-
-        existing = RideParticipantModel.query.filter_by(
-            ride_id=ride_id,
-            passenger_id=args['passenger_id']
-        ).first()
-        if existing:
-            return {'message': 'Passenger already joined this ride'}, 400
-
-        participant = RideParticipantModel(
-            ride_id=ride_id,
-            passenger_id=args['passenger_id']
+class RideParticipantsBulk(Resource):
+    def post(self, ride_id):
+        versions = if_match_versions('ride', ride_id)
+        try:
+            outcome = add_participants(ride_id, bulk_items('passenger_ids'), versions)
+        except ReservationError as error:
+            return {'message': error.message}, error.status
+        if outcome is None:
+            return {'message': 'Ride not found'}, 404
+        created, errors = outcome
+        if created:
+            publish_ride_event(ride_id, 'join', joined=len(created))
+        return {'created': created, 'errors': errors}, 201 if created else 400
+
+class SearchCacheStats(Resource):
+    def get(self):
+        return search_cache().stats()
+
+MAX_NEARBY_RADIUS_KM = 50.0
+MAX_NEARBY_RESULTS = 100
+
+nearby_args = Schema(location='args',
+    from_lat=Field(float, required=True, help="Pickup latitude is required"),
+    from_lng=Field(float, required=True, help="Pickup longitude is required"),
+    to_lat=Field(float, required=True, help="Drop-off latitude is required"),
+    to_lng=Field(float, required=True, help="Drop-off longitude is required"),
+    from_radius=Field(float, default=5.0),
+    to_radius=Field(float, default=5.0),
+    departure_after=Field(iso_datetime, invalid="Invalid date format. Use ISO format (YYYY-MM-DDTHH:MM:SS)"),
+    departure_before=Field(iso_datetime, invalid="Invalid date format. Use ISO format (YYYY-MM-DDTHH:MM:SS)"),
+    limit=Field(int, default=50)
+)
+
+class RidesNearby(Resource):
+    def get(self):
+        args = nearby_args.parse()
+
+        for radius in ('from_radius', 'to_radius'):
+            if not 0 < args[radius] <= MAX_NEARBY_RADIUS_KM:
+                abort(400, message=f"{radius} must be between 0 and {MAX_NEARBY_RADIUS_KM} km")
+        limit = min(max(args['limit'], 0), MAX_NEARBY_RESULTS)
+        departure_after = args['departure_after'] or datetime.utcnow()
+        departure_before = args['departure_before']
+
+        # Candidates come from the grid cells covering both circles (ix_ride_from_cell),
+        # earliest departures first and at most MAX_CANDIDATES of them. Exact distances
+        # are computed on their coordinates only; just the rides returned are loaded.
+        query = select(RideModel.id, RideModel.from_lat, RideModel.from_lng, RideModel.to_lat,
+                       RideModel.to_lng, RideModel.departure_time).where(
+            RideModel.from_cell.in_(cells_in_radius(args['from_lat'], args['from_lng'], args['from_radius'])),
+            RideModel.to_cell.in_(cells_in_radius(args['to_lat'], args['to_lng'], args['to_radius'])),
+            RideModel.status == RideStatus.PLANNED,
+            RideModel.departure_time >= departure_after
         )
+        if departure_before:
+            query = query.where(RideModel.departure_time < departure_before)
+        # Sorting the few rides of the cells beats walking every planned ride in departure
+        # order, which SQLite picks to skip the sort unless the ORDER BY is an expression
+        # no index has (the same text with '' appended).
+        query = query.order_by(RideModel.departure_time.concat(''), RideModel.id).limit(MAX_CANDIDATES)
+        candidates = db.session.execute(query).all()
+
+        pickup = haversine_km(args['from_lat'], args['from_lng'],
+                              [c.from_lat for c in candidates], [c.from_lng for c in candidates])
+        dropoff = haversine_km(args['to_lat'], args['to_lng'],
+                               [c.to_lat for c in candidates], [c.to_lng for c in candidates])
+        nearest = sorted(
+            (pickup_km + dropoff_km, candidate.departure_time, candidate.id, pickup_km, dropoff_km)
+            for candidate, pickup_km, dropoff_km in zip(candidates, pickup, dropoff)
+            if pickup_km <= args['from_radius'] and dropoff_km <= args['to_radius']
+        )[:limit]
+        if not nearest:
+            return []
+
+        found = ride_serializer.fetch_all(ride_serializer.select().where(RideModel.id.in_([n[2] for n in nearest])))
+        found = {ride['id']: ride for ride in found}
+        rides = []
+        for _, _, ride_id, pickup_km, dropoff_km in nearest:
+            ride = found.get(ride_id)
+            if ride is not None:
+                ride['pickup_distance_km'] = pickup_km
+                ride['dropoff_distance_km'] = dropoff_km
+                rides.append(ride)
+        return rides
+
+MAX_MATCHES = 100
+
+match_args = Schema(location='args',
+    from_lat=Field(float, required=True, help="Pickup latitude is required"),
+    from_lng=Field(float, required=True, help="Pickup longitude is required"),
+    to_lat=Field(float, required=True, help="Drop-off latitude is required"),
+    to_lng=Field(float, required=True, help="Drop-off longitude is required"),
+    departure_time=Field(iso_datetime, invalid="Invalid date format. Use ISO format (YYYY-MM-DDTHH:MM:SS)"),
+    window_hours=Field(float, default=3.0),
+    max_detour_km=Field(float, default=15.0),
+    seats=Field(int, default=1),
+    limit=Field(int, default=20)
+)
+
+class RidesMatch(Resource):
+    def get(self):
+        args = match_args.parse()
+
+        if not 0 < args['max_detour_km'] <= CORRIDOR_DETOUR_KM:
+            abort(400, message=f"max_detour_km must be between 0 and {CORRIDOR_DETOUR_KM} km")
+        if not 0 < args['window_hours'] <= MAX_WINDOW_HOURS:
+            abort(400, message=f"window_hours must be between 0 and {MAX_WINDOW_HOURS}")
+        if args['seats'] < 1:
+            abort(400, message="seats must be at least 1")
+        departure = args['departure_time'] or datetime.utcnow()
+        pickup = (args['from_lat'], args['from_lng'])
+        dropoff = (args['to_lat'], args['to_lng'])
+
+        query = (ride_serializer.select()
+                 .add_columns(rating_column())
+                 .where(*corridor_conditions(pickup, dropoff, departure, args['window_hours'], args['seats']))
+                 .order_by(*candidate_order(departure))
+                 .limit(MAX_CANDIDATES))
+        rows = db.session.execute(query).all()
+
+        columns = {key: index for index, key in enumerate(rideFields)}
+        columns['rating'] = len(rideFields)
+        ranked = rank_rides(rows, columns, pickup, dropoff, departure, args['max_detour_km'],
+                            min(max(args['limit'], 0), MAX_MATCHES))
+
+        rides = []
+        for score, detour, pickup_time, row in ranked:
+            ride = ride_serializer.encode(row)
+            ride['detour_km'] = round(detour, 3)
+            ride['pickup_time'] = pickup_time.replace(microsecond=0).isoformat()
+            ride['score'] = round(score, 3)
+            rides.append(ride)
+        return rides
 
-        ride.seats_available -= 1
-        db.session.add(participant)
-        db.session.commit()
+class RideJoin(Resource):
+    def post(self, ride_id):
+        args = passenger_args.parse()
+        versions = if_match_versions('ride', ride_id)
+
+        try:
+            retry_on_locked(reserve_seat, ride_id, args['passenger_id'], versions)
+        except ReservationError as error:
+            return {'message': error.message}, error.status
+        publish_ride_event(ride_id, 'join', passenger_id=args['passenger_id'])
 
         return {'message': f'Passenger {args["passenger_id"]} joined ride {ride_id}'}, 201
     
@@ -289,51 +532,47 @@ participantFields = {
     'joined_at': fields.DateTime(dt_format='iso8601')
 }
 
+participant_serializer = Serializer(participantFields, RideParticipantModel)
+
+rideParticipantFields = {
+    'id': fields.Integer,
+    'ride_id': fields.Integer,
+    'passenger_id': fields.Integer,
+    'passenger_username': fields.String,
+    'joined_at': fields.DateTime(dt_format='iso8601')
+}
+
+ride_participant_serializer = Serializer(rideParticipantFields, RideParticipantModel,
+                                         columns={'passenger_username': UserModel.username},
+                                         joins=[(UserModel, UserModel.id == RideParticipantModel.passenger_id)])
+
 class AllParticipants(Resource):
-    @marshal_with(participantFields)
     def get(self):
-        participants = RideParticipantModel.query.all()
-        return participants
+        return paginate(participant_serializer.select(), [RideParticipantModel.id], participant_serializer)
 
 
 class RideLeave(Resource):
     def post(self, ride_id):
-        parser = reqparse.RequestParser()
-        parser.add_argument('passenger_id', type=int, required=True, help="Passenger ID is required")
-        args = parser.parse_args()
+        args = passenger_args.parse()
+        versions = if_match_versions('ride', ride_id)
 
-        ride = RideModel.query.get(ride_id)
-        if not ride:
-            return {'message': 'Ride not found'}, 404
-
-        if ride.status != RideStatus.PLANNED:
-            return {'message': 'Cannot leave ride that is not in PLANNED status'}, 400
-
-        participant = RideParticipantModel.query.filter_by(
-            ride_id=ride_id,
-            passenger_id=args['passenger_id']
-        ).first()
-
-        if not participant:
-            return {'message': 'Passenger not in this ride'}, 404
-
-        ride.seats_available += 1
-
-        db.session.delete(participant)
-        db.session.commit()
+        try:
+            retry_on_locked(release_seat, ride_id, args['passenger_id'], versions)
+        except ReservationError as error:
+            return {'message': error.message}, error.status
+        publish_ride_event(ride_id, 'leave', passenger_id=args['passenger_id'])
 
         return {'message': f'Passenger {args["passenger_id"]} left ride {ride_id}'}, 200
     
 class RideStart(Resource):
     def patch(self, ride_id):
-        parser = reqparse.RequestParser()
-        parser.add_argument('driver_id', type=int, required=True, help="Driver ID is required")
-        parser.add_argument('participant_ids', type=int, action='append', required=True, help="List of participant IDs in the vehicle")
-        args = parser.parse_args()
+        args = ride_start_args.parse()
 
         ride = RideModel.query.get(ride_id)
         if not ride:
             return {'message': 'Ride not found'}, 404
+        versions = if_match_versions('ride', ride_id)
+        check_version(ride.version, versions)
 
         if ride.driver_id != args['driver_id']:
             return {'message': 'Only the driver can start the ride'}, 403
@@ -341,23 +580,22 @@ class RideStart(Resource):
         if ride.status != RideStatus.PLANNED:
             return {'message': 'Ride cannot be started'}, 400
 
-        all_participants = RideParticipantModel.query.filter_by(ride_id=ride_id).all()
         confirmed_ids = set(args['participant_ids'])
-
-        removed_count = 0
-        for participant in all_participants:
-            if participant.passenger_id not in confirmed_ids:
-                ride.seats_available += 1
-                db.session.delete(participant)
-                removed_count += 1
-
-        registered_ids = {p.passenger_id for p in all_participants}
+        registered_ids = set(db.session.execute(
+            select(RideParticipantModel.passenger_id).filter_by(ride_id=ride_id)).scalars())
         invalid_ids = confirmed_ids - registered_ids
         if invalid_ids:
             return {'message': f'Invalid participant IDs: {list(invalid_ids)}'}, 400
 
-        ride.status = RideStatus.IN_PROGRESS
-        db.session.commit()
+        buckets = SearchCache.ride_buckets(ride)
+        removed_count = retry_on_locked(start_ride, ride_id, confirmed_ids, versions)
+        if removed_count is None:
+            if ride_modified(ride_id, versions):
+                precondition_failed()
+            return {'message': 'Ride cannot be started'}, 400
+        invalidate_ride_searches(buckets)
+        publish_ride_event(ride_id, 'start', participant_ids=sorted(confirmed_ids),
+                           removed_participants=removed_count)
 
         return {
             'message': f'Ride {ride_id} started with {len(confirmed_ids)} participants',
@@ -367,13 +605,13 @@ class RideStart(Resource):
     
 class RideComplete(Resource):
     def patch(self, ride_id):
-        parser = reqparse.RequestParser()
-        parser.add_argument('driver_id', type=int, required=True, help="Driver ID is required")
-        args = parser.parse_args()
+        args = driver_args.parse()
 
         ride = RideModel.query.get(ride_id)
         if not ride:
             return {'message': 'Ride not found'}, 404
+        versions = if_match_versions('ride', ride_id)
+        check_version(ride.version, versions)
 
         if ride.driver_id != args['driver_id']:
             return {'message': 'Only the driver can complete the ride'}, 403
@@ -381,8 +619,13 @@ class RideComplete(Resource):
         if ride.status != RideStatus.IN_PROGRESS:
             return {'message': 'Ride is not in progress and cannot be completed'}, 400
 
-        ride.status = RideStatus.COMPLETED
-        db.session.commit()
+        buckets = SearchCache.ride_buckets(ride)
+        if not retry_on_locked(complete_ride, ride_id, versions):
+            if ride_modified(ride_id, versions):
+                precondition_failed()
+            return {'message': 'Ride is not in progress and cannot be completed'}, 400
+        invalidate_ride_searches(buckets)
+        publish_ride_event(ride_id, 'complete')
 
         participants_count = RideParticipantModel.query.filter_by(ride_id=ride_id).count()
 
@@ -393,13 +636,13 @@ class RideComplete(Resource):
 
 class RideCancel(Resource):
     def patch(self, ride_id):
-        parser = reqparse.RequestParser()
-        parser.add_argument('driver_id', type=int, required=True, help="Driver ID is required")
-        args = parser.parse_args()
+        args = driver_args.parse()
 
         ride = RideModel.query.get(ride_id)
         if not ride:
             return {'message': 'Ride not found'}, 404
+        versions = if_match_versions('ride', ride_id)
+        check_version(ride.version, versions)
 
         if ride.driver_id != args['driver_id']:
             return {'message': 'Only the driver can cancel the ride'}, 403
@@ -410,45 +653,77 @@ class RideCancel(Resource):
         if ride.status == RideStatus.CANCELLED:
             return {'message': 'Ride is already cancelled'}, 400
 
-        participants = RideParticipantModel.query.filter_by(ride_id=ride_id).all()
-        for participant in participants:
-            db.session.delete(participant)
-        
-        ride.status = RideStatus.CANCELLED
-        db.session.commit()
+        buckets = SearchCache.ride_buckets(ride)
+        removed = retry_on_locked(cancel_ride, ride_id, versions)
+        if removed is None:
+            if ride_modified(ride_id, versions):
+                precondition_failed()
+            return {'message': 'Ride can no longer be cancelled'}, 400
+        invalidate_ride_searches(buckets)
+        publish_ride_event(ride_id, 'cancel', removed_participants=removed)
 
         return {
             'message': f'Ride {ride_id} cancelled',
-            'removed_participants': len(participants)
+            'removed_participants': removed
         }, 200
 
+EVENT_STREAM_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+def ride_event_stream(ride_ids, single=False):
+    from flask import Response, current_app
+
+    try:
+        stream = EventStream(event_hub(), ride_ids, current_app.config['EVENTS_HEARTBEAT'])
+    except HubFull as error:
+        return {'message': str(error)}, 503
+    rows = db.session.execute(ride_state_query(ride_ids)).all()
+    if single and not rows:
+        stream.close()
+        return {'message': 'Ride not found'}, 404
+    stream.snapshots = [ride_state(row) for row in rows]
+    return Response(stream, mimetype='text/event-stream', headers=EVENT_STREAM_HEADERS)
+
+class RideEvents(Resource):
+    def get(self, ride_id):
+        return ride_event_stream([ride_id], single=True)
+
+class RidesEvents(Resource):
+    def get(self):
+        from flask import current_app, request
+
+        try:
+            ride_ids = parse_ride_ids(request.args.get('ids'), current_app.config['EVENTS_MAX_RIDES'])
+        except ValueError as error:
+            abort(400, message=str(error))
+        return ride_event_stream(ride_ids)
+
 class RideParticipants(Resource):
     def get(self, ride_id):
-        participants = RideParticipantModel.query.filter_by(ride_id=ride_id).all()
-        
-        result = []
-        for participant in participants:
-            user = UserModel.query.get(participant.passenger_id)
-            result.append({
-                'id': participant.id,
-                'ride_id': participant.ride_id,
-                'passenger_id': participant.passenger_id,
-                'passenger_username': user.username if user else None,
-                'joined_at': participant.joined_at.isoformat()
-            })
+        def participants_etag():
+            ride_version, passengers = ride_participants_etag_queries(ride_id)
+            ride_version = db.session.execute(ride_version).scalar()
+            passengers = db.session.execute(passengers).all()
+            return digest_etag('participants', [ride_version] + passengers)
+
+        etag, not_modified = conditional_get(participants_etag)
+        if not_modified:
+            return not_modified
+
+        result = ride_participant_serializer.fetch_all(ride_participants_query(ride_id))
         
-        return result
+        return result, 200, {'ETag': etag or participants_etag()}
     
-ratings_fields = reqparse.RequestParser()
-ratings_fields.add_argument('ride_id', type=int, required=True, help="Ride ID is required")
-ratings_fields.add_argument('user_id', type=int, required=True, help="User ID is required")
-ratings_fields.add_argument('rater_id', type=int, required=True, help="Rater ID is required")
-ratings_fields.add_argument('stars', type=int, required=True, help="Stars rating is required (1-5)")
+ratings_fields = Schema(
+    ride_id=Field(int, required=True, help="Ride ID is required"),
+    user_id=Field(int, required=True, help="User ID is required"),
+    rater_id=Field(int, required=True, help="Rater ID is required"),
+    stars=Field(int, required=True, help="Stars rating is required (1-5)")
+)
 
 
 class Ratings(Resource):
     def post(self):
-        args = ratings_fields.parse_args()
+        args = ratings_fields.parse()
 
         ride = RideModel.query.get(args['ride_id'])
         if not ride:
@@ -470,29 +745,81 @@ class Ratings(Resource):
             stars=args['stars']
         )
         db.session.add(rating)
-        db.session.flush()  
-
-        all_ratings = RatingModel.query.filter_by(user_id=args['user_id']).all()
-        total_stars = sum(r.stars for r in all_ratings)
-        user.average_rating = total_stars / len(all_ratings)
+        try:
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            return {'message': 'This ride has already been rated by this user'}, 400
 
+        record_rating(db.session, args['user_id'], args['stars'])
         db.session.commit()
 
         return {'message': 'Rating submitted successfully'}, 201
     
 class UserRides(Resource):
-    @marshal_with(rideFields)
     def get(self, id):
-        driver_rides = RideModel.query.filter_by(driver_id=id).all()
+        user_rides = user_rides_condition(id)
 
-        participant_rides_ids = db.session.query(RideParticipantModel.ride_id)\
-            .filter_by(passenger_id=id).subquery()
-        passenger_rides = RideModel.query.filter(RideModel.id.in_(participant_rides_ids)).all()
+        def rides_etag():
+            return digest_etag('user-rides', db.session.execute(user_rides_etag_query(id)).all())
 
-        all_rides = list({ride.id: ride for ride in driver_rides + passenger_rides}.values())
-        
-        for ride in all_rides:
-            driver = UserModel.query.get(ride.driver_id)
-            ride.driver_name = driver.username if driver else None
+        etag, not_modified = conditional_get(rides_etag)
+        if not_modified:
+            return not_modified
+
+        result = paginate(ride_serializer.select().where(user_rides), RIDE_ORDER, ride_serializer)
+        if isinstance(result, tuple):
+            result[2]['ETag'] = etag or rides_etag()
+        return result
+
+
+class UserStats(Resource):
+    def get(self, id):
+        row = db.session.execute(user_stats_query(id)).first()
+        if row is None:
+            return {'message': 'User not found'}, 404
+        return user_stats(row), 200
+
+# History of archived rides (see archive.py). The live endpoints above never read the
+# archive tables; these never read the live ones.
+ARCHIVE_ORDER = [ArchivedRideModel.departure_time, ArchivedRideModel.id]
+
+archived_ride_serializer = Serializer(rideFields, ArchivedRideModel,
+                                      columns={'driver_name': UserModel.username},
+                                      joins=[(UserModel, UserModel.id == ArchivedRideModel.driver_id)])
+
+archived_participant_serializer = Serializer(rideParticipantFields, ArchivedRideParticipantModel,
+                                             columns={'passenger_username': UserModel.username},
+                                             joins=[(UserModel, UserModel.id == ArchivedRideParticipantModel.passenger_id)])
 
-        return all_rides
\ No newline at end of file
+class UserRideHistory(Resource):
+    def get(self, id):
+        participant_rides_ids = select(ArchivedRideParticipantModel.ride_id).filter_by(passenger_id=id)
+        query = archived_ride_serializer.select().where(
+            or_(ArchivedRideModel.driver_id == id, ArchivedRideModel.id.in_(participant_rides_ids)))
+        return paginate(query, ARCHIVE_ORDER, archived_ride_serializer)
+
+class RideParticipantHistory(Resource):
+    def get(self, ride_id):
+        query = archived_participant_serializer.select().where(ArchivedRideParticipantModel.ride_id == ride_id)
+        return paginate(query, [ArchivedRideParticipantModel.id], archived_participant_serializer)
+
+suggest_args = Schema(location='args',
+    q=Field(str, required=True, help="Query cannot be blank"),
+    kind=Field(str, choices=KINDS),
+    limit=Field(int, default=10)
+)
+
+class PlacesSuggest(Resource):
+    def get(self):
+        args = suggest_args.parse()
+
+        match = match_expression(args['q'])
+        if match is None:
+            return []
+        rows = db.session.execute(suggest_query(args['kind']), {
+            'match': match,
+            'kind': args['kind'],
+            'limit': min(max(args['limit'], 0), MAX_SUGGESTIONS),
+        })
+        return [{'name': name, 'kind': kind, 'planned_rides': planned_rides} for name, kind, planned_rides in rows]
@@ -1,17 +1,58 @@
-from flask import Flask 
+from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_restful import Api
 from flask_cors import CORS
+from sqlalchemy import event
 
-app = Flask(__name__) 
-app.url_map.strict_slashes = False
-CORS(app, resources={
-    r"/api/*": {
-        "origins": ["http://localhost:5173", "http://localhost:5174"],
-        "methods": ["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"]
-    }
-})
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
-db = SQLAlchemy(app) 
-api = Api(app)
+from config import Config, engine_options, sqlite_pragmas
+from metrics import init_metrics
+
+db = SQLAlchemy()
+
+CORS_ORIGINS = ["http://localhost:5173", "http://localhost:5174"]
+
+
+def apply_pragmas(engine, pragmas):
+    """Run ``PRAGMA name=value`` for ``pragmas`` on every new connection of ``engine``
+    (a sync Engine, or the ``sync_engine`` of an AsyncEngine)."""
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+def create_app(config=None):
+    """Build the Flask app from ``Config`` (environment) plus the ``config`` overrides,
+    bind ``db`` to it and register the API routes."""
+    app = Flask(__name__)
+    app.url_map.strict_slashes = False
+    CORS(app, resources={
+        r"/api/*": {
+            "origins": CORS_ORIGINS,
+            "methods": ["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],
+            "allow_headers": ["Content-Type", "Authorization"]
+        }
+    })
+    app.config.from_object(Config)
+    app.config.update(config or {})
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config))
+
+    db.init_app(app)
+    with app.app_context():
+        apply_pragmas(db.engine, sqlite_pragmas(app.config))
+        init_metrics(app, db.engine)
+
+    from events import init_event_hub
+    from passwords import init_password_pool
+    from search_cache import init_search_cache
+    init_search_cache(app)
+    init_event_hub(app)
+    init_password_pool(app)
+
+    from routes import register_routes
+    register_routes(app, Api(app))
+    return app
@@ -0,0 +1,126 @@
+"""Hot/cold split for finished rides.
+
+Rides that are COMPLETED or CANCELLED and departed more than ARCHIVE_AFTER_DAYS ago
+are moved, together with their participants and ratings, from the live tables into
+ride_archive / ride_participant_archive / rating_archive. Each batch is one short
+write transaction (copy, then delete), so the live tables stay small and the lock is
+never held for long. The API's live queries only read the hot tables; history is
+served from the archive by its own endpoints.
+"""
+import datetime
+import random
+import time
+
+from sqlalchemy import delete, func, insert, literal, select
+
+from app_setup import db
+from models import (ArchivedRatingModel, ArchivedRideModel, ArchivedRideParticipantModel,
+                    RatingModel, RideModel, RideParticipantModel, RideStatus)
+from search_cache import SearchCache, invalidate_ride_searches
+from transactions import retry_on_locked
+
+ARCHIVED_STATUSES = (RideStatus.COMPLETED, RideStatus.CANCELLED)
+
+# (live model, archive model, column of the live model holding the ride id)
+ARCHIVE_TABLES = (
+    (RideModel, ArchivedRideModel, RideModel.id),
+    (RideParticipantModel, ArchivedRideParticipantModel, RideParticipantModel.ride_id),
+    (RatingModel, ArchivedRatingModel, RatingModel.ride_id),
+)
+
+
+def archive_cutoff(days, now=None):
+    return (now or datetime.datetime.utcnow()) - datetime.timedelta(days=days)
+
+def copy_rows(live, archived, ride_column, ride_ids, archived_at):
+    columns = [column.name for column in archived.__table__.columns if column.name != 'archived_at']
+    values = [live.__table__.c[name] for name in columns]
+    if 'archived_at' in archived.__table__.columns:
+        columns.append('archived_at')
+        values.append(literal(archived_at, db.DateTime))
+    db.session.execute(insert(archived.__table__).from_select(
+        columns, select(*values).where(ride_column.in_(ride_ids))))
+
+def archive_batch(cutoff, batch_size):
+    """Move up to ``batch_size`` finished rides that departed before ``cutoff`` into
+    the archive in one transaction. Returns the number of rides moved."""
+    rides = db.session.execute(
+        select(RideModel.id, RideModel.start_city, RideModel.end_city, RideModel.departure_time)
+        .where(RideModel.status.in_(ARCHIVED_STATUSES), RideModel.departure_time < cutoff)
+        .limit(batch_size)
+    ).all()
+    if not rides:
+        return 0
+
+    ride_ids = [ride.id for ride in rides]
+    archived_at = datetime.datetime.utcnow()
+    for live, archived, ride_column in ARCHIVE_TABLES:
+        copy_rows(live, archived, ride_column, ride_ids, archived_at)
+    # Children first, the rides last.
+    for live, archived, ride_column in reversed(ARCHIVE_TABLES):
+        db.session.execute(delete(live).where(ride_column.in_(ride_ids)))
+    db.session.commit()
+
+    # Searches return rides of every status, so cached pages may still list them.
+    buckets = set()
+    for ride in rides:
+        buckets |= SearchCache.buckets_for(ride.start_city, ride.end_city, ride.departure_time)
+    invalidate_ride_searches(buckets)
+    return len(rides)
+
+def archive_rides(cutoff, batch_size=500, pause=0.0, max_batches=None, log=None):
+    """Archive batch after batch until no ride older than ``cutoff`` is left (or
+    ``max_batches`` ran), sleeping ``pause`` seconds between batches to let other
+    writers in. Returns the number of rides moved."""
+    moved = batches = 0
+    while max_batches is None or batches < max_batches:
+        count = retry_on_locked(archive_batch, cutoff, batch_size)
+        if not count:
+            break
+        moved += count
+        batches += 1
+        if log:
+            log(f"{moved} rides archived")
+        if pause:
+            time.sleep(pause)
+    return moved
+
+def archive_finished_rides(app):
+    """One background pass with the app's ARCHIVE_* settings."""
+    config = app.config
+    moved = archive_rides(archive_cutoff(config['ARCHIVE_AFTER_DAYS']), config['ARCHIVE_BATCH_SIZE'],
+                          pause=config['ARCHIVE_PAUSE'])
+    if moved:
+        app.logger.info("Archived %d finished rides", moved)
+    return moved
+
+
+def table_sizes():
+    sizes = {}
+    for live, archived, _ in ARCHIVE_TABLES:
+        for model in (live, archived):
+            sizes[model.__tablename__] = db.session.execute(select(func.count()).select_from(model)).scalar()
+    return sizes
+
+def search_latency(samples=200, rng_seed=0):
+    """Mean milliseconds per first page of the live ride search (city pairs that have
+    rides) and of the user rides listing, measured straight against the database."""
+    from api import RIDE_ORDER, ride_search_query, ride_serializer, user_rides_condition
+    from pagination import DEFAULT_PAGE_SIZE
+
+    rng = random.Random(rng_seed)
+    pairs = db.session.execute(
+        select(RideModel.start_city_norm, RideModel.end_city_norm).distinct()).all()
+    users = db.session.execute(select(RideModel.driver_id).distinct().limit(10000)).scalars().all()
+    if not pairs or not users:
+        return {'search_ms': None, 'user_rides_ms': None}
+
+    def mean_ms(queries):
+        started = time.perf_counter()
+        for query in queries:
+            db.session.execute(query.order_by(*RIDE_ORDER).limit(DEFAULT_PAGE_SIZE)).all()
+        return (time.perf_counter() - started) * 1000 / len(queries)
+
+    searches = [ride_search_query(*rng.choice(pairs), None) for _ in range(samples)]
+    listings = [ride_serializer.select().where(user_rides_condition(rng.choice(users))) for _ in range(samples)]
+    return {'search_ms': round(mean_ms(searches), 3), 'user_rides_ms': round(mean_ms(listings), 3)}
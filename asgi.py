@@ -0,0 +1,302 @@
+"""ASGI entry point: ``uvicorn asgi:app``.
+
+The read-heavy list endpoints (ride search, a user's rides, a ride's participants)
+are served by async handlers on an aiosqlite engine so their queries overlap instead
+of each holding a thread, and the ride event streams are served as coroutines so an
+idle subscriber costs no thread. Everything else - writes, paginated streams, CORS
+requests - is handed to the Flask app from run.py unchanged.
+"""
+import asyncio
+import json
+import re
+from urllib.parse import parse_qsl
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import parse_etags, unquote_etag
+
+from app_setup import CORS_ORIGINS, apply_pragmas, db
+from background import start_background_tasks, stop_background_tasks
+from api import (RIDE_ORDER, ride_participant_serializer, ride_participants_etag_queries,
+                 ride_participants_query, ride_search_cache_key, ride_search_params,
+                 ride_search_query, ride_serializer, user_rides_condition, user_rides_etag_query)
+from config import sqlite_pragmas
+from etags import digest_etag
+from events import (EVICTED, KEEPALIVE, RETRY, HubFull, event_hub, format_event, parse_ride_ids,
+                    ride_state, ride_state_query)
+from metrics import begin_request, end_request, instrument_engine, n_plus_one_detection
+from pagination import DEFAULT_PAGE_SIZE, PageError, finish_page, page_query
+from run import app
+from search_cache import search_cache
+
+ASYNC_POOL_SIZE = 20
+
+
+class _WsgiInstance(WsgiToAsgiInstance):
+    # asgiref runs every WSGI call on one shared thread by default; the Flask app is
+    # thread-safe, so let fallback requests use the executor pool instead.
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, thread_sensitive=False)
+
+class _WsgiFallback(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await _WsgiInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Request:
+    def __init__(self, scope):
+        self.scope = scope
+        self.headers = {k.decode('latin1').lower(): v.decode('latin1') for k, v in scope['headers']}
+        self.query_string = scope['query_string']
+        self.args = MultiDict(parse_qsl(self.query_string.decode('latin1'), keep_blank_values=True)).to_dict()
+
+    @property
+    def base_url(self):
+        host = self.headers.get('host')
+        if not host:
+            host, port = self.scope.get('server') or ('localhost', 80)
+            host = f'{host}:{port}'
+        return f"{self.scope.get('scheme', 'http')}://{host}{self.scope.get('root_path', '')}{self.scope['path']}"
+
+    def if_none_match(self, etag):
+        header = self.headers.get('if-none-match')
+        return header is not None and parse_etags(header).contains(unquote_etag(etag)[0])
+
+
+class AsyncApp:
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.fallback = _WsgiFallback(flask_app)
+        self.engine = None
+        self.cache = None
+        # (pattern, handler, the Flask rule it stands in for)
+        self.routes = [
+            (re.compile(r'/api/rides/?'), self.rides, '/api/rides/'),
+            (re.compile(r'/api/users/(\d+)/rides/?'), self.user_rides, '/api/users/<int:id>/rides'),
+            (re.compile(r'/api/rides/(\d+)/participants/?'), self.ride_participants,
+             '/api/rides/<int:ride_id>/participants'),
+        ]
+        # Long-lived responses; they send their own headers, CORS included.
+        self.streams = [
+            (re.compile(r'/api/rides/(\d+)/events/?'), self.ride_events, '/api/rides/<int:ride_id>/events'),
+            (re.compile(r'/api/rides/events/?'), self.rides_events, '/api/rides/events'),
+        ]
+
+    async def startup(self):
+        with self.flask_app.app_context():
+            url = db.engine.url.set(drivername='sqlite+aiosqlite')
+            self.cache = search_cache()
+            self.hub = event_hub()
+        config = self.flask_app.config
+        self.engine = create_async_engine(url, pool_size=config['DB_POOL_SIZE'] or ASYNC_POOL_SIZE,
+                                          max_overflow=config['DB_MAX_OVERFLOW'] or 10)
+        apply_pragmas(self.engine.sync_engine, sqlite_pragmas(config))
+        instrument_engine(self.engine.sync_engine)
+        start_background_tasks(self.flask_app)
+
+    async def shutdown(self):
+        stop_background_tasks(self.flask_app)
+        if self.engine is not None:
+            await self.engine.dispose()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        handler = self.route(scope)
+        if handler is None:
+            return await self.fallback(scope, receive, send)
+        if self.engine is None:
+            await self.startup()
+        handler, params, rule, streaming = handler
+        request = Request(scope)
+        token = begin_request(n_plus_one_detection(self.flask_app))
+        try:
+            if streaming:
+                await handler(request, receive, send, *params)
+                body, status, headers = None, 200, None
+            else:
+                body, status, headers = await handler(request, *params)
+        except HTTPError as error:
+            body, status, headers = {'message': str(error)}, error.status, {}
+        finally:
+            stats = end_request(token)
+        if headers is not None:
+            await self.respond(send, body, status, headers)
+        self.flask_app.extensions['metrics'].observe(rule, 'GET', status, stats)
+
+    def route(self, scope):
+        if scope['type'] != 'http' or scope['method'] != 'GET':
+            return None
+        for pattern, handler, rule in self.streams:
+            match = pattern.fullmatch(scope['path'])
+            if match:
+                return handler, [int(p) for p in match.groups()], rule, True
+        headers = dict(scope['headers'])
+        # Streams and CORS (preflight headers, allowed origins) stay with Flask.
+        if b'origin' in headers or b'stream=' in scope['query_string']:
+            return None
+        for pattern, handler, rule in self.routes:
+            match = pattern.fullmatch(scope['path'])
+            if match:
+                return handler, [int(p) for p in match.groups()], rule, False
+        return None
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def respond(self, send, body, status, headers):
+        raw_headers = []
+        payload = b''
+        if body is not None:
+            # Same bytes as flask-restful's output_json.
+            payload = (json.dumps(body, indent=4 if self.flask_app.debug else None) + '\n').encode()
+            raw_headers = [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode())]
+        raw_headers += [(k.lower().encode('latin1'), v.encode('latin1')) for k, v in headers.items()]
+        await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers})
+        await send({'type': 'http.response.body', 'body': payload})
+
+    async def fetch(self, query):
+        async with self.engine.connect() as connection:
+            return (await connection.execute(query)).all()
+
+    async def scalar(self, query):
+        async with self.engine.connect() as connection:
+            return (await connection.execute(query)).scalar()
+
+    async def page(self, request, query):
+        try:
+            query, limit = page_query(query, RIDE_ORDER, request.args, DEFAULT_PAGE_SIZE)
+        except PageError as error:
+            raise HTTPError(400, str(error))
+        items = ride_serializer.encode_all(await self.fetch(query.limit(limit + 1)))
+        return finish_page(items, RIDE_ORDER, limit, request.base_url, request.args)
+
+    async def conditional(self, request, etag_task, body_task):
+        """Run the ETag and body queries side by side; answer 304 when the client
+        already has the current representation."""
+        if 'if-none-match' in request.headers:
+            etag = await etag_task()
+            if request.if_none_match(etag):
+                return None, 304, {'ETag': etag}
+            items, headers = await body_task()
+        else:
+            etag, (items, headers) = await asyncio.gather(etag_task(), body_task())
+        return items, 200, dict(headers, ETag=etag)
+
+    async def rides(self, request):
+        cache_key = ride_search_cache_key(self.cache, request.args)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return tuple(cached)
+        items, headers = await self.page(request, ride_search_query(*ride_search_params(request.args)))
+        result = (items, 200, headers)
+        self.cache.set(cache_key, list(result))
+        return result
+
+    async def user_rides(self, request, id):
+        async def etag():
+            rows = await self.fetch(user_rides_etag_query(id))
+            return digest_etag('user-rides', rows, request.query_string)
+
+        async def body():
+            return await self.page(request, ride_serializer.select().where(user_rides_condition(id)))
+
+        return await self.conditional(request, etag, body)
+
+    async def ride_participants(self, request, ride_id):
+        async def etag():
+            ride_version, passengers = ride_participants_etag_queries(ride_id)
+            ride_version, passengers = await asyncio.gather(self.scalar(ride_version), self.fetch(passengers))
+            return digest_etag('participants', [ride_version] + passengers, request.query_string)
+
+        async def body():
+            rows = await self.fetch(ride_participants_query(ride_id))
+            return ride_participant_serializer.encode_all(rows), {}
+
+        return await self.conditional(request, etag, body)
+
+
+    async def ride_events(self, request, receive, send, ride_id):
+        await self.stream_events(request, receive, send, [ride_id], single=True)
+
+    async def rides_events(self, request, receive, send):
+        try:
+            ride_ids = parse_ride_ids(request.args.get('ids'), self.flask_app.config['EVENTS_MAX_RIDES'])
+        except ValueError as error:
+            raise HTTPError(400, str(error))
+        await self.stream_events(request, receive, send, ride_ids)
+
+    async def stream_events(self, request, receive, send, ride_ids, single=False):
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+
+        def wakeup():
+            # Called from the publishing (WSGI worker) thread.
+            try:
+                loop.call_soon_threadsafe(ready.set)
+            except RuntimeError:
+                pass  # loop already closed
+
+        try:
+            subscription = self.hub.subscribe(ride_ids, wakeup)
+        except HubFull as error:
+            raise HTTPError(503, str(error))
+        disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+        try:
+            rows = await self.fetch(ride_state_query(ride_ids))
+            if single and not rows:
+                raise HTTPError(404, 'Ride not found')
+            await send({'type': 'http.response.start', 'status': 200, 'headers': self.stream_headers(request)})
+            await send_text(send, RETRY + ''.join(format_event(None, 'snapshot', ride_state(row)) for row in rows))
+
+            heartbeat = self.flask_app.config['EVENTS_HEARTBEAT']
+            while True:
+                woken = asyncio.ensure_future(ready.wait())
+                await asyncio.wait((woken, disconnected), timeout=heartbeat, return_when=asyncio.FIRST_COMPLETED)
+                woken.cancel()
+                if disconnected.done():
+                    return
+                ready.clear()
+                chunk = ''.join(format_event(*message) for message in subscription.drain())
+                if subscription.evicted:
+                    await send_text(send, chunk + EVICTED)
+                    break
+                await send_text(send, chunk or KEEPALIVE)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            self.hub.unsubscribe(subscription)
+            disconnected.cancel()
+
+    def stream_headers(self, request):
+        headers = [(b'content-type', b'text/event-stream; charset=utf-8'), (b'cache-control', b'no-cache'),
+                   (b'x-accel-buffering', b'no')]
+        origin = request.headers.get('origin')
+        if origin in CORS_ORIGINS:
+            headers += [(b'access-control-allow-origin', origin.encode('latin1')), (b'vary', b'Origin')]
+        return headers
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+async def send_text(send, text):
+    await send({'type': 'http.response.body', 'body': text.encode(), 'more_body': True})
+
+
+app = AsyncApp(app)
@@ -0,0 +1,94 @@
+"""Periodic maintenance jobs run on daemon threads inside the serving process.
+
+Each job gets its own app context and a fresh session per run; a failing run is
+logged and retried on the next tick. Jobs are started explicitly by the entry points
+that serve traffic (run.py, asgi.py, serve.py), never by create_app, so scripts and
+the benchmark do not get surprise writers.
+
+With BACKGROUND_LOCK set, every process starts the jobs but only the one holding that
+file's lock runs them; when it exits, the next tick of another process takes over.
+"""
+import os
+import threading
+
+from app_setup import db
+
+
+class TaskLock:
+    """Exclusive lock on ``path``, taken by the first process that asks and held
+    until it exits. POSIX record locks are not inherited over fork, so a worker's
+    children (the password hashing pool) cannot keep it alive."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        import fcntl
+
+        with self.lock:
+            if self.file is None:
+                file = open(self.path, 'a')
+                try:
+                    fcntl.lockf(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    file.close()
+                    return False
+                self.file = file
+            return True
+
+
+class PeriodicTask(threading.Thread):
+    def __init__(self, app, name, interval, fn, lock=None):
+        super().__init__(name=name, daemon=True)
+        self.app = app
+        self.interval = interval
+        self.fn = fn
+        self.lock = lock
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            if self.lock is None or self.lock.acquire():
+                self.run_once()
+
+    def run_once(self):
+        with self.app.app_context():
+            try:
+                return self.fn(self.app)
+            except Exception:
+                self.app.logger.exception("Background task %s failed", self.name)
+            finally:
+                db.session.remove()
+
+    def stop(self):
+        self.stopped.set()
+
+
+def scheduled_tasks(app):
+    """(name, interval, fn) for every job enabled in the config."""
+    from archive import archive_finished_rides
+    from lifecycle import expire_stale_rides
+
+    tasks = []
+    if app.config['STALE_RIDES_INTERVAL'] > 0:
+        tasks.append(('stale-rides', app.config['STALE_RIDES_INTERVAL'], expire_stale_rides))
+    if app.config['ARCHIVE_INTERVAL'] > 0:
+        tasks.append(('archive', app.config['ARCHIVE_INTERVAL'], archive_finished_rides))
+    return tasks
+
+def start_background_tasks(app):
+    if app.extensions.get('background'):
+        return app.extensions['background']
+    path = app.config['BACKGROUND_LOCK']
+    lock = TaskLock(os.path.abspath(path)) if path else None
+    threads = [PeriodicTask(app, name, interval, fn, lock) for name, interval, fn in scheduled_tasks(app)]
+    for thread in threads:
+        thread.start()
+    app.extensions['background'] = threads
+    return threads
+
+def stop_background_tasks(app):
+    for thread in app.extensions.pop('background', []):
+        thread.stop()
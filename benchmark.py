@@ -0,0 +1,540 @@
+"""Load benchmark for every route registered in routes.py.
+
+    python benchmark.py --users 2000 --rides 20000 --participants 30000 --ratings 5000 \\
+        --mix search-heavy --mix join-burst --requests 5000 --concurrency 16 \\
+        --output results.json [--compare previous.json]
+
+A fresh SQLite database is seeded (seed.py), then each mix is replayed with a fixed
+RNG seed, either in-process through the Flask test client (default) or over HTTP
+against a server started with ``--serve wsgi|asgi|prefork`` (see loadtest.py). Throughput,
+p50/p95/p99 latency, status codes and SQL statements per request (from /metrics, by
+rule and method) are reported per operation and written to ``--output`` as JSON.
+``--hash-pool on|off`` overrides PASSWORD_HASH_POOL, e.g. to compare the login-storm
+mix both ways.
+"""
+import argparse
+import asyncio
+import datetime
+import http.client
+import json
+import os
+import platform
+import random
+import re
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from urllib.parse import urlencode, urlsplit
+
+from sqlalchemy import select
+
+from app_setup import create_app, db
+from models import RatingModel, RideModel, RideParticipantModel, RideStatus, UserModel
+from seed import CITIES, SEED_PASSWORD, USER_COLUMNS, insert_rows, next_id, seed, user_rows
+
+SAMPLE_SIZE = 10000
+HOT_RIDES = 20
+DISPOSABLE_USERS = 2000
+
+
+class Workload:
+    """Ids the request builders draw from, sampled from the seeded database. Pools of
+    rides in a given lifecycle state are consumed and refilled as requests succeed, so
+    start -> complete -> rate chains stay mostly valid under concurrency."""
+
+    def __init__(self, connection, now):
+        self.lock = threading.Lock()
+        self.counter = 0
+        self.now = now
+        users = connection.execute(
+            select(UserModel.id, UserModel.email).where(UserModel.username.like('user%')).limit(SAMPLE_SIZE)).all()
+        self.users = [id for id, _ in users]
+        self.emails = [email for _, email in users]
+        # (id, username, email) of users only ever patched or deleted
+        self.disposable = deque(connection.execute(
+            select(UserModel.id, UserModel.username, UserModel.email).where(UserModel.username.like('temp%'))).all())
+
+        planned = connection.execute(
+            select(RideModel.id, RideModel.driver_id, RideModel.start_city, RideModel.end_city,
+                   RideModel.departure_time, RideModel.from_lat, RideModel.from_lng,
+                   RideModel.to_lat, RideModel.to_lng)
+            .where(RideModel.status == RideStatus.PLANNED).limit(SAMPLE_SIZE)).all()
+        self.rides = [row.id for row in planned]
+        self.searches = [(row.start_city, row.end_city, row.departure_time.date()) for row in planned]
+        self.points = [(row.from_lat, row.from_lng, row.to_lat, row.to_lng) for row in planned]
+        self.hot = self.rides[:HOT_RIDES]
+        drivers = {row.id: row.driver_id for row in planned}
+
+        in_progress = dict(connection.execute(
+            select(RideModel.id, RideModel.driver_id)
+            .where(RideModel.status == RideStatus.IN_PROGRESS).limit(SAMPLE_SIZE)).all())
+        drivers.update(in_progress)
+        participants = defaultdict(list)
+        for ride_id, passenger_id in connection.execute(
+                select(RideParticipantModel.ride_id, RideParticipantModel.passenger_id)
+                .where(RideParticipantModel.ride_id.in_(self.rides[HOT_RIDES:] + list(in_progress)))):
+            participants[ride_id].append(passenger_id)
+
+        # (ride id, driver id, passenger ids); rides with passengers alternate between
+        # the start and cancel pools.
+        self.startable = deque((ride_id, drivers[ride_id], participants[ride_id])
+                               for ride_id in self.rides[HOT_RIDES::2] if ride_id in participants)
+        self.in_progress = deque((ride_id, driver, participants[ride_id]) for ride_id, driver in in_progress.items())
+        self.cancellable = deque((ride_id, drivers[ride_id]) for ride_id in self.rides[HOT_RIDES + 1::2])
+
+        rated = select(RatingModel.id).where(RatingModel.ride_id == RideParticipantModel.ride_id,
+                                             RatingModel.rater_id == RideParticipantModel.passenger_id)
+        self.rateable = deque(connection.execute(
+            select(RideModel.id, RideModel.driver_id, RideParticipantModel.passenger_id)
+            .join(RideParticipantModel, RideParticipantModel.ride_id == RideModel.id)
+            .where(RideModel.status == RideStatus.COMPLETED, ~rated.exists())
+            .limit(SAMPLE_SIZE)).all())
+        self.joined = deque()
+        self.created_rides = deque()
+
+    def unique(self):
+        with self.lock:
+            self.counter += 1
+            return self.counter
+
+    def pop(self, pool):
+        with self.lock:
+            return pool.popleft() if pool else None
+
+    def push(self, pool, item):
+        with self.lock:
+            pool.append(item)
+
+    def ride_payload(self, rng):
+        start, end = rng.sample(list(CITIES), 2)
+        departure = self.now + datetime.timedelta(days=rng.uniform(1, 30))
+        return dict(driver_id=rng.choice(self.users), from_address=f'{start}, ul. Nowa 1',
+                    from_lat=CITIES[start][0], from_lng=CITIES[start][1], to_address=f'{end}, ul. Nowa 2',
+                    to_lat=CITIES[end][0], to_lng=CITIES[end][1], start_city=start, end_city=end,
+                    departure_time=departure.replace(microsecond=0).isoformat(),
+                    price_per_seat=40, seats_available=4)
+
+
+# Request builders: (workload, rng) -> (method, path, json body, on_success) or None
+# when the pool they draw from is empty. on_success receives the decoded response.
+
+def users_list(w, rng):
+    return 'GET', '/api/users/?limit=50', None, None
+
+def users_create(w, rng):
+    n = w.unique()
+    return 'POST', '/api/users/', {'username': f'bench{n}', 'email': f'bench{n}@example.com',
+                                   'password': SEED_PASSWORD}, None
+
+def user_get(w, rng):
+    return 'GET', f'/api/users/{rng.choice(w.users)}', None, None
+
+def user_patch(w, rng):
+    user = w.pop(w.disposable)
+    if user is None:
+        return None
+    id, username, email = user
+    body = {'username': username, 'email': email, 'password': SEED_PASSWORD,
+            'university': f'University {rng.randint(1, 50)}'}
+    return 'PATCH', f'/api/users/{id}', body, lambda _: w.push(w.disposable, user)
+
+def user_delete(w, rng):
+    user = w.pop(w.disposable)
+    return None if user is None else ('DELETE', f'/api/users/{user[0]}', None, None)
+
+def register(w, rng):
+    n = w.unique()
+    return 'POST', '/api/register', {'username': f'new{n}', 'email': f'new{n}@example.com',
+                                     'password': SEED_PASSWORD}, None
+
+def login(w, rng):
+    return 'POST', '/api/login/', {'email': rng.choice(w.emails), 'password': SEED_PASSWORD}, None
+
+def rides_search(w, rng):
+    origin, destination, date = rng.choice(w.searches)
+    query = {'origin': origin, 'destination': destination, 'date': date.isoformat(), 'limit': 20}
+    for key in rng.sample(['destination', 'date'], rng.randint(0, 2)):
+        del query[key]
+    return 'GET', '/api/rides/?' + urlencode(query), None, None
+
+def rides_create(w, rng):
+    return 'POST', '/api/rides/', w.ride_payload(rng), lambda ride: w.push(w.created_rides, ride['id'])
+
+def rides_delete(w, rng):
+    id = w.pop(w.created_rides)
+    return None if id is None else ('DELETE', '/api/rides/', {'id': id}, None)
+
+def rides_nearby(w, rng):
+    from_lat, from_lng, to_lat, to_lng = rng.choice(w.points)
+    query = {'from_lat': from_lat, 'from_lng': from_lng, 'to_lat': to_lat, 'to_lng': to_lng,
+             'from_radius': 10, 'to_radius': 10, 'limit': 20}
+    return 'GET', '/api/rides/nearby?' + urlencode(query), None, None
+
+def rides_match(w, rng):
+    from_lat, from_lng, to_lat, to_lng = rng.choice(w.points)
+    date = rng.choice(w.searches)[2]
+    departure = datetime.datetime.combine(date, datetime.time(rng.randrange(24)))
+    query = {'from_lat': from_lat, 'from_lng': from_lng, 'to_lat': to_lat, 'to_lng': to_lng,
+             'departure_time': departure.isoformat(), 'window_hours': 6, 'limit': 20}
+    return 'GET', '/api/rides/match?' + urlencode(query), None, None
+
+def rides_bulk(w, rng):
+    return 'POST', '/api/rides/bulk', {'rides': [w.ride_payload(rng) for _ in range(10)]}, None
+
+def ride_join(w, rng):
+    ride_id, passenger = rng.choice(w.hot), rng.choice(w.users)
+    return ('POST', f'/api/rides/{ride_id}/join/', {'passenger_id': passenger},
+            lambda _: w.push(w.joined, (ride_id, passenger)))
+
+def ride_leave(w, rng):
+    pair = w.pop(w.joined)
+    if pair is None:
+        return None
+    ride_id, passenger = pair
+    return 'POST', f'/api/rides/{ride_id}/leave', {'passenger_id': passenger}, None
+
+def participants_all(w, rng):
+    return 'GET', '/api/participants/?limit=50', None, None
+
+def ride_participants(w, rng):
+    return 'GET', f'/api/rides/{rng.choice(w.rides)}/participants', None, None
+
+def ride_participants_bulk(w, rng):
+    ride_id = rng.choice(w.hot)
+    return 'POST', f'/api/rides/{ride_id}/participants/bulk', {'passenger_ids': rng.sample(w.users, 3)}, None
+
+def ride_start(w, rng):
+    ride = w.pop(w.startable)
+    if ride is None:
+        return None
+    ride_id, driver, passengers = ride
+    return ('PATCH', f'/api/rides/{ride_id}/start', {'driver_id': driver, 'participant_ids': passengers},
+            lambda _: w.push(w.in_progress, ride))
+
+def ride_complete(w, rng):
+    ride = w.pop(w.in_progress)
+    if ride is None:
+        return None
+    ride_id, driver, passengers = ride
+
+    def completed(_):
+        for passenger in passengers:
+            w.push(w.rateable, (ride_id, driver, passenger))
+    return 'PATCH', f'/api/rides/{ride_id}/complete', {'driver_id': driver}, completed
+
+def ride_cancel(w, rng):
+    ride = w.pop(w.cancellable)
+    if ride is None:
+        return None
+    ride_id, driver = ride
+    return 'PATCH', f'/api/rides/{ride_id}/cancel', {'driver_id': driver}, None
+
+def rate(w, rng):
+    triple = w.pop(w.rateable)
+    if triple is None:
+        return None
+    ride_id, driver, passenger = triple
+    return 'POST', '/api/ratings/', {'ride_id': ride_id, 'user_id': driver, 'rater_id': passenger,
+                                     'stars': rng.randint(1, 5)}, None
+
+def places_suggest(w, rng):
+    city = rng.choice(w.searches)[0]
+    return 'GET', '/api/places/suggest?' + urlencode({'q': city[:rng.randint(1, len(city))], 'limit': 8}), None, None
+
+def user_rides(w, rng):
+    return 'GET', f'/api/users/{rng.choice(w.users)}/rides?limit=20', None, None
+
+def user_stats(w, rng):
+    return 'GET', f'/api/users/{rng.choice(w.users)}/stats', None, None
+
+def user_ride_history(w, rng):
+    return 'GET', f'/api/users/{rng.choice(w.users)}/rides/history?limit=20', None, None
+
+def ride_participant_history(w, rng):
+    return 'GET', f'/api/rides/{rng.choice(w.rides)}/participants/history', None, None
+
+def cache_stats(w, rng):
+    return 'GET', '/api/cache/stats', None, None
+
+def home(w, rng):
+    return 'GET', '/', None, None
+
+
+# name: (Flask rule the request is routed to, builder)
+OPERATIONS = {
+    'users.list': ('/api/users/', users_list),
+    'users.create': ('/api/users/', users_create),
+    'user.get': ('/api/users/<int:id>', user_get),
+    'user.patch': ('/api/users/<int:id>', user_patch),
+    'user.delete': ('/api/users/<int:id>', user_delete),
+    'register': ('/api/register', register),
+    'login': ('/api/login/', login),
+    'rides.search': ('/api/rides/', rides_search),
+    'rides.create': ('/api/rides/', rides_create),
+    'rides.delete': ('/api/rides/', rides_delete),
+    'rides.nearby': ('/api/rides/nearby', rides_nearby),
+    'rides.match': ('/api/rides/match', rides_match),
+    'rides.bulk': ('/api/rides/bulk', rides_bulk),
+    'ride.join': ('/api/rides/<int:ride_id>/join/', ride_join),
+    'ride.leave': ('/api/rides/<int:ride_id>/leave', ride_leave),
+    'participants.all': ('/api/participants/', participants_all),
+    'ride.participants': ('/api/rides/<int:ride_id>/participants', ride_participants),
+    'ride.participants.bulk': ('/api/rides/<int:ride_id>/participants/bulk', ride_participants_bulk),
+    'ride.start': ('/api/rides/<int:ride_id>/start', ride_start),
+    'ride.complete': ('/api/rides/<int:ride_id>/complete', ride_complete),
+    'ride.cancel': ('/api/rides/<int:ride_id>/cancel', ride_cancel),
+    'ratings': ('/api/ratings/', rate),
+    'user.rides': ('/api/users/<int:id>/rides', user_rides),
+    'user.stats': ('/api/users/<int:id>/stats', user_stats),
+    'user.rides.history': ('/api/users/<int:id>/rides/history', user_ride_history),
+    'ride.participants.history': ('/api/rides/<int:ride_id>/participants/history', ride_participant_history),
+    'places.suggest': ('/api/places/suggest', places_suggest),
+    'cache.stats': ('/api/cache/stats', cache_stats),
+    'home': ('/', home),
+}
+
+MIXES = {
+    'search-heavy': {'rides.search': 50, 'places.suggest': 5, 'rides.nearby': 10, 'rides.match': 5,
+                     'user.rides': 10, 'ride.participants': 10, 'user.get': 5, 'ride.join': 3, 'rides.create': 2},
+    'join-burst': {'ride.join': 60, 'ride.leave': 20, 'ride.participants': 15, 'rides.search': 5},
+    # Password checks next to cheap reads: run with --hash-pool on and off.
+    'login-storm': {'login': 60, 'user.get': 20, 'rides.search': 20},
+    'rating-heavy': {'ratings': 50, 'ride.start': 10, 'ride.complete': 10, 'user.get': 15,
+                     'user.rides': 10, 'user.stats': 5, 'users.list': 5},
+    'full': {'users.list': 3, 'users.create': 1, 'user.get': 5, 'user.patch': 1, 'user.delete': 1,
+             'register': 1, 'login': 1, 'rides.search': 10, 'rides.create': 3, 'rides.delete': 1,
+             'rides.nearby': 3, 'rides.match': 2, 'rides.bulk': 1, 'ride.join': 5, 'ride.leave': 2, 'participants.all': 2,
+             'ride.participants': 5, 'ride.participants.bulk': 1, 'ride.start': 2, 'ride.complete': 2,
+             'ride.cancel': 1, 'ratings': 3, 'user.rides': 5, 'user.stats': 2, 'user.rides.history': 1,
+             'ride.participants.history': 1, 'places.suggest': 2, 'cache.stats': 1, 'home': 1},
+}
+
+
+class InProcessClient:
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def request(self, method, path, body=None):
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.app.test_client()
+        # Closing the response is what finishes its /metrics observation.
+        with self.local.client.open(path, method=method, json=body) as response:
+            return response.status_code, response.get_data()
+
+class HttpClient:
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.local = threading.local()
+
+    def request(self, method, path, body=None):
+        if not hasattr(self.local, 'connection'):
+            self.local.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        connection = self.local.connection
+        payload = json.dumps(body) if body is not None else None
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        try:
+            connection.request(method, path, payload, headers)
+            response = connection.getresponse()
+        except (http.client.HTTPException, OSError):
+            # The server closed a kept-alive connection; retry once on a new one.
+            connection.close()
+            connection.request(method, path, payload, headers)
+            response = connection.getresponse()
+        return response.status, response.read()
+
+
+METRIC_LINE = re.compile(r'db_queries_per_request_(sum|count)\{endpoint="([^"]*)",method="([^"]*)"\} (\S+)')
+
+def sql_counters(client):
+    """[statements, requests] per (rule, method) from /metrics."""
+    status, body = client.request('GET', '/metrics')
+    counters = defaultdict(lambda: [0.0, 0.0])
+    for kind, endpoint, method, value in METRIC_LINE.findall(body.decode()):
+        counters[endpoint, method][kind == 'count'] += float(value)
+    return counters
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+def run_mix(client, workload, mix, requests, concurrency, rng_seed):
+    names = list(MIXES[mix])
+    weights = [MIXES[mix][name] for name in names]
+    latencies = defaultdict(list)
+    statuses = defaultdict(Counter)
+    skipped = Counter()
+    methods = {}
+    before = sql_counters(client)
+
+    def worker(index, count):
+        rng = random.Random(rng_seed * 1000 + index)
+        for _ in range(count):
+            name = rng.choices(names, weights)[0]
+            built = OPERATIONS[name][1](workload, rng)
+            if built is None:
+                skipped[name] += 1
+                continue
+            method, path, body, on_success = built
+            methods[name] = method
+            started = time.perf_counter()
+            status, data = client.request(method, path, body)
+            latencies[name].append(time.perf_counter() - started)
+            statuses[name][status] += 1
+            if on_success is not None and status < 300:
+                on_success(json.loads(data) if data else None)
+
+    per_worker = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+    threads = [threading.Thread(target=worker, args=(i, n)) for i, n in enumerate(per_worker)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    after = sql_counters(client)
+    sql = {key: (after[key][0] - before[key][0]) / (after[key][1] - before[key][1])
+           for key in after if after[key][1] > before[key][1]}
+    # /metrics can only tell operations apart by rule and method; operations of the
+    # mix sharing both would get a blend of the two, so they get no figure.
+    series = {name: (OPERATIONS[name][0], method) for name, method in methods.items()}
+    sharing = Counter(series.values())
+
+    endpoints = {}
+    for name in names:
+        values = sorted(latencies[name])
+        rule = OPERATIONS[name][0]
+        key = series.get(name)
+        endpoints[name] = {
+            'rule': rule,
+            'method': key and key[1],
+            'requests': len(values),
+            'skipped': skipped[name],
+            'rps': round(len(values) / elapsed, 1),
+            'p50_ms': round(percentile(values, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(values, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(values, 0.99) * 1000, 2),
+            'status': {str(code): n for code, n in sorted(statuses[name].items())},
+            'sql_per_request': round(sql[key], 2) if key in sql and sharing[key] == 1 else None,
+        }
+    total = sum(len(v) for v in latencies.values())
+    return {'requests': total, 'duration_s': round(elapsed, 3), 'rps': round(total / elapsed, 1),
+            'endpoints': endpoints}
+
+
+def prepare_database(app, args):
+    with app.app_context():
+        db.create_all()
+        counts = seed(db.engine, args.users, args.rides, args.participants, args.ratings, args.seed)
+        now = datetime.datetime.utcnow()
+        with db.engine.begin() as connection:
+            insert_rows(connection, 'user_model', USER_COLUMNS,
+                        user_rows(next_id(connection, 'user_model'), DISPOSABLE_USERS, now, 'x', prefix='temp'))
+        with db.engine.connect() as connection:
+            workload = Workload(connection, now)
+    return counts, workload
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(previous, current):
+    for mix, result in current['mixes'].items():
+        old = previous.get('mixes', {}).get(mix)
+        if not old:
+            continue
+        print(f"{mix}: {old['rps']} -> {result['rps']} req/s")
+        for name, stats in result['endpoints'].items():
+            before = old['endpoints'].get(name)
+            if before and before['requests'] and stats['requests']:
+                print(f"  {name:24} p50 {before['p50_ms']:>8} -> {stats['p50_ms']:<8} "
+                      f"p99 {before['p99_ms']:>8} -> {stats['p99_ms']:<8} "
+                      f"sql {before['sql_per_request']} -> {stats['sql_per_request']}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--rides', type=int, default=20000)
+    parser.add_argument('--participants', type=int, default=30000)
+    parser.add_argument('--ratings', type=int, default=5000)
+    parser.add_argument('--mix', action='append', choices=sorted(MIXES), help="repeatable; default: all")
+    parser.add_argument('--requests', type=int, default=2000, help="requests per mix")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--serve', choices=('wsgi', 'asgi', 'prefork'), help="drive a real server instead of the test client")
+    parser.add_argument('--port', type=int, default=5056)
+    parser.add_argument('--hash-pool', choices=('on', 'off'),
+                        help="hash passwords in the process pool or inline (default: PASSWORD_HASH_POOL)")
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--compare', help="earlier --output file to compare against")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = 'sqlite:///' + os.path.join(directory, 'benchmark.db')
+        config = {'SQLALCHEMY_DATABASE_URI': database_url}
+        if args.hash_pool:
+            config['PASSWORD_HASH_POOL'] = args.hash_pool == 'on'
+            os.environ['PASSWORD_HASH_POOL'] = args.hash_pool
+        app = create_app(config)
+        started = time.perf_counter()
+        counts, workload = prepare_database(app, args)
+        print(f"Seeded {counts} in {time.perf_counter() - started:.1f}s", flush=True)
+
+        server = None
+        if args.serve:
+            from loadtest import start_server, wait_for_port
+
+            os.environ['DATABASE_URL'] = database_url
+            server = start_server(args.serve, args.port)
+            asyncio.run(wait_for_port(args.port))
+            client = HttpClient(f'http://127.0.0.1:{args.port}')
+        else:
+            client = InProcessClient(app)
+
+        results = {
+            'meta': {
+                'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'sqlite': sqlite3.sqlite_version,
+                'target': args.serve or 'in-process',
+                'requests': args.requests,
+                'concurrency': args.concurrency,
+                'hash_pool': app.config['PASSWORD_HASH_POOL'],
+                'seed': args.seed,
+                'dataset': counts,
+            },
+            'mixes': {},
+        }
+        try:
+            for mix in args.mix or list(MIXES):
+                result = run_mix(client, workload, mix, args.requests, args.concurrency, args.seed)
+                results['mixes'][mix] = result
+                print(f"{mix}: {result['rps']} req/s over {result['requests']} requests", flush=True)
+                for name, stats in result['endpoints'].items():
+                    print(f"  {name:24} n={stats['requests']:<6} p50={stats['p50_ms']:<8} "
+                          f"p95={stats['p95_ms']:<8} p99={stats['p99_ms']:<8} "
+                          f"sql={stats['sql_per_request']} {stats['status']}")
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+    return results
+
+
+if __name__ == '__main__':
+    main()
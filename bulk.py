@@ -0,0 +1,197 @@
+import datetime
+
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app_setup import db
+from etags import version_condition
+from geo import grid_cell, route_corridor
+from models import RideModel, RideParticipantModel, RideStatus, UserModel, departure_bucket, normalize_city
+from reservations import MODIFIED, ReservationError
+from search_cache import SearchCache, invalidate_ride_searches
+from stats import FINISHED, record_rides
+from transactions import retry_on_locked
+
+CHUNK_SIZE = 1000
+MAX_BATCH = 100000
+
+
+def ride_row(row, now):
+    # Bulk inserts bypass the ORM, so the columns normally filled by the RideModel
+    # listeners and defaults are computed here.
+    min_lat, max_lat, min_lng, max_lng = route_corridor(row['from_lat'], row['from_lng'],
+                                                        row['to_lat'], row['to_lng'])
+    return dict(
+        row,
+        start_city_norm=normalize_city(row['start_city']),
+        end_city_norm=normalize_city(row['end_city']),
+        from_cell=grid_cell(row['from_lat'], row['from_lng']),
+        to_cell=grid_cell(row['to_lat'], row['to_lng']),
+        corridor_min_lat=min_lat,
+        corridor_max_lat=max_lat,
+        corridor_min_lng=min_lng,
+        corridor_max_lng=max_lng,
+        departure_bucket=departure_bucket(row['departure_time']),
+        created_at=now,
+        version=1,
+    )
+
+def _insert_many(table, rows):
+    """executemany INSERT, returning the new primary keys in row order.
+
+    RETURNING with a guaranteed row order makes SQLAlchemy fall back to one statement
+    per row on SQLite. Once the INSERT runs, the transaction holds SQLite's write lock,
+    so the rows got consecutive rowids ending at last_insert_rowid()."""
+    db.session.execute(insert(table), rows)
+    last_id = db.session.execute(select(func.last_insert_rowid())).scalar()
+    return list(range(last_id - len(rows) + 1, last_id + 1))
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def create_rides(items, schema):
+    """Validate a batch of ride payloads against ``schema`` and insert the valid ones
+    in chunked executemany transactions. Returns (created ids, per-item errors)."""
+    errors = []
+    valid = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append({'index': index, 'errors': {'ride': 'Must be an object'}})
+            continue
+        row, item_errors = schema.validate(item)
+        if item_errors:
+            errors.append({'index': index, 'errors': item_errors})
+        else:
+            row['status'] = RideStatus(row['status'] or 'planned')
+            valid.append((index, row))
+
+    driver_ids = {row['driver_id'] for _, row in valid}
+    known = set()
+    for chunk in _chunks(list(driver_ids), CHUNK_SIZE):
+        known.update(db.session.execute(select(UserModel.id).where(UserModel.id.in_(chunk))).scalars())
+    for index, row in valid:
+        if row['driver_id'] not in known:
+            errors.append({'index': index, 'errors': {'driver_id': 'Driver not found'}})
+    valid = [(index, row) for index, row in valid if row['driver_id'] in known]
+
+    now = datetime.datetime.utcnow()
+    created = []
+    buckets = set()
+    for chunk in _chunks(valid, CHUNK_SIZE):
+        rows = [ride_row(row, now) for _, row in chunk]
+
+        def insert_chunk():
+            ids = _insert_many(RideModel.__table__, rows)
+            record_rides(db.session, [id for id, row in zip(ids, rows) if row['status'] in FINISHED])
+            db.session.commit()
+            return ids
+
+        created.extend(retry_on_locked(insert_chunk))
+        for row in rows:
+            buckets |= SearchCache.buckets_for(row['start_city'], row['end_city'], row['departure_time'])
+
+    invalidate_ride_searches(buckets)
+    errors.sort(key=lambda error: error['index'])
+    return created, errors
+
+
+def _load_ride(ride_id, versions):
+    ride = db.session.get(RideModel, ride_id)
+    if ride and versions is not None and ride.version not in versions:
+        raise ReservationError(MODIFIED, 412)
+    return ride
+
+def _reserve_many(ride_id, candidates, versions):
+    while True:
+        ride = _load_ride(ride_id, versions)
+        if not ride:
+            return None
+        if ride.status != RideStatus.PLANNED:
+            return [], [(index, 'Cannot join ride that is not in PLANNED status') for index, _ in candidates]
+
+        ids = [passenger_id for _, passenger_id in candidates]
+        users = set(db.session.execute(select(UserModel.id).where(UserModel.id.in_(ids))).scalars())
+        joined = set(db.session.execute(
+            select(RideParticipantModel.passenger_id)
+            .where(RideParticipantModel.ride_id == ride_id, RideParticipantModel.passenger_id.in_(ids))
+        ).scalars())
+
+        accepted, rejected = [], []
+        for index, passenger_id in candidates:
+            if passenger_id == ride.driver_id:
+                rejected.append((index, 'Driver cannot join'))
+            elif passenger_id not in users:
+                rejected.append((index, 'Passenger not found'))
+            elif passenger_id in joined:
+                rejected.append((index, 'Passenger already joined this ride'))
+            else:
+                accepted.append((index, passenger_id))
+
+        seats = max(ride.seats_available, 0)
+        rejected += [(index, 'No seats available') for index, _ in accepted[seats:]]
+        accepted = [passenger_id for _, passenger_id in accepted[:seats]]
+        if not accepted:
+            db.session.rollback()
+            return [], rejected
+
+        taken = db.session.execute(
+            update(RideModel)
+            .where(RideModel.id == ride_id,
+                   RideModel.status == RideStatus.PLANNED,
+                   RideModel.seats_available >= len(accepted),
+                   *version_condition(RideModel.version, versions))
+            .values(seats_available=RideModel.seats_available - len(accepted),
+                    version=RideModel.version + 1)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not taken:
+            # Seats, status or version changed since the ride was read; start over.
+            db.session.rollback()
+            continue
+
+        now = datetime.datetime.utcnow()
+        try:
+            created = _insert_many(
+                RideParticipantModel.__table__,
+                [{'ride_id': ride_id, 'passenger_id': passenger_id, 'joined_at': now} for passenger_id in accepted]
+            )
+        except IntegrityError:
+            # One of them joined on their own meanwhile; start over, reporting them as
+            # already joined.
+            db.session.rollback()
+            continue
+        buckets = SearchCache.ride_buckets(ride)
+        db.session.commit()
+        invalidate_ride_searches(buckets)
+        return created, rejected
+
+def add_participants(ride_id, passenger_ids, versions=None):
+    """Join many passengers to one ride. Seats for the whole batch are taken with one
+    conditional UPDATE (which, with If-Match ``versions``, also requires one of them);
+    passengers beyond the free seats are reported as errors. Returns None if the ride
+    does not exist, else (created ids, per-item errors); raises ReservationError (412)
+    once the ride is at none of ``versions``."""
+    errors = []
+    candidates = []
+    seen = set()
+    for index, passenger_id in enumerate(passenger_ids):
+        if isinstance(passenger_id, bool) or not isinstance(passenger_id, int):
+            errors.append({'index': index, 'errors': {'passenger_id': f'Invalid value: {passenger_id!r}'}})
+        elif passenger_id in seen:
+            errors.append({'index': index, 'errors': {'passenger_id': 'Duplicate passenger in batch'}})
+        else:
+            seen.add(passenger_id)
+            candidates.append((index, passenger_id))
+
+    if candidates:
+        outcome = retry_on_locked(_reserve_many, ride_id, candidates, versions)
+    else:
+        # Nothing valid to reserve, but a missing ride is still reported as missing.
+        outcome = ([], []) if _load_ride(ride_id, versions) is not None else None
+    if outcome is None:
+        return None
+    created, rejected = outcome
+    errors += [{'index': index, 'errors': {'passenger_id': message}} for index, message in rejected]
+    errors.sort(key=lambda error: error['index'])
+    return created, errors
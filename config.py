@@ -0,0 +1,104 @@
+import os
+
+
+def env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+def env_bool(name, default):
+    value = os.environ.get(name)
+    return value.lower() in ('1', 'true', 'yes', 'on') if value not in (None, '') else default
+
+
+# PRAGMAs applied to every new SQLite connection. 'tuned' lets readers proceed while
+# a writer commits (WAL), fsyncs only at checkpoints, maps the file into memory and
+# waits for a lock instead of failing with "database is locked" right away.
+SQLITE_PROFILES = {
+    'default': {},
+    'tuned': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'cache_size': -64000,  # KiB
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY',
+    },
+}
+
+
+class Config:
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///database.db')
+    SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'tuned')
+    # Overrides for single PRAGMAs of the profile, e.g. SQLITE_MMAP_SIZE=0.
+    SQLITE_PRAGMAS = {name: os.environ[f'SQLITE_{name.upper()}']
+                      for name in SQLITE_PROFILES['tuned'] if f'SQLITE_{name.upper()}' in os.environ}
+
+    # None leaves SQLAlchemy's default for the dialect (pool options are rejected by
+    # the single-connection pools used for in-memory SQLite).
+    DB_POOL_SIZE = env_int('DB_POOL_SIZE', None)
+    DB_MAX_OVERFLOW = env_int('DB_MAX_OVERFLOW', None)
+    DB_POOL_TIMEOUT = env_int('DB_POOL_TIMEOUT', None)
+    DB_POOL_RECYCLE = env_int('DB_POOL_RECYCLE', None)
+    DB_POOL_PRE_PING = env_bool('DB_POOL_PRE_PING', False)
+
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+    PASSWORD_HASH_SALT_LENGTH = env_int('PASSWORD_HASH_SALT_LENGTH', 16)
+    PASSWORD_HASH_POOL = env_bool('PASSWORD_HASH_POOL', True)
+    PASSWORD_HASH_WORKERS = env_int('PASSWORD_HASH_WORKERS', os.cpu_count() or 2)
+    PASSWORD_HASH_QUEUE_LIMIT = env_int('PASSWORD_HASH_QUEUE_LIMIT', 64)
+
+    # 'memory' (per process) or a redis:// URL shared by every worker.
+    SEARCH_CACHE_BACKEND = os.environ.get('SEARCH_CACHE_BACKEND', 'memory')
+    SEARCH_CACHE_TTL = env_int('SEARCH_CACHE_TTL', 30)
+    SEARCH_CACHE_MAX_ENTRIES = env_int('SEARCH_CACHE_MAX_ENTRIES', 1024)
+
+    # None: on in debug mode only.
+    N_PLUS_ONE_DETECTION = env_bool('N_PLUS_ONE_DETECTION', None)
+    N_PLUS_ONE_THRESHOLD = env_int('N_PLUS_ONE_THRESHOLD', 5)
+
+    # Finished rides older than ARCHIVE_AFTER_DAYS move to the archive tables every
+    # ARCHIVE_INTERVAL seconds (0 turns the background pass off).
+    ARCHIVE_AFTER_DAYS = env_int('ARCHIVE_AFTER_DAYS', 30)
+    ARCHIVE_INTERVAL = env_int('ARCHIVE_INTERVAL', 3600)
+    ARCHIVE_BATCH_SIZE = env_int('ARCHIVE_BATCH_SIZE', 500)
+    ARCHIVE_PAUSE = float(os.environ.get('ARCHIVE_PAUSE', 0.05))
+
+    # Overdue rides: PLANNED rides are cancelled STALE_CANCEL_AFTER_HOURS after their
+    # departure, IN_PROGRESS ones completed STALE_COMPLETE_AFTER_HOURS after it (0 turns
+    # a rule off), in a pass every STALE_RIDES_INTERVAL seconds (0 turns the pass off).
+    STALE_RIDES_INTERVAL = env_int('STALE_RIDES_INTERVAL', 300)
+    STALE_CANCEL_AFTER_HOURS = env_int('STALE_CANCEL_AFTER_HOURS', 2)
+    STALE_COMPLETE_AFTER_HOURS = env_int('STALE_COMPLETE_AFTER_HOURS', 24)
+    STALE_RIDES_BATCH_SIZE = env_int('STALE_RIDES_BATCH_SIZE', 100)
+    STALE_RIDES_PAUSE = float(os.environ.get('STALE_RIDES_PAUSE', 0.02))
+
+    # File whose lock decides which process runs the background jobs (None: every
+    # process that starts them runs them). serve.py sets one next to the database.
+    BACKGROUND_LOCK = os.environ.get('BACKGROUND_LOCK')
+
+    # Server-Sent Events: events buffered per subscriber before it is evicted as a slow
+    # consumer, open streams per process, rides per multi-ride stream, and seconds
+    # between keepalive comments on an idle stream.
+    EVENTS_QUEUE_SIZE = env_int('EVENTS_QUEUE_SIZE', 64)
+    EVENTS_MAX_SUBSCRIBERS = env_int('EVENTS_MAX_SUBSCRIBERS', 10000)
+    EVENTS_MAX_RIDES = env_int('EVENTS_MAX_RIDES', 100)
+    EVENTS_HEARTBEAT = env_int('EVENTS_HEARTBEAT', 15)
+
+
+def engine_options(config):
+    options = {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+    }
+    options = {key: value for key, value in options.items() if value is not None}
+    if config['DB_POOL_PRE_PING']:
+        options['pool_pre_ping'] = True
+    return options
+
+def sqlite_pragmas(config):
+    profile = config['SQLITE_PROFILE']
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f"Unknown SQLITE_PROFILE {profile!r}, expected one of {sorted(SQLITE_PROFILES)}")
+    return dict(SQLITE_PROFILES[profile], **config['SQLITE_PRAGMAS'])
@@ -1,6 +1,11 @@
-from app_setup import app, db 
+from app_setup import create_app, db
 from models import UserModel, RideModel, RideParticipantModel, RatingModel
+from migrations import upgrade
+
+app = create_app()
 
 with app.app_context():
     db.create_all()
-    print("Database tables created successfully!")
\ No newline at end of file
+    print("Database tables created successfully!")
+    version = upgrade(db.engine)
+    print(f"Database schema at version {version}")
\ No newline at end of file
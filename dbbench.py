@@ -0,0 +1,121 @@
+"""Read/write concurrency of the app under each SQLITE_PROFILE.
+
+    python dbbench.py --readers 8 --writers 2 --duration 5
+
+For every profile a fresh database is seeded, then reader threads page through
+users' rides and ride participants while writer threads create rides, all through
+the Flask test client. Prints requests/sec, p99 latency and failed requests per side.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+from sqlalchemy import insert
+
+from app_setup import create_app, db
+from config import SQLITE_PROFILES
+
+CITIES = ['Warszawa', 'Kraków', 'Gdańsk', 'Wrocław', 'Poznań', 'Łódź']
+
+
+def ride_payload(driver_id):
+    start, end = random.sample(CITIES, 2)
+    departure = datetime.datetime(2030, 1, 1) + datetime.timedelta(minutes=random.randrange(60 * 24 * 30))
+    return dict(driver_id=driver_id, from_address=f'{start} centrum', from_lat=52.0 + random.random(),
+                from_lng=19.0 + random.random(), to_address=f'{end} centrum', to_lat=51.0 + random.random(),
+                to_lng=18.0 + random.random(), departure_time=departure.isoformat(), price_per_seat=25,
+                seats_available=4, start_city=start, end_city=end)
+
+def seed(users, rides):
+    from api import ride_args
+    from bulk import create_rides
+    from models import UserModel
+
+    now = datetime.datetime.utcnow()
+    db.session.execute(insert(UserModel.__table__), [
+        dict(username=f'user{i}', email=f'user{i}@example.com', password_hash='x', average_rating=0.0,
+             rating_count=0, rating_sum=0, created_at=now, version=1)
+        for i in range(1, users + 1)
+    ])
+    db.session.commit()
+    create_rides([ride_payload(random.randint(1, users)) for _ in range(rides)], ride_args)
+
+def worker(app, stop, results, request):
+    client = app.test_client()
+    latencies = []
+    failed = 0
+    while not stop.is_set():
+        started = time.perf_counter()
+        response = request(client)
+        latencies.append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            failed += 1
+    results.append((latencies, failed))
+
+def summarize(results, duration):
+    latencies = sorted(l for latency, _ in results for l in latency)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] if latencies else 0.0
+    return {
+        'rps': round(len(latencies) / duration, 1),
+        'p99_ms': round(p99 * 1000, 2),
+        'failed': sum(failed for _, failed in results),
+    }
+
+def run(profile, args):
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(directory, 'bench.db'),
+            'SQLITE_PROFILE': profile,
+            'SQLITE_PRAGMAS': {},
+            'PASSWORD_HASH_POOL': False,
+        })
+        with app.app_context():
+            db.create_all()
+            seed(args.users, args.rides)
+
+        def read(client):
+            if random.random() < 0.5:
+                return client.get(f'/api/users/{random.randint(1, args.users)}/rides?limit=20')
+            return client.get(f'/api/rides/{random.randint(1, args.rides)}/participants')
+
+        def write(client):
+            return client.post('/api/rides/', json=ride_payload(random.randint(1, args.users)))
+
+        stop = threading.Event()
+        reads, writes = [], []
+        threads = [threading.Thread(target=worker, args=(app, stop, reads, read)) for _ in range(args.readers)]
+        threads += [threading.Thread(target=worker, args=(app, stop, writes, write)) for _ in range(args.writers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        with app.app_context():
+            db.engine.dispose()
+        return {'reads': summarize(reads, args.duration), 'writes': summarize(writes, args.duration)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--rides', type=int, default=20000)
+    parser.add_argument('--profile', action='append', choices=sorted(SQLITE_PROFILES))
+    args = parser.parse_args(argv)
+
+    results = {}
+    for profile in args.profile or sorted(SQLITE_PROFILES):
+        results[profile] = run(profile, args)
+        print(profile, json.dumps(results[profile]), flush=True)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+import hashlib
+
+from flask import Response, request
+from flask_restful import abort
+from werkzeug.http import quote_etag, unquote_etag
+
+
+# Ids are never reused (the tables use AUTOINCREMENT), so a tag names one row for good:
+# a row created after a delete cannot match a tag of the deleted one.
+def version_etag(kind, id, version):
+    return quote_etag(f'{kind}-{id}-v{version}')
+
+def digest_etag(kind, rows, query_string=None):
+    """Strong ETag for a collection, from the (id, version, ...) tuples of its members
+    and the query string (page, limit) of the request."""
+    digest = hashlib.sha1(repr(list(rows)).encode())
+    digest.update(request.query_string if query_string is None else query_string)
+    return quote_etag(f'{kind}-{digest.hexdigest()}')
+
+def conditional_get(etag_factory):
+    """Return ``(etag, response)``. ``response`` is a ready 304 when the client's
+    If-None-Match already names the current ETag; the caller renders the full
+    representation otherwise. Without If-None-Match no ETag is computed up front."""
+    if not request.if_none_match:
+        return None, None
+    etag = etag_factory()
+    if etag is not None and request.if_none_match.contains(unquote_etag(etag)[0]):
+        return etag, Response(status=304, headers={'ETag': etag})
+    return etag, None
+
+def if_match_versions(kind, id):
+    """The versions of ``kind`` ``id`` the request's If-Match accepts, for the write to
+    put in its WHERE clause; None without If-Match (or with ``*``). Aborts with 412
+    when none of the tags names this row."""
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    prefix = f'{kind}-{id}-v'
+    versions = {int(tag[len(prefix):]) for tag in request.if_match.as_set()
+                if tag.startswith(prefix) and tag[len(prefix):].isdigit()}
+    if not versions:
+        precondition_failed()
+    return versions
+
+def version_condition(column, versions):
+    """The WHERE clauses (none or one) making a write conditional on If-Match."""
+    return () if versions is None else (column.in_(versions),)
+
+def check_version(version, versions):
+    if versions is not None and version not in versions:
+        precondition_failed()
+
+def precondition_failed():
+    abort(412, message="Resource has been modified")
@@ -0,0 +1,177 @@
+"""Ride lifecycle events pushed to clients as Server-Sent Events.
+
+The lifecycle endpoints publish join/leave/start/complete/cancel to an in-process hub
+after their transaction commits. Every subscriber owns a bounded queue; when an event
+finds it full the subscriber is evicted instead of blocking the publisher or growing
+without limit - its stream ends with an ``evicted`` event and the client reconnects,
+starting again from a fresh ``snapshot``. Only subscribers of the same process are
+reached, so with several workers a client sees the events of the worker it is
+connected to.
+
+Subscribers are woken through a callback, so the same hub serves the blocking Flask
+streams and the async ones in asgi.py (where an idle connection is one coroutine and
+an empty deque).
+"""
+import json
+import threading
+from collections import defaultdict, deque
+from itertools import count
+
+from flask import current_app
+from sqlalchemy import select
+
+from app_setup import db
+from models import RideModel
+
+
+class HubFull(Exception):
+    pass
+
+
+class Subscription:
+    __slots__ = ('ride_ids', 'queue', 'wakeup', 'evicted')
+
+    def __init__(self, ride_ids, wakeup):
+        self.ride_ids = ride_ids
+        self.queue = deque()
+        self.wakeup = wakeup
+        self.evicted = False
+
+    def drain(self):
+        queue = self.queue
+        while queue:
+            yield queue.popleft()
+
+
+class EventHub:
+    def __init__(self, queue_size=64, max_subscribers=10000):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.lock = threading.Lock()
+        self.by_ride = defaultdict(set)
+        self.subscribers = 0
+        self.ids = count(1)
+        self.published = 0
+        self.evictions = 0
+
+    def subscribe(self, ride_ids, wakeup):
+        subscription = Subscription(tuple(ride_ids), wakeup)
+        with self.lock:
+            if self.subscribers >= self.max_subscribers:
+                raise HubFull(f"Too many event subscribers (limit {self.max_subscribers})")
+            for ride_id in subscription.ride_ids:
+                self.by_ride[ride_id].add(subscription)
+            self.subscribers += 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self._remove(subscription)
+
+    def _remove(self, subscription):
+        removed = False
+        for ride_id in subscription.ride_ids:
+            subscribers = self.by_ride.get(ride_id)
+            if subscribers and subscription in subscribers:
+                subscribers.discard(subscription)
+                removed = True
+                if not subscribers:
+                    del self.by_ride[ride_id]
+        if removed:
+            self.subscribers -= 1
+
+    def watching(self, ride_id):
+        return ride_id in self.by_ride
+
+    def publish(self, ride_id, event, data):
+        wakeups = []
+        with self.lock:
+            message = (next(self.ids), event, data)
+            self.published += 1
+            for subscription in list(self.by_ride.get(ride_id, ())):
+                if len(subscription.queue) >= self.queue_size:
+                    subscription.evicted = True
+                    self._remove(subscription)
+                    self.evictions += 1
+                else:
+                    subscription.queue.append(message)
+                wakeups.append(subscription.wakeup)
+        for wakeup in wakeups:
+            wakeup()
+
+    def stats(self):
+        with self.lock:
+            return {'subscribers': self.subscribers, 'rides': len(self.by_ride),
+                    'published': self.published, 'evictions': self.evictions}
+
+
+def init_event_hub(app):
+    app.extensions['event_hub'] = EventHub(app.config['EVENTS_QUEUE_SIZE'], app.config['EVENTS_MAX_SUBSCRIBERS'])
+
+def event_hub():
+    return current_app.extensions['event_hub']
+
+
+def format_event(id, event, data):
+    lines = f'id: {id}\n' if id is not None else ''
+    return f'{lines}event: {event}\ndata: {json.dumps(data)}\n\n'
+
+KEEPALIVE = ': keepalive\n\n'
+RETRY = 'retry: 3000\n\n'
+EVICTED = format_event(None, 'evicted', {'reason': 'slow consumer'})
+
+def ride_state_query(ride_ids):
+    return (select(RideModel.id, RideModel.status, RideModel.seats_available, RideModel.version)
+            .where(RideModel.id.in_(ride_ids))
+            .order_by(RideModel.id))
+
+def ride_state(row):
+    return {'ride_id': row.id, 'status': row.status.value, 'seats_available': row.seats_available,
+            'version': row.version}
+
+def parse_ride_ids(value, max_rides):
+    try:
+        ride_ids = sorted({int(part) for part in (value or '').split(',') if part.strip()})
+    except ValueError:
+        raise ValueError("ids must be a comma-separated list of ride ids")
+    if not 0 < len(ride_ids) <= max_rides:
+        raise ValueError(f"ids must name between 1 and {max_rides} rides")
+    return ride_ids
+
+def publish_ride_event(ride_id, event, **data):
+    """Publish ``event`` with the ride's committed state. Costs nothing when nobody
+    watches the ride."""
+    hub = event_hub()
+    if not hub.watching(ride_id):
+        return
+    row = db.session.execute(ride_state_query([ride_id])).first()
+    if row is not None:
+        hub.publish(ride_id, event, dict(ride_state(row), **data))
+
+
+class EventStream:
+    """Blocking SSE body for the WSGI app (one thread per connection). Subscribes on
+    creation, before the caller reads the snapshot, so no event falls in between;
+    werkzeug calls close() when the response ends, started or not."""
+
+    def __init__(self, hub, ride_ids, heartbeat):
+        self.hub = hub
+        self.heartbeat = heartbeat
+        self.ready = threading.Event()
+        self.subscription = hub.subscribe(ride_ids, self.ready.set)
+        self.snapshots = []
+
+    def __iter__(self):
+        subscription, ready = self.subscription, self.ready
+        yield RETRY + ''.join(format_event(None, 'snapshot', state) for state in self.snapshots)
+        while True:
+            ready.wait(self.heartbeat)
+            ready.clear()
+            chunk = ''.join(format_event(*message) for message in subscription.drain())
+            if subscription.evicted:
+                yield chunk + EVICTED
+                return
+            yield chunk or KEEPALIVE
+
+    def close(self):
+        self.hub.unsubscribe(self.subscription)
@@ -0,0 +1,86 @@
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+
+# Rides are bucketed into a fixed lat/lng grid; a cell is stored as a single integer
+# so that "which cells does this circle touch" becomes an indexed IN (...) lookup.
+CELL_DEG = 0.1
+LAT_CELLS = int(round(180 / CELL_DEG))
+LNG_CELLS = int(round(360 / CELL_DEG))
+
+
+def _lat_index(lat):
+    return min(max(int(math.floor((lat + 90) / CELL_DEG)), 0), LAT_CELLS - 1)
+
+def _lng_index(lng):
+    return int(math.floor((lng + 180) / CELL_DEG)) % LNG_CELLS
+
+def grid_cell(lat, lng):
+    if lat is None or lng is None:
+        return None
+    return _lat_index(lat) * LNG_CELLS + _lng_index(lng)
+
+def cells_in_radius(lat, lng, radius_km):
+    dlat = radius_km / KM_PER_DEGREE
+    cos_lat = math.cos(math.radians(min(abs(lat) + dlat, 90.0)))
+    dlng = radius_km / (KM_PER_DEGREE * cos_lat) if cos_lat > 1e-9 else 180.0
+
+    lat_range = range(_lat_index(lat - dlat), _lat_index(lat + dlat) + 1)
+    if dlng >= 180.0:
+        lng_range = range(LNG_CELLS)
+    else:
+        first = _lng_index(lng - dlng)
+        count = (_lng_index(lng + dlng) - first) % LNG_CELLS + 1
+        lng_range = [(first + i) % LNG_CELLS for i in range(count)]
+    return [i * LNG_CELLS + j for i in lat_range for j in lng_range]
+
+def haversine_km(lat, lng, lats, lngs):
+    """Distances from one point to every point of the lats/lngs columns, in km."""
+    lat1 = math.radians(lat)
+    cos_lat1 = math.cos(lat1)
+    sin, cos, asin, sqrt, radians = math.sin, math.cos, math.asin, math.sqrt, math.radians
+    distances = []
+    for lat2, lng2 in zip(lats, lngs):
+        lat2 = radians(lat2)
+        a = sin((lat2 - lat1) / 2) ** 2 + cos_lat1 * cos(lat2) * sin(radians(lng2 - lng) / 2) ** 2
+        distances.append(2 * EARTH_RADIUS_KM * asin(min(1.0, sqrt(a))))
+    return distances
+
+# Largest detour (km) a corridor search can ask for. Every ride stores the bounding
+# box of the ellipse with its endpoints as foci and CORRIDOR_DETOUR_KM of slack: a
+# pickup or drop-off outside that box costs the driver more than this to serve.
+# Changing it requires recomputing the corridor columns.
+CORRIDOR_DETOUR_KM = 30.0
+
+def route_corridor(from_lat, from_lng, to_lat, to_lng, detour_km=CORRIDOR_DETOUR_KM):
+    """(min_lat, max_lat, min_lng, max_lng) of the detour ellipse of a route. Computed
+    in a local flat projection, with a small margin for the difference to haversine."""
+    if None in (from_lat, from_lng, to_lat, to_lng):
+        return None, None, None, None
+    length = haversine_km(from_lat, from_lng, [to_lat], [to_lng])[0]
+    a = (length + detour_km) / 2 * 1.02
+    b = math.sqrt(max(a * a - (length / 2) ** 2, 0.0))
+
+    center_lat = (from_lat + to_lat) / 2
+    x = (to_lng - from_lng) * KM_PER_DEGREE * math.cos(math.radians(center_lat))
+    y = (to_lat - from_lat) * KM_PER_DEGREE
+    theta = math.atan2(y, x)
+    half_x = math.hypot(a * math.cos(theta), b * math.sin(theta))
+    half_y = math.hypot(a * math.sin(theta), b * math.cos(theta))
+
+    dlat = half_y / KM_PER_DEGREE
+    cos_lat = math.cos(math.radians(min(abs(center_lat) + dlat, 89.0)))
+    dlng = half_x / (KM_PER_DEGREE * cos_lat)
+    center_lng = (from_lng + to_lng) / 2
+    return center_lat - dlat, center_lat + dlat, center_lng - dlng, center_lng + dlng
+
+def haversine_pairs_km(lats1, lngs1, lats2, lngs2):
+    """Distances between the points of two coordinate columns, row by row, in km."""
+    sin, cos, asin, sqrt, radians = math.sin, math.cos, math.asin, math.sqrt, math.radians
+    distances = []
+    for lat1, lng1, lat2, lng2 in zip(lats1, lngs1, lats2, lngs2):
+        lat1, lat2 = radians(lat1), radians(lat2)
+        a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin(radians(lng2 - lng1) / 2) ** 2
+        distances.append(2 * EARTH_RADIUS_KM * asin(min(1.0, sqrt(a))))
+    return distances
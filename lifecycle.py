@@ -0,0 +1,151 @@
+"""Ride status transitions as set-based statements, and the stale-ride pass.
+
+A transition is one conditional UPDATE (the status it starts from is part of the
+WHERE clause, so a concurrent change makes it match nothing instead of being
+overwritten) plus at most one DELETE for the participants; no rows are loaded.
+Finishing rides also updates their users' stats in the same transaction.
+
+The stale-ride pass cancels PLANNED rides that never started and completes
+IN_PROGRESS rides that were never closed, STALE_CANCEL_AFTER_HOURS and
+STALE_COMPLETE_AFTER_HOURS after their departure. Candidates are read without a
+write lock; each batch of at most STALE_RIDES_BATCH_SIZE rides is then one short
+write transaction, so a seat reservation waits for one batch at worst.
+"""
+import datetime
+import time
+
+from sqlalchemy import delete, select, update
+
+from app_setup import db
+from etags import version_condition
+from events import publish_ride_event
+from models import RideModel, RideParticipantModel, RideStatus
+from search_cache import SearchCache, invalidate_ride_searches
+from stats import FINISHED, record_rides
+from transactions import retry_on_locked
+
+CANCELLABLE = (RideStatus.PLANNED, RideStatus.IN_PROGRESS)
+
+
+def transition(ride_ids, from_statuses, to_status, drop_participants=False, versions=None):
+    """Move the rides of ``ride_ids`` still in one of ``from_statuses`` (and, with
+    If-Match ``versions``, at one of them) to ``to_status``, optionally deleting their
+    participants, and count the rides it finishes in user_stats. Does not commit.
+    Returns (ids of the rides moved, participants deleted)."""
+    moved = db.session.execute(
+        update(RideModel)
+        .where(RideModel.id.in_(ride_ids), RideModel.status.in_(from_statuses),
+               *version_condition(RideModel.version, versions))
+        .values(status=to_status, version=RideModel.version + 1)
+        .returning(RideModel.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    if to_status in FINISHED:
+        record_rides(db.session, moved)
+    removed = 0
+    if drop_participants and moved:
+        removed = db.session.execute(
+            delete(RideParticipantModel)
+            .where(RideParticipantModel.ride_id.in_(moved))
+            .execution_options(synchronize_session=False)
+        ).rowcount
+    return moved, removed
+
+def start_ride(ride_id, confirmed_ids, versions=None):
+    """Start a PLANNED ride with ``confirmed_ids`` on board: the other participants
+    are removed and their seats given back. Commits. Returns the number removed, or
+    None when the ride was no longer PLANNED (or at one of ``versions``)."""
+    removed = db.session.execute(
+        delete(RideParticipantModel)
+        .where(RideParticipantModel.ride_id == ride_id,
+               RideParticipantModel.passenger_id.not_in(confirmed_ids))
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    started = db.session.execute(
+        update(RideModel)
+        .where(RideModel.id == ride_id, RideModel.status == RideStatus.PLANNED,
+               *version_condition(RideModel.version, versions))
+        .values(status=RideStatus.IN_PROGRESS, seats_available=RideModel.seats_available + removed,
+                version=RideModel.version + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not started:
+        db.session.rollback()
+        return None
+    db.session.commit()
+    return removed
+
+def complete_ride(ride_id, versions=None):
+    """IN_PROGRESS -> COMPLETED. Commits. Returns False when the ride was not in
+    progress (or at one of ``versions``) any more."""
+    completed, _ = transition([ride_id], (RideStatus.IN_PROGRESS,), RideStatus.COMPLETED, versions=versions)
+    if not completed:
+        db.session.rollback()
+        return False
+    db.session.commit()
+    return True
+
+def cancel_ride(ride_id, versions=None):
+    """PLANNED or IN_PROGRESS -> CANCELLED, dropping the participants. Commits.
+    Returns the number of participants removed, or None when the ride could no longer
+    be cancelled (or was not at one of ``versions``)."""
+    cancelled, removed = transition([ride_id], CANCELLABLE, RideStatus.CANCELLED, drop_participants=True,
+                                    versions=versions)
+    if not cancelled:
+        db.session.rollback()
+        return None
+    db.session.commit()
+    return removed
+
+
+# (status, setting with the hours after departure, new status, drop participants, event)
+STALE_RULES = (
+    (RideStatus.PLANNED, 'STALE_CANCEL_AFTER_HOURS', RideStatus.CANCELLED, True, 'cancel'),
+    (RideStatus.IN_PROGRESS, 'STALE_COMPLETE_AFTER_HOURS', RideStatus.COMPLETED, False, 'complete'),
+)
+
+def expire_batch(status, cutoff, to_status, drop_participants, batch_size):
+    """Apply one rule to at most ``batch_size`` rides. Returns (rides looked at, rides
+    moved)."""
+    rides = db.session.execute(
+        select(RideModel.id, RideModel.start_city, RideModel.end_city, RideModel.departure_time)
+        .where(RideModel.status == status, RideModel.departure_time < cutoff)
+        .limit(batch_size)
+    ).all()
+    if not rides:
+        return [], []
+    moved, _ = transition([ride.id for ride in rides], (status,), to_status, drop_participants)
+    db.session.commit()
+    return rides, set(moved)
+
+def expire_stale_rides(app):
+    """One pass of every enabled STALE_RULES rule with the app's settings. Returns
+    the number of rides moved per new status."""
+    config = app.config
+    now = datetime.datetime.utcnow()
+    moved_total = {}
+    for status, setting, to_status, drop_participants, event in STALE_RULES:
+        hours = config[setting]
+        if not hours:
+            continue
+        cutoff = now - datetime.timedelta(hours=hours)
+        count = 0
+        while True:
+            rides, moved = retry_on_locked(expire_batch, status, cutoff, to_status, drop_participants,
+                                           config['STALE_RIDES_BATCH_SIZE'])
+            if not rides:
+                break
+            buckets = set()
+            for ride in rides:
+                if ride.id in moved:
+                    buckets |= SearchCache.buckets_for(ride.start_city, ride.end_city, ride.departure_time)
+            invalidate_ride_searches(buckets)
+            for ride_id in moved:
+                publish_ride_event(ride_id, event, automatic=True)
+            count += len(moved)
+            if config['STALE_RIDES_PAUSE']:
+                time.sleep(config['STALE_RIDES_PAUSE'])
+        if count:
+            app.logger.info("Moved %d overdue %s rides to %s", count, status.value, to_status.value)
+        moved_total[to_status.value] = count
+    return moved_total
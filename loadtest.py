@@ -0,0 +1,132 @@
+"""Compare the sync WSGI app (run.py's threaded Werkzeug server) with the ASGI entry
+point (asgi.py under uvicorn, or pre-forked by serve.py) on the read-heavy endpoints.
+
+    python loadtest.py --concurrency 200 --duration 10
+
+Both servers run against the current database, one after the other, and are hit
+with the same request mix; requests/sec and latency percentiles are printed per server.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+SERVERS = {
+    'wsgi': [sys.executable, '-c',
+             'import logging; logging.getLogger("werkzeug").setLevel(logging.ERROR)\n'
+             'from run import app; app.run(port={port}, threaded=True)'],
+    'asgi': [sys.executable, '-m', 'uvicorn', 'asgi:app', '--port', '{port}',
+             '--log-level', 'warning', '--no-access-log'],
+    # asgi.py in WEB_CONCURRENCY (default: one per CPU) workers forked by serve.py.
+    'prefork': [sys.executable, 'serve.py', '--bind', '127.0.0.1:{port}'],
+}
+
+DEFAULT_PATHS = [
+    '/api/rides/?limit=20',
+    '/api/users/{user}/rides?limit=20',
+    '/api/rides/{ride}/participants',
+]
+
+
+def start_server(kind, port):
+    command = [part.format(port=port) for part in SERVERS[kind]]
+    return subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+async def wait_for_port(port, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f'server on port {port} did not start')
+
+async def get(port, path):
+    """One GET on a fresh connection; returns the status code."""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nConnection: close\r\n\r\n'.encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return int(response[9:12])
+
+async def drive(port, paths, concurrency, duration):
+    """Keep ``concurrency`` clients busy for ``duration`` seconds; returns the latency
+    (seconds) of every request and the number of failed ones."""
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + duration
+
+    async def client():
+        nonlocal errors
+        while time.monotonic() < deadline:
+            path = random.choice(paths)
+            started = time.perf_counter()
+            try:
+                status = await get(port, path)
+            except OSError:
+                status = None
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                errors += 1
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, errors
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+def summarize(latencies, errors, duration):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / duration, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+async def run(kind, port, paths, concurrency, duration, warmup=1.0):
+    server = start_server(kind, port)
+    try:
+        await wait_for_port(port)
+        await drive(port, paths, min(concurrency, 10), warmup)
+        latencies, errors = await drive(port, paths, concurrency, duration)
+        return summarize(latencies, errors, duration)
+    finally:
+        server.terminate()
+        server.wait()
+
+def expand(paths, users, rides):
+    return [p.format(user=u, ride=r) for p in paths for u, r in zip(users, rides)]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--users', type=int, default=50, help="user ids 1..N to spread requests over")
+    parser.add_argument('--rides', type=int, default=50, help="ride ids 1..N to spread requests over")
+    parser.add_argument('--path', action='append', help="request path (repeatable), may use {user} and {ride}")
+    parser.add_argument('--servers', default='wsgi,asgi')
+    args = parser.parse_args(argv)
+
+    users = [random.randint(1, args.users) for _ in range(100)]
+    rides = [random.randint(1, args.rides) for _ in range(100)]
+    paths = expand(args.path or DEFAULT_PATHS, users, rides)
+
+    results = {}
+    for kind in args.servers.split(','):
+        results[kind] = asyncio.run(run(kind, args.port, paths, args.concurrency, args.duration))
+        print(kind, json.dumps(results[kind]), flush=True)
+    return results
+
+
+if __name__ == '__main__':
+    main()
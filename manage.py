@@ -0,0 +1,128 @@
+import argparse
+import sys
+import time
+
+from app_setup import create_app, db
+import models
+from archive import archive_cutoff, archive_rides, search_latency, table_sizes
+from lifecycle import expire_stale_rides
+from places import rebuild_places
+from migrations import MIGRATIONS, current_version, upgrade
+from ratings import check_rating_aggregates, rebuild_rating_aggregates
+from seed import seed
+from stats import rebuild_user_stats
+
+
+def migrate(args):
+    db.create_all()
+    if args.status:
+        with db.engine.connect() as connection:
+            version = current_version(connection)
+        print(f"Schema at version {version}")
+        for number, name, _ in MIGRATIONS:
+            print(f"  {number:>3} {'applied' if number <= version else 'pending'}  {name}")
+        return
+    version = upgrade(db.engine)
+    print(f"Schema at version {version}")
+
+def seed_data(args):
+    started = time.perf_counter()
+    written = seed(db.engine, args.users, args.rides, args.participants, args.ratings, args.seed, log=print)
+    print(f"Seeded {written} in {time.perf_counter() - started:.1f}s")
+
+
+def rebuild_ratings(args):
+    with db.engine.begin() as connection:
+        users = rebuild_rating_aggregates(connection)
+    print(f"Rebuilt rating counters ({users} rated users)")
+
+def check_ratings(args):
+    mismatches = 0
+    with db.engine.connect() as connection:
+        for user_id, stored, expected in check_rating_aggregates(connection):
+            mismatches += 1
+            if mismatches <= args.show:
+                print(f"user {user_id}: stored count/sum/avg {stored}, expected {expected}")
+    print(f"{mismatches} user(s) with inconsistent rating counters")
+    return 1 if mismatches else 0
+
+
+def archive(args):
+    days = args.older_than_days if args.older_than_days is not None else db.get_app().config['ARCHIVE_AFTER_DAYS']
+    before = dict(table_sizes(), **search_latency(args.samples))
+    started = time.perf_counter()
+    moved = archive_rides(archive_cutoff(days), args.batch_size, pause=args.pause,
+                          log=print if args.verbose else None)
+    elapsed = time.perf_counter() - started
+    db.session.remove()
+    after = dict(table_sizes(), **search_latency(args.samples))
+    print(f"Archived {moved} rides older than {days} days in {elapsed:.1f}s")
+    print(f"{'':<26}{'before':>12}{'after':>12}")
+    for key in before:
+        print(f"{key:<26}{before[key]!s:>12}{after[key]!s:>12}")
+
+def rebuild_place_index(args):
+    with db.engine.begin() as connection:
+        places = rebuild_places(connection)
+    print(f"Rebuilt place suggestions ({places} places)")
+
+def rebuild_stats(args):
+    started = time.perf_counter()
+    with db.engine.begin() as connection:
+        users = rebuild_user_stats(connection)
+    print(f"Rebuilt ride statistics ({users} users) in {time.perf_counter() - started:.1f}s")
+
+def expire_rides(args):
+    started = time.perf_counter()
+    moved = expire_stale_rides(db.get_app())
+    print(f"Expired overdue rides {moved} in {time.perf_counter() - started:.1f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintenance commands for the ride sharing database")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    migrate_parser = commands.add_parser('migrate', help="Create missing tables and apply pending schema migrations")
+    migrate_parser.add_argument('--status', action='store_true', help="Only list applied and pending migrations")
+    migrate_parser.set_defaults(func=migrate)
+
+    seed_parser = commands.add_parser('seed', help="Bulk-insert synthetic users, rides, participants and ratings")
+    seed_parser.add_argument('--users', type=int, default=10000)
+    seed_parser.add_argument('--rides', type=int, default=100000)
+    seed_parser.add_argument('--participants', type=int, default=150000)
+    seed_parser.add_argument('--ratings', type=int, default=10000)
+    seed_parser.add_argument('--seed', type=int, default=0, help="RNG seed")
+    seed_parser.set_defaults(func=seed_data)
+
+    commands.add_parser('rebuild-ratings', help="Recompute rating counters from rating_model") \
+        .set_defaults(func=rebuild_ratings)
+
+    check = commands.add_parser('check-ratings', help="Report users whose rating counters are out of date")
+    check.add_argument('--show', type=int, default=20, help="Print at most this many mismatches")
+    check.set_defaults(func=check_ratings)
+
+    archive_parser = commands.add_parser('archive', help="Move old finished rides into the archive tables "
+                                                         "and report table sizes and search latency")
+    archive_parser.add_argument('--older-than-days', type=int, default=None,
+                                help="Defaults to ARCHIVE_AFTER_DAYS")
+    archive_parser.add_argument('--batch-size', type=int, default=500)
+    archive_parser.add_argument('--pause', type=float, default=0.0, help="Seconds to sleep between batches")
+    archive_parser.add_argument('--samples', type=int, default=200, help="Queries per latency measurement")
+    archive_parser.add_argument('--verbose', action='store_true')
+    archive_parser.set_defaults(func=archive)
+
+    commands.add_parser('rebuild-places', help="Recount places and rebuild the suggestion index") \
+        .set_defaults(func=rebuild_place_index)
+
+    commands.add_parser('rebuild-stats', help="Recompute user_stats from the live and archived rides") \
+        .set_defaults(func=rebuild_stats)
+
+    commands.add_parser('expire-rides', help="Cancel or complete overdue rides now (STALE_* settings)") \
+        .set_defaults(func=expire_rides)
+
+    args = parser.parse_args(argv)
+    with create_app().app_context():
+        return args.func(args) or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""Corridor matching: planned rides a passenger can be picked up and dropped off by
+on the way, ranked by the cost of doing so.
+
+The database narrows the rides down with the precomputed route corridors (both the
+pickup and the drop-off must lie in the ride's detour box) and hour buckets of the
+departure time, nearest hours first and capped at MAX_CANDIDATES. The candidates are
+then scored column-wise in one pass and only the best ``limit`` are kept, so the work
+per request is bounded however many rides fall into the window.
+"""
+import datetime
+import heapq
+
+from sqlalchemy import func
+
+from geo import CORRIDOR_DETOUR_KM, haversine_km, haversine_pairs_km
+from models import RideModel, RideStatus, UserModel, departure_bucket
+
+MAX_CANDIDATES = 5000
+MAX_WINDOW_HOURS = 24
+AVERAGE_SPEED_KMH = 70.0
+
+# Score = cost in "detour km": one hour between the wanted and the actual pickup time
+# weighs like 20 km of detour, 1 unit of price like 0.5 km, one star of the driver's
+# average rating takes 5 km off. Unrated drivers count as NEUTRAL_RATING.
+SLACK_KM_PER_HOUR = 20.0
+PRICE_KM_PER_UNIT = 0.5
+RATING_KM_PER_STAR = 5.0
+NEUTRAL_RATING = 3.0
+
+
+def corridor_conditions(pickup, dropoff, departure, window_hours, seats):
+    """WHERE conditions for planned rides with ``seats`` free seats, departing within
+    ``window_hours`` of ``departure`` (rounded out to whole buckets), whose corridor
+    contains both points. There is deliberately no departure_time range: with one,
+    SQLite prefers ix_ride_status_departure over the corridor index."""
+    first = departure_bucket(departure - datetime.timedelta(hours=window_hours))
+    last = departure_bucket(departure + datetime.timedelta(hours=window_hours))
+    conditions = [
+        RideModel.status == RideStatus.PLANNED,
+        RideModel.departure_bucket.in_(range(first, last + 1)),
+        RideModel.seats_available >= seats,
+    ]
+    for lat, lng in (pickup, dropoff):
+        conditions += [
+            RideModel.corridor_min_lat <= lat, RideModel.corridor_max_lat >= lat,
+            RideModel.corridor_min_lng <= lng, RideModel.corridor_max_lng >= lng,
+        ]
+    return conditions
+
+def candidate_order(departure):
+    # Nearest departure hours first, so the MAX_CANDIDATES cap drops the least
+    # punctual rides.
+    return func.abs(RideModel.departure_bucket - departure_bucket(departure)), RideModel.id
+
+def rating_column():
+    return func.coalesce(func.nullif(UserModel.average_rating, 0.0), NEUTRAL_RATING)
+
+
+def rank_rides(rows, columns, pickup, dropoff, departure, max_detour_km=CORRIDOR_DETOUR_KM, limit=20):
+    """Score candidate ``rows`` (tuples; ``columns`` maps 'from_lat', 'from_lng',
+    'to_lat', 'to_lng', 'departure_time', 'price_per_seat' and 'rating' to positions)
+    and return the best ``limit`` as (score, detour_km, pickup_time, row), best first.
+    Rides that would need a detour over ``max_detour_km`` are dropped."""
+    if not rows:
+        return []
+    column = lambda name: [row[columns[name]] for row in rows]
+    from_lats, from_lngs = column('from_lat'), column('from_lng')
+    to_lats, to_lngs = column('to_lat'), column('to_lng')
+
+    # Driver route A -> B becomes A -> pickup -> drop-off -> B.
+    to_pickup = haversine_km(pickup[0], pickup[1], from_lats, from_lngs)
+    from_dropoff = haversine_km(dropoff[0], dropoff[1], to_lats, to_lngs)
+    direct = haversine_pairs_km(from_lats, from_lngs, to_lats, to_lngs)
+    trip = haversine_km(pickup[0], pickup[1], [dropoff[0]], [dropoff[1]])[0]
+
+    scored = []
+    for index, (departure_time, price, rating) in enumerate(zip(
+            column('departure_time'), column('price_per_seat'), column('rating'))):
+        detour = max(to_pickup[index] + trip + from_dropoff[index] - direct[index], 0.0)
+        if detour > max_detour_km:
+            continue
+        pickup_time = departure_time + datetime.timedelta(hours=to_pickup[index] / AVERAGE_SPEED_KMH)
+        slack_hours = abs((pickup_time - departure).total_seconds()) / 3600
+        score = (detour + SLACK_KM_PER_HOUR * slack_hours + PRICE_KM_PER_UNIT * price
+                 - RATING_KM_PER_STAR * rating)
+        scored.append((score, index, detour, pickup_time))
+
+    best = heapq.nsmallest(limit, scored)
+    return [(score, detour, pickup_time, rows[index]) for score, index, detour, pickup_time in best]
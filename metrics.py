@@ -0,0 +1,255 @@
+"""Per-request instrumentation exposed in the Prometheus text format on ``/metrics``.
+
+Each request gets a RequestStats in a context variable until its response is closed;
+SQLAlchemy cursor events add every statement's count and time to it, so the Flask
+views (streamed bodies included) and the async handlers in asgi.py are measured the
+same way. Outside a request the events only do a lookup.
+"""
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+
+from flask import Response, current_app, request
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+_current = ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    __slots__ = ('started', 'queries', 'db_time', 'shapes')
+
+    def __init__(self, track_shapes):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.shapes = Counter() if track_shapes else None
+
+def begin_request(track_shapes=False):
+    return _current.set(RequestStats(track_shapes))
+
+def end_request(token):
+    stats = _current.get()
+    _current.reset(token)
+    return stats
+
+
+def instrument_engine(engine):
+    """Count statements and their time into the current request's RequestStats
+    (a sync Engine, or the ``sync_engine`` of an AsyncEngine)."""
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is not None:
+            conn.info['query_started'] = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        stats = _current.get()
+        started = conn.info.pop('query_started', None)
+        if stats is None or started is None:
+            return
+        stats.queries += 1
+        stats.db_time += time.perf_counter() - started
+        if stats.shapes is not None:
+            # Parameters are bound, so the statement text is the query's shape.
+            stats.shapes[statement] += 1
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            yield f'{name}_bucket', dict(labels, le=le), cumulative
+        yield f'{name}_sum', labels, self.sum
+        yield f'{name}_count', labels, self.count
+
+
+class Metrics:
+    def __init__(self, n_plus_one_threshold=5, logger=None):
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.queries = defaultdict(lambda: Histogram(QUERY_BUCKETS))
+        self.db_time = Counter()
+        self.n_plus_one = Counter()
+
+    def observe(self, endpoint, method, status, stats):
+        duration = time.perf_counter() - stats.started
+        repeated = self.check_n_plus_one(endpoint, method, stats)
+        with self.lock:
+            self.requests[endpoint, method, str(status)] += 1
+            self.latency[endpoint, method].observe(duration)
+            self.queries[endpoint, method].observe(stats.queries)
+            self.db_time[endpoint, method] += stats.db_time
+            if repeated:
+                self.n_plus_one[endpoint, method] += 1
+
+    def check_n_plus_one(self, endpoint, method, stats):
+        if not stats.shapes:
+            return False
+        statement, count = stats.shapes.most_common(1)[0]
+        if count < self.n_plus_one_threshold:
+            return False
+        if self.logger is not None:
+            self.logger.warning("Possible N+1: %s %s ran the same query %d times: %s",
+                                method, endpoint, count, ' '.join(statement.split())[:200])
+        return True
+
+    def render(self, extra=()):
+        """The registry (plus ``extra`` (name, type, help, samples) families) as
+        Prometheus text exposition format 0.0.4."""
+        with self.lock:
+            families = [
+                ('http_requests_total', 'counter', "Requests by endpoint, method and status",
+                 [('http_requests_total', dict(endpoint=e, method=m, status=s), n)
+                  for (e, m, s), n in sorted(self.requests.items())]),
+                ('http_request_duration_seconds', 'histogram', "Request latency by endpoint and method",
+                 [sample for (e, m), h in sorted(self.latency.items())
+                  for sample in h.samples('http_request_duration_seconds', dict(endpoint=e, method=m))]),
+                ('db_queries_per_request', 'histogram', "SQL statements per request by endpoint and method",
+                 [sample for (e, m), h in sorted(self.queries.items())
+                  for sample in h.samples('db_queries_per_request', dict(endpoint=e, method=m))]),
+                ('db_time_seconds_total', 'counter', "Time spent executing SQL by endpoint and method",
+                 [('db_time_seconds_total', dict(endpoint=e, method=m), t)
+                  for (e, m), t in sorted(self.db_time.items())]),
+                ('n_plus_one_requests_total', 'counter', "Requests that repeated one query shape",
+                 [('n_plus_one_requests_total', dict(endpoint=e, method=m), n)
+                  for (e, m), n in sorted(self.n_plus_one.items())]),
+            ]
+        lines = []
+        for name, kind, help, samples in families + list(extra):
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for sample, labels, value in samples:
+                lines.append(f'{sample}{format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in labels.values())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + '}'
+
+def search_cache_families():
+    from search_cache import search_cache
+
+    stats = search_cache().stats()
+    return [
+        ('search_cache_hits_total', 'counter', "Ride search cache hits",
+         [('search_cache_hits_total', {}, stats['hits'])]),
+        ('search_cache_misses_total', 'counter', "Ride search cache misses",
+         [('search_cache_misses_total', {}, stats['misses'])]),
+    ]
+
+def event_hub_families():
+    from events import event_hub
+
+    stats = event_hub().stats()
+    return [
+        ('sse_subscribers', 'gauge', "Open event streams",
+         [('sse_subscribers', {}, stats['subscribers'])]),
+        ('sse_events_published_total', 'counter', "Ride events published",
+         [('sse_events_published_total', {}, stats['published'])]),
+        ('sse_evictions_total', 'counter', "Event streams dropped as slow consumers",
+         [('sse_evictions_total', {}, stats['evictions'])]),
+    ]
+
+
+MEMORY_FIELDS = {'Rss': 'rss', 'Pss': 'pss', 'Private_Clean': 'private', 'Private_Dirty': 'private'}
+
+def process_memory():
+    """Resident, proportional (shared pages split between their users) and private
+    memory of this process in bytes; {} where /proc/self/smaps_rollup is missing."""
+    try:
+        with open('/proc/self/smaps_rollup') as file:
+            lines = file.readlines()
+    except OSError:
+        return {}
+    memory = dict.fromkeys(MEMORY_FIELDS.values(), 0)
+    for line in lines:
+        name, _, value = line.partition(':')
+        if name in MEMORY_FIELDS:
+            memory[MEMORY_FIELDS[name]] += int(value.split()[0]) * 1024
+    return memory
+
+def process_families():
+    memory = process_memory()
+    return [
+        (f'process_{name}_memory_bytes', 'gauge', help, [(f'process_{name}_memory_bytes', {}, memory[key])])
+        for name, key, help in (('resident', 'rss', "Resident memory of the serving process"),
+                                ('proportional', 'pss', "Resident memory with shared pages split between processes"),
+                                ('private', 'private', "Memory of the serving process shared with no other"))
+        if key in memory
+    ]
+
+
+def n_plus_one_detection(app):
+    """N+1 detection follows debug mode unless N_PLUS_ONE_DETECTION says otherwise
+    (decided per request, since ``app.run(debug=True)`` sets debug after create_app)."""
+    enabled = app.config['N_PLUS_ONE_DETECTION']
+    return app.debug if enabled is None else enabled
+
+def init_metrics(app, engine):
+    """Record every request of ``app`` and serve the registry on ``/metrics``."""
+    metrics = Metrics(app.config['N_PLUS_ONE_THRESHOLD'], app.logger)
+    app.extensions['metrics'] = metrics
+    instrument_engine(engine)
+
+    def finisher(status):
+        # Takes the request's token, so each request is observed once.
+        token = request.environ.pop('metrics.token', None)
+        if token is None:
+            return None
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        method = request.method
+        return lambda: metrics.observe(endpoint, method, status, end_request(token))
+
+    @app.before_request
+    def start_timer():
+        request.environ['metrics.token'] = begin_request(n_plus_one_detection(app))
+
+    @app.after_request
+    def record(response):
+        finish = finisher(response.status_code)
+        if finish is not None:
+            # Observed when the server closes the response, after the body is sent, so
+            # the statements a streamed body runs count towards the request too.
+            response.call_on_close(finish)
+        return response
+
+    @app.teardown_request
+    def record_error(error):
+        # Only reached with the token still set when the view raised past Flask's
+        # error handlers.
+        finish = finisher(500)
+        if finish is not None:
+            finish()
+
+    def metrics_view():
+        body = current_app.extensions['metrics'].render(search_cache_families() + event_hub_families()
+                                                        + process_families())
+        return Response(body, mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+    return metrics
@@ -0,0 +1,240 @@
+import datetime
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateTable
+
+from geo import grid_cell, route_corridor
+from models import (ArchivedRatingModel, ArchivedRideModel, ArchivedRideParticipantModel, PlaceModel,
+                    RatingModel, RideModel, RideParticipantModel, UserModel, UserStatsModel, departure_bucket,
+                    normalize_city)
+from places import install_place_index, rebuild_places
+from ratings import rebuild_rating_aggregates
+from stats import rebuild_user_stats
+
+# Schema changes for databases created before a model change. The applied version is
+# kept in SQLite's PRAGMA user_version; every migration is idempotent so that a fresh
+# database built by db.create_all() can be stamped by running them all.
+MIGRATIONS = []
+
+def migration(version, name):
+    def register(fn):
+        MIGRATIONS.append((version, name, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+def current_version(connection):
+    return connection.exec_driver_sql('PRAGMA user_version').scalar()
+
+def upgrade(engine, log=print):
+    with engine.begin() as connection:
+        version = current_version(connection)
+
+    for number, name, fn in MIGRATIONS:
+        if number <= version:
+            continue
+        with engine.begin() as connection:
+            fn(connection)
+            connection.exec_driver_sql(f'PRAGMA user_version = {number}')
+        log(f"Applied migration {number}: {name}")
+        version = number
+    return version
+
+def add_column(connection, table, column, ddl):
+    columns = {c['name'] for c in inspect(connection).get_columns(table)}
+    if column not in columns:
+        connection.exec_driver_sql(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}')
+
+def backfill(connection, select_sql, update_sql, convert, batch_size=5000):
+    last_id = 0
+    while True:
+        rows = connection.execute(text(select_sql), {'last_id': last_id, 'limit': batch_size}).all()
+        if not rows:
+            break
+        connection.execute(text(update_sql), [convert(row) for row in rows])
+        last_id = rows[-1][0]
+
+def rebuild_with_autoincrement(connection, model):
+    """Recreate the table of ``model`` from its current definition (which declares
+    sqlite_autoincrement), keeping its rows, indexes and triggers. No-op when the
+    table already uses AUTOINCREMENT."""
+    table = model.__tablename__
+    schema = connection.exec_driver_sql(
+        "SELECT type, sql FROM sqlite_master WHERE tbl_name = ? AND sql IS NOT NULL", (table,)).all()
+    if any(kind == 'table' and 'AUTOINCREMENT' in sql.upper() for kind, sql in schema):
+        return
+    # SQLite's usual recipe: copy into a new table, drop the old one, rename. The app
+    # never turns foreign_keys on, so the DROP does not cascade into the child tables.
+    create = str(CreateTable(model.__table__).compile(dialect=connection.dialect))
+    connection.exec_driver_sql(create.replace(f'CREATE TABLE {table} ', f'CREATE TABLE {table}_rebuild ', 1))
+    columns = ', '.join(column.name for column in model.__table__.columns)
+    connection.exec_driver_sql(f'INSERT INTO {table}_rebuild ({columns}) SELECT {columns} FROM {table}')
+    connection.exec_driver_sql(f'DROP TABLE {table}')
+    connection.exec_driver_sql(f'ALTER TABLE {table}_rebuild RENAME TO {table}')
+    for kind, sql in schema:
+        if kind in ('index', 'trigger'):
+            connection.exec_driver_sql(sql)
+
+def reserve_ids(connection, table, *others):
+    # The next AUTOINCREMENT id of ``table`` goes past every id in ``others`` too.
+    highest = max(connection.exec_driver_sql(f'SELECT coalesce(max(id), 0) FROM {name}').scalar()
+                  for name in (table,) + others)
+    connection.exec_driver_sql('DELETE FROM sqlite_sequence WHERE name = ?', (table,))
+    connection.exec_driver_sql('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (table, highest))
+    return highest
+
+
+@migration(1, 'normalized city columns and ride search index')
+def normalized_city_columns(connection):
+    add_column(connection, 'ride_model', 'start_city_norm', 'VARCHAR(100)')
+    add_column(connection, 'ride_model', 'end_city_norm', 'VARCHAR(100)')
+    # casefold() is done in Python: SQLite's lower() only folds ASCII letters.
+    backfill(
+        connection,
+        'SELECT id, start_city, end_city FROM ride_model WHERE id > :last_id ORDER BY id LIMIT :limit',
+        'UPDATE ride_model SET start_city_norm = :start, end_city_norm = :end WHERE id = :id',
+        lambda row: {'id': row[0], 'start': normalize_city(row[1]), 'end': normalize_city(row[2])},
+    )
+    connection.exec_driver_sql(
+        'CREATE INDEX IF NOT EXISTS ix_ride_search '
+        'ON ride_model (start_city_norm, end_city_norm, departure_time, status)'
+    )
+
+
+@migration(2, 'grid cell columns for nearby search')
+def grid_cell_columns(connection):
+    add_column(connection, 'ride_model', 'from_cell', 'INTEGER')
+    add_column(connection, 'ride_model', 'to_cell', 'INTEGER')
+    backfill(
+        connection,
+        'SELECT id, from_lat, from_lng, to_lat, to_lng FROM ride_model '
+        'WHERE id > :last_id ORDER BY id LIMIT :limit',
+        'UPDATE ride_model SET from_cell = :from_cell, to_cell = :to_cell WHERE id = :id',
+        lambda row: {'id': row[0], 'from_cell': grid_cell(row[1], row[2]), 'to_cell': grid_cell(row[3], row[4])},
+    )
+    connection.exec_driver_sql(
+        'CREATE INDEX IF NOT EXISTS ix_ride_from_cell ON ride_model (from_cell, status, departure_time)'
+    )
+
+
+@migration(3, 'rating counters on user_model')
+def rating_counters(connection):
+    add_column(connection, 'user_model', 'rating_count', "INTEGER NOT NULL DEFAULT '0'")
+    add_column(connection, 'user_model', 'rating_sum', "INTEGER NOT NULL DEFAULT '0'")
+    rebuild_rating_aggregates(connection)
+
+
+@migration(4, 'row versions for ETags')
+def row_versions(connection):
+    add_column(connection, 'user_model', 'version', "INTEGER NOT NULL DEFAULT '1'")
+    add_column(connection, 'ride_model', 'version', "INTEGER NOT NULL DEFAULT '1'")
+
+
+@migration(5, 'indexes on foreign keys')
+def foreign_key_indexes(connection):
+    for table, column in (('ride_model', 'driver_id'), ('ride_participant_model', 'passenger_id'),
+                          ('rating_model', 'ride_id'), ('rating_model', 'rater_id')):
+        connection.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS ix_{table}_{column} ON {table} ({column})')
+
+
+@migration(6, 'archive tables for finished rides')
+def archive_tables(connection):
+    for model in (ArchivedRideModel, ArchivedRideParticipantModel, ArchivedRatingModel):
+        model.__table__.create(connection, checkfirst=True)
+    connection.exec_driver_sql(
+        'CREATE INDEX IF NOT EXISTS ix_ride_status_departure ON ride_model (status, departure_time)'
+    )
+
+
+@migration(7, 'route corridors and departure buckets for corridor matching')
+def corridor_columns(connection):
+    for column in ('corridor_min_lat', 'corridor_max_lat', 'corridor_min_lng', 'corridor_max_lng'):
+        add_column(connection, 'ride_model', column, 'FLOAT')
+    add_column(connection, 'ride_model', 'departure_bucket', 'INTEGER')
+
+    def convert(row):
+        min_lat, max_lat, min_lng, max_lng = route_corridor(row[1], row[2], row[3], row[4])
+        departure = row[5] if isinstance(row[5], datetime.datetime) else datetime.datetime.fromisoformat(row[5])
+        return {'id': row[0], 'min_lat': min_lat, 'max_lat': max_lat, 'min_lng': min_lng, 'max_lng': max_lng,
+                'bucket': departure_bucket(departure)}
+
+    backfill(
+        connection,
+        'SELECT id, from_lat, from_lng, to_lat, to_lng, departure_time FROM ride_model '
+        'WHERE id > :last_id ORDER BY id LIMIT :limit',
+        'UPDATE ride_model SET corridor_min_lat = :min_lat, corridor_max_lat = :max_lat, '
+        'corridor_min_lng = :min_lng, corridor_max_lng = :max_lng, departure_bucket = :bucket WHERE id = :id',
+        convert,
+    )
+    connection.exec_driver_sql(
+        'CREATE INDEX IF NOT EXISTS ix_ride_corridor ON ride_model (status, departure_bucket, corridor_min_lat)'
+    )
+
+
+@migration(8, 'place table and full-text index for address suggestions')
+def place_index(connection):
+    PlaceModel.__table__.create(connection, checkfirst=True)
+    install_place_index(connection)
+    rebuild_places(connection)
+
+
+@migration(9, 'per-user ride statistics')
+def user_stats_table(connection):
+    UserStatsModel.__table__.create(connection, checkfirst=True)
+    rebuild_user_stats(connection)
+
+
+# (live table, archive table, (table, column) pairs referencing the live id)
+ARCHIVED_IDS = (
+    ('ride_model', 'ride_archive', (('ride_participant_model', 'ride_id'), ('rating_model', 'ride_id'))),
+    ('ride_participant_model', 'ride_participant_archive', ()),
+    ('rating_model', 'rating_archive', ()),
+)
+
+@migration(10, 'never reuse ride, participant and rating ids')
+def autoincrement_ids(connection):
+    for model in (RideModel, RideParticipantModel, RatingModel):
+        rebuild_with_autoincrement(connection, model)
+    for table, archive, references in ARCHIVED_IDS:
+        # Rows that already got the id of an archived row move to fresh ids, or the
+        # archive pass would fail on them for good.
+        next_id = reserve_ids(connection, table, archive)
+        reused = connection.exec_driver_sql(
+            f'SELECT id FROM {table} WHERE id IN (SELECT id FROM {archive}) ORDER BY id').scalars().all()
+        for old in reused:
+            next_id += 1
+            connection.exec_driver_sql(f'UPDATE {table} SET id = ? WHERE id = ?', (next_id, old))
+            for child, column in references:
+                connection.exec_driver_sql(f'UPDATE {child} SET {column} = ? WHERE {column} = ?', (next_id, old))
+        reserve_ids(connection, table, archive)
+
+
+@migration(11, 'never reuse user ids')
+def autoincrement_user_ids(connection):
+    rebuild_with_autoincrement(connection, UserModel)
+    reserve_ids(connection, 'user_model')
+
+
+@migration(12, 'ride search indexes for one city or a date alone')
+def search_order_indexes(connection):
+    # ix_ride_search loses its trailing status column, which no search filters on and
+    # which kept SQLite from reading origin + destination matches in (departure_time, id)
+    # order.
+    sql = connection.exec_driver_sql("SELECT sql FROM sqlite_master WHERE name = 'ix_ride_search'").scalar()
+    if sql and 'status' in sql:
+        connection.exec_driver_sql('DROP INDEX ix_ride_search')
+    for name, columns in (('ix_ride_search', 'start_city_norm, end_city_norm, departure_time'),
+                          ('ix_ride_origin_departure', 'start_city_norm, departure_time'),
+                          ('ix_ride_destination_departure', 'end_city_norm, departure_time'),
+                          ('ix_ride_departure', 'departure_time')):
+        connection.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS {name} ON ride_model ({columns})')
+
+
+@migration(13, 'drop-off cell in the nearby search index')
+def nearby_index_to_cell(connection):
+    sql = connection.exec_driver_sql("SELECT sql FROM sqlite_master WHERE name = 'ix_ride_from_cell'").scalar()
+    if sql and 'to_cell' not in sql:
+        connection.exec_driver_sql('DROP INDEX ix_ride_from_cell')
+    connection.exec_driver_sql(
+        'CREATE INDEX IF NOT EXISTS ix_ride_from_cell ON ride_model (from_cell, status, departure_time, to_cell)'
+    )
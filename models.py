@@ -1,6 +1,8 @@
 import datetime
 import enum
+from sqlalchemy import event
 from app_setup import db
+from geo import grid_cell, route_corridor
 from werkzeug.security import generate_password_hash, check_password_hash
 
 class RideStatus(enum.Enum):
@@ -10,21 +12,60 @@ class RideStatus(enum.Enum):
     CANCELLED = 'cancelled'
 
 class UserModel(db.Model): 
+    __table_args__ = {'sqlite_autoincrement': True}
+
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(80), unique=True, nullable=False)
-    password_hash = db.Column(db.String(80), nullable=False)
+    password_hash = db.Column(db.String(255), nullable=False)
     student_id = db.Column(db.String(80), nullable=True)
     university = db.Column(db.String(80), nullable=True)
     average_rating = db.Column(db.Float, default=0.0)
+    rating_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    # The row version behind ETags. ORM writes bump it and only match the version they
+    # loaded (StaleDataError otherwise); bulk UPDATE statements increment it themselves.
+    __mapper_args__ = {'version_id_col': version}
 
     def __repr__(self): 
         return f"User(username = {self.username}, email = {self.email})"
 
+def normalize_city(city):
+    if city is None:
+        return None
+    return ' '.join(city.split()).casefold()
+
+DEPARTURE_BUCKET = datetime.timedelta(hours=1)
+EPOCH = datetime.datetime(1970, 1, 1)
+
+def departure_bucket(departure_time):
+    if departure_time is None:
+        return None
+    return (departure_time - EPOCH) // DEPARTURE_BUCKET
+
 class RideModel(db.Model):
+    __table_args__ = (
+        db.Index('ix_ride_search', 'start_city_norm', 'end_city_norm', 'departure_time'),
+        # Searches by one city or by date alone, read in (departure_time, id) order.
+        db.Index('ix_ride_origin_departure', 'start_city_norm', 'departure_time'),
+        db.Index('ix_ride_destination_departure', 'end_city_norm', 'departure_time'),
+        db.Index('ix_ride_departure', 'departure_time'),
+        # to_cell last: nearby searches reject rides with the wrong drop-off cell in the
+        # index, before reading the row.
+        db.Index('ix_ride_from_cell', 'from_cell', 'status', 'departure_time', 'to_cell'),
+        db.Index('ix_ride_status_departure', 'status', 'departure_time'),
+        # Equality on the hour bucket (an IN list) lets the index also range-scan the
+        # corridor latitude, which a departure_time range in its place would not.
+        db.Index('ix_ride_corridor', 'status', 'departure_bucket', 'corridor_min_lat'),
+        # Ids are never handed out again, not even after the ride is archived or deleted.
+        {'sqlite_autoincrement': True},
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    driver_id = db.Column(db.Integer, db.ForeignKey('user_model.id', ondelete='CASCADE'), nullable=False)
+    driver_id = db.Column(db.Integer, db.ForeignKey('user_model.id', ondelete='CASCADE'), nullable=False, index=True)
     from_address = db.Column(db.Text, nullable=False)
     from_lat = db.Column(db.Float, nullable=False)
     from_lng = db.Column(db.Float, nullable=False)
@@ -33,39 +74,152 @@ class RideModel(db.Model):
     to_lng = db.Column(db.Float, nullable=False)
     start_city = db.Column(db.String(100), nullable=True)
     end_city = db.Column(db.String(100), nullable=True)
+    start_city_norm = db.Column(db.String(100), nullable=True)
+    end_city_norm = db.Column(db.String(100), nullable=True)
+    from_cell = db.Column(db.Integer, nullable=True)
+    to_cell = db.Column(db.Integer, nullable=True)
+    corridor_min_lat = db.Column(db.Float, nullable=True)
+    corridor_max_lat = db.Column(db.Float, nullable=True)
+    corridor_min_lng = db.Column(db.Float, nullable=True)
+    corridor_max_lng = db.Column(db.Float, nullable=True)
     departure_time = db.Column(db.DateTime, nullable=False)
+    departure_bucket = db.Column(db.Integer, nullable=True)
     price_per_seat = db.Column(db.Float, nullable=False)
     seats_available = db.Column(db.Integer, nullable=False)
     status = db.Column(db.Enum(RideStatus, by_name=False), default=RideStatus.PLANNED) #dodałem to by_name
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    __mapper_args__ = {'version_id_col': version}
+
+    driver = db.relationship('UserModel')
+
+    @property
+    def driver_name(self):
+        return self.driver.username if self.driver else None
 
     def __repr__(self):
         return f"Ride(id = {self.id}, driver_id = {self.driver_id}, from = {self.from_address}, to = {self.to_address}, status = {self.status})"
 
+@event.listens_for(RideModel, 'before_insert')
+@event.listens_for(RideModel, 'before_update')
+def fill_ride_search_columns(mapper, connection, ride):
+    ride.start_city_norm = normalize_city(ride.start_city)
+    ride.end_city_norm = normalize_city(ride.end_city)
+    ride.from_cell = grid_cell(ride.from_lat, ride.from_lng)
+    ride.to_cell = grid_cell(ride.to_lat, ride.to_lng)
+    (ride.corridor_min_lat, ride.corridor_max_lat,
+     ride.corridor_min_lng, ride.corridor_max_lng) = route_corridor(ride.from_lat, ride.from_lng,
+                                                                    ride.to_lat, ride.to_lng)
+    ride.departure_bucket = departure_bucket(ride.departure_time)
+
 class RideParticipantModel(db.Model):
-    __table_args__ = (db.UniqueConstraint('ride_id', 'passenger_id', name='unique_ride_passenger'),)
+    __table_args__ = (
+        db.UniqueConstraint('ride_id', 'passenger_id', name='unique_ride_passenger'),
+        {'sqlite_autoincrement': True},
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     ride_id = db.Column(db.Integer, db.ForeignKey('ride_model.id', ondelete='CASCADE'), nullable=False)
-    passenger_id = db.Column(db.Integer, db.ForeignKey('user_model.id', ondelete='CASCADE'), nullable=False)
+    passenger_id = db.Column(db.Integer, db.ForeignKey('user_model.id', ondelete='CASCADE'), nullable=False, index=True)
     joined_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
 
+    passenger = db.relationship('UserModel')
+
+    @property
+    def passenger_username(self):
+        return self.passenger.username if self.passenger else None
+
     def __repr__(self):
         return f"RideParticipant(id = {self.id}, ride_id = {self.ride_id}, passenger_id = {self.passenger_id})"
 
+# ride_participant_model.ride_id and rating_model.user_id need no index of their own:
+# they lead the unique constraints.
 class RatingModel(db.Model):
     __table_args__ = (
         db.UniqueConstraint('user_id', 'rater_id', 'ride_id', name='unique_rating_per_ride'),
-        db.CheckConstraint('stars >= 1 AND stars <= 5', name='check_stars_range')
+        db.CheckConstraint('stars >= 1 AND stars <= 5', name='check_stars_range'),
+        {'sqlite_autoincrement': True},
     )
     
     id = db.Column(db.Integer, primary_key=True)
-    ride_id = db.Column(db.Integer, db.ForeignKey('ride_model.id', ondelete='CASCADE'), nullable=False)
+    ride_id = db.Column(db.Integer, db.ForeignKey('ride_model.id', ondelete='CASCADE'), nullable=False, index=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user_model.id', ondelete='CASCADE'), nullable=False)
-    rater_id = db.Column(db.Integer, db.ForeignKey('user_model.id', ondelete='CASCADE'), nullable=False)
+    rater_id = db.Column(db.Integer, db.ForeignKey('user_model.id', ondelete='CASCADE'), nullable=False, index=True)
     stars = db.Column(db.Integer, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
 
     def __repr__(self):
         return f"Rating(id = {self.id}, ride_id = {self.ride_id}, user_id = {self.user_id}, rater_id = {self.rater_id}, stars = {self.stars})"
 
+
+
+# Distinct addresses and cities with their number of PLANNED rides, kept current by
+# triggers on ride_model (see places.py).
+class PlaceModel(db.Model):
+    __tablename__ = 'place'
+    __table_args__ = (db.UniqueConstraint('kind', 'name', name='unique_place'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(16), nullable=False)
+    name = db.Column(db.Text, nullable=False)
+    planned_rides = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+# Per-user dashboard counters for finished rides, updated in the transactions that
+# finish them (see stats.py).
+class UserStatsModel(db.Model):
+    __tablename__ = 'user_stats'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user_model.id', ondelete='CASCADE'), primary_key=True,
+                        autoincrement=False)
+    rides_driven = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rides_cancelled = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    passengers_carried = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    revenue = db.Column(db.Float, nullable=False, default=0.0, server_default='0')
+    rides_taken = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+# Cold storage for finished rides (see archive.py). Same columns as the live tables,
+# ids preserved, so archived rows serialize exactly like live ones.
+class ArchivedRideModel(db.Model):
+    __tablename__ = 'ride_archive'
+    __table_args__ = (db.Index('ix_ride_archive_driver', 'driver_id', 'departure_time'),)
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    driver_id = db.Column(db.Integer, nullable=False)
+    from_address = db.Column(db.Text, nullable=False)
+    from_lat = db.Column(db.Float, nullable=False)
+    from_lng = db.Column(db.Float, nullable=False)
+    to_address = db.Column(db.Text, nullable=False)
+    to_lat = db.Column(db.Float, nullable=False)
+    to_lng = db.Column(db.Float, nullable=False)
+    start_city = db.Column(db.String(100), nullable=True)
+    end_city = db.Column(db.String(100), nullable=True)
+    start_city_norm = db.Column(db.String(100), nullable=True)
+    end_city_norm = db.Column(db.String(100), nullable=True)
+    from_cell = db.Column(db.Integer, nullable=True)
+    to_cell = db.Column(db.Integer, nullable=True)
+    departure_time = db.Column(db.DateTime, nullable=False)
+    price_per_seat = db.Column(db.Float, nullable=False)
+    seats_available = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.Enum(RideStatus, by_name=False))
+    created_at = db.Column(db.DateTime)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    archived_at = db.Column(db.DateTime, nullable=False)
+
+class ArchivedRideParticipantModel(db.Model):
+    __tablename__ = 'ride_participant_archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    ride_id = db.Column(db.Integer, nullable=False, index=True)
+    passenger_id = db.Column(db.Integer, nullable=False, index=True)
+    joined_at = db.Column(db.DateTime)
+
+class ArchivedRatingModel(db.Model):
+    __tablename__ = 'rating_archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    ride_id = db.Column(db.Integer, nullable=False, index=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    rater_id = db.Column(db.Integer, nullable=False)
+    stars = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime)
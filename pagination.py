@@ -0,0 +1,118 @@
+import base64
+import json
+from datetime import datetime
+from urllib.parse import urlencode
+
+from flask import Response, request, stream_with_context
+from flask_restful import abort
+from sqlalchemy import DateTime, and_, or_
+
+from app_setup import db
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 500
+
+
+def encode_cursor(values):
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+class PageError(ValueError):
+    pass
+
+def decode_cursor(token, columns):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError
+        return [datetime.fromisoformat(v) if isinstance(c.type, DateTime) else v
+                for c, v in zip(columns, values)]
+    except (ValueError, TypeError):
+        raise PageError("Invalid cursor")
+
+def after(columns, values):
+    # (a, b) > (x, y) spelled out so SQLite can seek on the leading index column.
+    clauses = []
+    for i, (column, value) in enumerate(zip(columns, values)):
+        equal = [c == v for c, v in zip(columns[:i], values[:i])]
+        clauses.append(and_(*equal, column > value))
+    return or_(*clauses)
+
+def parse_limit(args, default):
+    limit = args.get('limit')
+    if limit is None:
+        return default
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise PageError("limit must be an integer")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise PageError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return limit
+
+# The helpers below take the query-string arguments as a plain mapping so the async
+# entry point (asgi.py) pages exactly like the Flask resources do.
+
+def page_query(query, columns, args, default_limit=DEFAULT_PAGE_SIZE):
+    """Order ``query`` by ``columns`` and skip past ``args['cursor']``; returns the
+    query and the page size (None for an unlimited stream)."""
+    query = query.order_by(*columns)
+    cursor = args.get('cursor')
+    if cursor:
+        query = query.where(after(columns, decode_cursor(cursor, columns)))
+    return query, parse_limit(args, default_limit)
+
+def finish_page(items, columns, limit, base_url, args):
+    """Trim the ``limit + 1`` fetched ``items`` to one page; returns the page and its
+    Link / X-Next-Cursor headers."""
+    if len(items) <= limit:
+        return items, {}
+    items = items[:limit]
+    cursor = encode_cursor([items[-1][c.key] for c in columns])
+    args = dict(args, cursor=cursor)
+    return items, {'Link': f'<{base_url}?{urlencode(args)}>; rel="next"', 'X-Next-Cursor': cursor}
+
+def paginate(query, columns, serializer):
+    """Keyset-paginate the SELECT ``query`` ordered by ``columns`` (unique as a whole,
+    last one the primary key, all of them present in the serializer's output) and
+    encode one page with ``serializer``.
+
+    ``?stream=ndjson`` / ``?stream=json`` instead streams every row after the cursor.
+    """
+    args = request.args.to_dict()
+    stream = args.get('stream')
+    if stream and stream not in ('json', 'ndjson'):
+        abort(400, message="stream must be 'json' or 'ndjson'")
+    try:
+        query, limit = page_query(query, columns, args, None if stream else DEFAULT_PAGE_SIZE)
+    except PageError as error:
+        abort(400, message=str(error))
+
+    if stream:
+        if limit:
+            query = query.limit(limit)
+        return stream_rows(query, serializer, stream)
+
+    items = serializer.fetch_all(query.limit(limit + 1))
+    items, headers = finish_page(items, columns, limit, request.base_url, args)
+    return items, 200, headers
+
+def stream_rows(query, serializer, fmt):
+    encode = serializer.encode
+
+    def generate():
+        rows = db.session.execute(query.execution_options(yield_per=STREAM_BATCH_SIZE))
+        if fmt == 'ndjson':
+            for row in rows:
+                yield json.dumps(encode(row)) + '\n'
+            return
+        yield '['
+        first = True
+        for row in rows:
+            yield ('' if first else ',') + json.dumps(encode(row))
+            first = False
+        yield ']\n'
+
+    mimetype = 'application/x-ndjson' if fmt == 'ndjson' else 'application/json'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
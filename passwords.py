@@ -0,0 +1,74 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from flask import current_app
+from flask_restful import abort
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Hashing is CPU-bound and holds the GIL, so it runs in a small process pool. At most
+# PASSWORD_HASH_QUEUE_LIMIT calls may be running or waiting; beyond that requests are
+# shed with 503 instead of piling up behind a login storm.
+class HashPool:
+    def __init__(self, workers, queue_limit):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._pool = None
+        self._pid = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def executor(self):
+        with self._lock:
+            # A pool inherited through fork() is unusable, so each process builds its own.
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                self._slots = threading.BoundedSemaphore(self.queue_limit)
+                self._pid = os.getpid()
+            return self._pool, self._slots
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+
+def init_password_pool(app):
+    app.extensions['password_pool'] = HashPool(app.config['PASSWORD_HASH_WORKERS'],
+                                               app.config['PASSWORD_HASH_QUEUE_LIMIT'])
+
+def _run(fn, *args):
+    if not current_app.config['PASSWORD_HASH_POOL']:
+        return fn(*args)
+    pool, slots = current_app.extensions['password_pool'].executor()
+    if not slots.acquire(blocking=False):
+        abort(503, message="Server is busy, please retry shortly")
+    try:
+        return pool.submit(fn, *args).result()
+    finally:
+        slots.release()
+
+def shutdown_pool():
+    current_app.extensions['password_pool'].shutdown()
+
+
+def hash_password(password):
+    config = current_app.config
+    return _run(generate_password_hash, password,
+                config['PASSWORD_HASH_METHOD'], config['PASSWORD_HASH_SALT_LENGTH'])
+
+def verify_password(password_hash, password):
+    return _run(check_password_hash, password_hash, password)
+
+@lru_cache(maxsize=8)
+def _hash_prefix(method, salt_length):
+    return generate_password_hash('', method, salt_length).split('$', 1)[0]
+
+def needs_rehash(password_hash):
+    config = current_app.config
+    method, _, rest = password_hash.partition('$')
+    salt = rest.partition('$')[0]
+    return (method != _hash_prefix(config['PASSWORD_HASH_METHOD'], config['PASSWORD_HASH_SALT_LENGTH'])
+            or len(salt) != config['PASSWORD_HASH_SALT_LENGTH'])
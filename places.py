@@ -0,0 +1,136 @@
+"""Type-ahead over the addresses and cities of planned rides.
+
+``place`` holds every distinct address and city with the number of PLANNED rides
+using it; ``place_fts`` is a contentless FTS5 index over the names with prefix
+indexes for 1-3 characters, so a keystroke is one index lookup plus a sort of the
+matching places (never of the rides). Triggers on ride_model keep the counts current
+from every write path - ORM, bulk INSERTs, set-based status UPDATEs - inside the
+writing transaction; a reservation does not touch them (it only updates seats).
+Since overdue PLANNED rides are cancelled by the stale-ride pass, PLANNED is what
+"upcoming" means here.
+"""
+from contextlib import contextmanager
+
+from sqlalchemy import event, text
+
+from app_setup import db
+
+KINDS = ('address', 'city')
+MAX_SUGGESTIONS = 50
+
+# unicode61 drops accents (ó -> o) but keeps letters that are not composed, like ł.
+FOLDED = {'ł': 'l', 'Ł': 'L'}
+
+def fold(value):
+    for letter, plain in FOLDED.items():
+        value = value.replace(letter, plain)
+    return value
+
+def _fold_sql(expression):
+    for letter, plain in FOLDED.items():
+        expression = f"replace({expression}, '{letter}', '{plain}')"
+    return expression
+
+def _place_rows(row, sign, condition):
+    # The four place names of a ride (OLD or NEW) that pass ``condition``, upserted with
+    # ``sign`` rides.
+    return f"""
+        INSERT INTO place (kind, name, planned_rides)
+        SELECT kind, name, {sign} * count(*) FROM (
+            SELECT 'address' AS kind, trim({row}.from_address) AS name
+            UNION ALL SELECT 'address', trim({row}.to_address)
+            UNION ALL SELECT 'city', trim({row}.start_city)
+            UNION ALL SELECT 'city', trim({row}.end_city)
+        ) WHERE name IS NOT NULL AND name != '' AND {condition}
+        GROUP BY kind, name
+        ON CONFLICT (kind, name) DO UPDATE SET planned_rides = planned_rides + excluded.planned_rides;"""
+
+PLACE_FTS = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS place_fts USING fts5("
+    "name, content='', tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')"
+)
+
+RIDE_TRIGGERS = {
+    'place_ride_insert': f"""
+        CREATE TRIGGER IF NOT EXISTS place_ride_insert AFTER INSERT ON ride_model
+        WHEN NEW.status = 'PLANNED'
+        BEGIN {_place_rows('NEW', 1, '1')}
+        END""",
+    'place_ride_delete': f"""
+        CREATE TRIGGER IF NOT EXISTS place_ride_delete AFTER DELETE ON ride_model
+        WHEN OLD.status = 'PLANNED'
+        BEGIN {_place_rows('OLD', -1, '1')}
+        END""",
+    'place_ride_update': f"""
+        CREATE TRIGGER IF NOT EXISTS place_ride_update
+        AFTER UPDATE OF status, from_address, to_address, start_city, end_city ON ride_model
+        WHEN OLD.status = 'PLANNED' OR NEW.status = 'PLANNED'
+        BEGIN {_place_rows('OLD', -1, "OLD.status = 'PLANNED'")}
+              {_place_rows('NEW', 1, "NEW.status = 'PLANNED'")}
+        END""",
+}
+
+PLACE_TRIGGER = f"""
+    CREATE TRIGGER IF NOT EXISTS place_fts_insert AFTER INSERT ON place
+    BEGIN
+        INSERT INTO place_fts (rowid, name) VALUES (NEW.id, {_fold_sql('NEW.name')});
+    END"""
+
+
+def install_place_index(connection):
+    connection.exec_driver_sql(PLACE_FTS)
+    connection.exec_driver_sql(PLACE_TRIGGER)
+    for sql in RIDE_TRIGGERS.values():
+        connection.exec_driver_sql(sql)
+
+@event.listens_for(db.metadata, 'after_create')
+def create_place_index(metadata, connection, **kw):
+    # Databases built by create_all() alone (benchmarks, scratch apps) get the index too.
+    if connection.dialect.name == 'sqlite':
+        install_place_index(connection)
+
+def rebuild_places(connection):
+    """Recount every place from ride_model and rebuild the FTS index. Returns the
+    number of places with planned rides."""
+    connection.exec_driver_sql('DELETE FROM place')
+    connection.exec_driver_sql("INSERT INTO place_fts (place_fts) VALUES ('delete-all')")
+    connection.exec_driver_sql("""
+        INSERT INTO place (kind, name, planned_rides)
+        SELECT kind, name, count(*) FROM (
+            SELECT 'address' AS kind, trim(from_address) AS name FROM ride_model WHERE status = 'PLANNED'
+            UNION ALL SELECT 'address', trim(to_address) FROM ride_model WHERE status = 'PLANNED'
+            UNION ALL SELECT 'city', trim(start_city) FROM ride_model WHERE status = 'PLANNED'
+            UNION ALL SELECT 'city', trim(end_city) FROM ride_model WHERE status = 'PLANNED'
+        ) WHERE name IS NOT NULL AND name != ''
+        GROUP BY kind, name""")
+    return connection.exec_driver_sql('SELECT count(*) FROM place').scalar()
+
+@contextmanager
+def deferred_place_sync(engine):
+    """Bulk loads: drop the ride_model triggers for the block, then recount once."""
+    with engine.begin() as connection:
+        for name in RIDE_TRIGGERS:
+            connection.exec_driver_sql(f'DROP TRIGGER IF EXISTS {name}')
+    try:
+        yield
+    finally:
+        with engine.begin() as connection:
+            rebuild_places(connection)
+            for sql in RIDE_TRIGGERS.values():
+                connection.exec_driver_sql(sql)
+
+
+def match_expression(q):
+    """FTS5 query matching places that contain a word starting with every word of
+    ``q``, or None if ``q`` has no words."""
+    words = ''.join(c if c.isalnum() else ' ' for c in fold(q)).split()
+    return ' AND '.join('"' + word + '"*' for word in words) or None
+
+def suggest_query(kind=None):
+    kind_filter = 'AND place.kind = :kind' if kind else ''
+    return text(f"""
+        SELECT place.name, place.kind, place.planned_rides
+        FROM place_fts JOIN place ON place.id = place_fts.rowid
+        WHERE place_fts MATCH :match AND place.planned_rides > 0 {kind_filter}
+        ORDER BY place.planned_rides DESC, place.name
+        LIMIT :limit""")
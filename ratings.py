@@ -0,0 +1,57 @@
+from sqlalchemy import bindparam, func, select, union_all, update
+
+from models import ArchivedRatingModel, RatingModel, UserModel
+
+
+def record_rating(session, user_id, stars):
+    """Add one rating to the user's counters with a single UPDATE, relative to the
+    values already stored so that concurrent submissions cannot lose each other."""
+    session.execute(
+        update(UserModel)
+        .where(UserModel.id == user_id)
+        .values(
+            rating_count=UserModel.rating_count + 1,
+            rating_sum=UserModel.rating_sum + stars,
+            average_rating=(UserModel.rating_sum + stars) * 1.0 / (UserModel.rating_count + 1),
+            version=UserModel.version + 1,
+        )
+    )
+
+def rating_totals():
+    # Ratings of archived rides still count towards the user's average.
+    ratings = union_all(select(RatingModel.user_id, RatingModel.stars),
+                        select(ArchivedRatingModel.user_id, ArchivedRatingModel.stars)).subquery()
+    return (
+        select(ratings.c.user_id, func.count().label('count'), func.sum(ratings.c.stars).label('total'))
+        .group_by(ratings.c.user_id)
+    )
+
+def rebuild_rating_aggregates(connection):
+    totals = connection.execute(rating_totals()).all()
+    connection.execute(update(UserModel).values(rating_count=0, rating_sum=0, average_rating=0.0))
+    if totals:
+        connection.execute(
+            update(UserModel.__table__)
+            .where(UserModel.__table__.c.id == bindparam('user_id'))
+            .values(rating_count=bindparam('count'), rating_sum=bindparam('total'),
+                    average_rating=bindparam('average')),
+            [{'user_id': user_id, 'count': count, 'total': total, 'average': total / count}
+             for user_id, count, total in totals],
+        )
+    return len(totals)
+
+def check_rating_aggregates(connection, batch_size=10000):
+    """Yield (user_id, stored (count, sum, average), expected (count, sum, average))
+    for every user whose counters disagree with rating_model."""
+    totals = rating_totals().subquery()
+    query = (
+        select(UserModel.id, UserModel.rating_count, UserModel.rating_sum, UserModel.average_rating,
+               func.coalesce(totals.c.count, 0), func.coalesce(totals.c.total, 0))
+        .outerjoin(totals, totals.c.user_id == UserModel.id)
+        .order_by(UserModel.id)
+        .execution_options(yield_per=batch_size)
+    )
+    for user_id, count, total, average, expected_count, expected_total in connection.execute(query):
+        expected_average = expected_total / expected_count if expected_count else 0.0
+        if (count, total) != (expected_count, expected_total) or abs((average or 0.0) - expected_average) > 1e-9:
+            yield user_id, (count, total, average), (expected_count, expected_total, expected_average)
@@ -0,0 +1,104 @@
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app_setup import db
+from etags import version_condition
+from models import RideModel, RideParticipantModel, RideStatus
+from search_cache import SearchCache, invalidate_ride_searches
+
+
+class ReservationError(Exception):
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+MODIFIED = 'Resource has been modified'
+
+
+def ride_modified(ride_id, versions):
+    """Whether the ride is no longer at one of the If-Match ``versions`` (None: no
+    If-Match), to tell a failed conditional write's 412 from its other causes."""
+    if versions is None:
+        return False
+    return db.session.execute(select(RideModel.version).filter_by(id=ride_id)).scalar() not in versions
+
+def _load_planned_ride(ride_id, action, versions=None):
+    ride = db.session.get(RideModel, ride_id)
+    if not ride:
+        raise ReservationError('Ride not found', 404)
+    if versions is not None and ride.version not in versions:
+        raise ReservationError(MODIFIED, 412)
+    if ride.status != RideStatus.PLANNED:
+        raise ReservationError(f'Cannot {action} ride that is not in PLANNED status', 400)
+    return ride
+
+def reserve_seat(ride_id, passenger_id, versions=None):
+    """Take one seat and add the passenger in one transaction.
+
+    The seat is taken with a conditional UPDATE, so two concurrent joins can never both
+    see the last seat as free; the unique (ride_id, passenger_id) constraint rejects a
+    passenger joining twice. With If-Match ``versions`` the UPDATE also requires one of
+    them."""
+    ride = _load_planned_ride(ride_id, 'join', versions)
+    if ride.driver_id == passenger_id:
+        raise ReservationError('Driver cannot join', 400)
+
+    existing = db.session.execute(
+        select(RideParticipantModel.id).filter_by(ride_id=ride_id, passenger_id=passenger_id)
+    ).first()
+    if existing:
+        raise ReservationError('Passenger already joined this ride', 400)
+
+    reserved = db.session.execute(
+        update(RideModel)
+        .where(RideModel.id == ride_id,
+               RideModel.status == RideStatus.PLANNED,
+               RideModel.seats_available > 0,
+               *version_condition(RideModel.version, versions))
+        .values(seats_available=RideModel.seats_available - 1, version=RideModel.version + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not reserved:
+        db.session.rollback()
+        if ride_modified(ride_id, versions):
+            raise ReservationError(MODIFIED, 412)
+        raise ReservationError('No seats available', 400)
+
+    buckets = SearchCache.ride_buckets(ride)
+    db.session.add(RideParticipantModel(ride_id=ride_id, passenger_id=passenger_id))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        raise ReservationError('Passenger already joined this ride', 400)
+    invalidate_ride_searches(buckets)
+
+def release_seat(ride_id, passenger_id, versions=None):
+    ride = _load_planned_ride(ride_id, 'leave', versions)
+    buckets = SearchCache.ride_buckets(ride)
+
+    removed = db.session.execute(
+        delete(RideParticipantModel)
+        .where(RideParticipantModel.ride_id == ride_id,
+               RideParticipantModel.passenger_id == passenger_id)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not removed:
+        db.session.rollback()
+        raise ReservationError('Passenger not in this ride', 404)
+
+    released = db.session.execute(
+        update(RideModel)
+        .where(RideModel.id == ride_id, RideModel.status == RideStatus.PLANNED,
+               *version_condition(RideModel.version, versions))
+        .values(seats_available=RideModel.seats_available + 1, version=RideModel.version + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not released:
+        db.session.rollback()
+        if ride_modified(ride_id, versions):
+            raise ReservationError(MODIFIED, 412)
+        raise ReservationError('Cannot leave ride that is not in PLANNED status', 400)
+    db.session.commit()
+    invalidate_ride_searches(buckets)
@@ -0,0 +1,41 @@
+from api import *
+
+
+def register_routes(app, api):
+    @app.route('/')
+    def home():
+        return {
+            'message': 'Flask API',
+            'endpoints': {
+                'users': '/api/users/',
+                'user': '/api/users/<id>',
+                'register': '/api/register',
+                'login': '/api/login/'
+            }
+        }
+
+    api.add_resource(Users, '/api/users/')
+    api.add_resource(User, '/api/users/<int:id>')
+    api.add_resource(Register, '/api/register')
+    api.add_resource(Login, '/api/login/')
+    api.add_resource(Rides, '/api/rides/')
+    api.add_resource(RidesNearby, '/api/rides/nearby')
+    api.add_resource(RidesMatch, '/api/rides/match')
+    api.add_resource(RidesBulk, '/api/rides/bulk')
+    api.add_resource(RideJoin, '/api/rides/<int:ride_id>/join/')
+    api.add_resource(AllParticipants, '/api/participants/')
+    api.add_resource(RideLeave, '/api/rides/<int:ride_id>/leave')
+    api.add_resource(RideStart, '/api/rides/<int:ride_id>/start')
+    api.add_resource(RideComplete, '/api/rides/<int:ride_id>/complete')
+    api.add_resource(RideCancel, '/api/rides/<int:ride_id>/cancel')
+    api.add_resource(RideParticipants, '/api/rides/<int:ride_id>/participants')
+    api.add_resource(RideEvents, '/api/rides/<int:ride_id>/events')
+    api.add_resource(RidesEvents, '/api/rides/events')
+    api.add_resource(RideParticipantsBulk, '/api/rides/<int:ride_id>/participants/bulk')
+    api.add_resource(Ratings, '/api/ratings/')
+    api.add_resource(UserRides, '/api/users/<int:id>/rides')
+    api.add_resource(UserStats, '/api/users/<int:id>/stats')
+    api.add_resource(UserRideHistory, '/api/users/<int:id>/rides/history')
+    api.add_resource(RideParticipantHistory, '/api/rides/<int:ride_id>/participants/history')
+    api.add_resource(PlacesSuggest, '/api/places/suggest')
+    api.add_resource(SearchCacheStats, '/api/cache/stats')
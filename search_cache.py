@@ -0,0 +1,152 @@
+import itertools
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+from models import normalize_city
+
+# Ride search results are cached per (origin, destination, date) bucket. Each bucket
+# has a generation counter that is part of every cache key, so invalidating a bucket
+# is a single increment and stale entries simply age out of the LRU.
+
+
+class MemoryBackend:
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def generation(self, bucket):
+        return self._generations.get(bucket, 0)
+
+    def bump(self, bucket):
+        with self._lock:
+            self._generations[bucket] = self._generations.get(bucket, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+
+
+class RedisBackend:
+    """Shared backend for several workers. ``client`` is anything with the redis-py
+    get/set/incr interface, e.g. ``redis.Redis`` or a local stand-in."""
+
+    def __init__(self, client, prefix='rides:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url):
+        import redis
+        return cls(redis.Redis.from_url(url))
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, json.dumps(value), ex=max(int(ttl), 1))
+
+    def generation(self, bucket):
+        return int(self.client.get(self.prefix + 'gen:' + bucket) or 0)
+
+    def bump(self, bucket):
+        self.client.incr(self.prefix + 'gen:' + bucket)
+
+
+class SearchCache:
+    def __init__(self, backend, ttl=30):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def bucket(origin, destination, date):
+        return '|'.join((origin or '', destination or '', date.isoformat() if date else ''))
+
+    def key(self, origin, destination, date, extra):
+        bucket = self.bucket(origin, destination, date)
+        return f'{bucket}#{self.backend.generation(bucket)}#{extra}'
+
+    def get(self, key):
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value, self.ttl)
+
+    @classmethod
+    def buckets_for(cls, start_city, end_city, departure_time):
+        """Every bucket a search could have put this ride in: each of origin, destination
+        and date is either the ride's own value or absent from the query."""
+        values = (normalize_city(start_city), normalize_city(end_city),
+                  departure_time.date() if departure_time else None)
+        return {cls.bucket(*combo)
+                for combo in itertools.product(*[(value, None) for value in values])}
+
+    @classmethod
+    def ride_buckets(cls, ride):
+        return cls.buckets_for(ride.start_city, ride.end_city, ride.departure_time)
+
+    def invalidate(self, buckets):
+        for bucket in buckets:
+            self.backend.bump(bucket)
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / total if total else 0.0,
+        }
+
+
+def init_search_cache(app):
+    """Build the app's search cache from its config."""
+    config = app.config
+    url = config['SEARCH_CACHE_BACKEND']
+    if url == 'memory':
+        backend = MemoryBackend(config['SEARCH_CACHE_MAX_ENTRIES'])
+    else:
+        backend = RedisBackend.from_url(url)
+    app.extensions['search_cache'] = SearchCache(backend, config['SEARCH_CACHE_TTL'])
+
+def search_cache():
+    return current_app.extensions['search_cache']
+
+def invalidate_ride_searches(buckets):
+    search_cache().invalidate(buckets)
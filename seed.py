@@ -0,0 +1,219 @@
+"""Synthetic data for benchmarks and local development.
+
+Rows are generated as plain tuples from a seeded RNG and written with raw executemany
+INSERTs in batched transactions, so neither the ORM nor SQLAlchemy's per-row
+parameter processing is involved. Secondary indexes are dropped for the load and
+rebuilt once at the end, which is much cheaper than maintaining them row by row; the
+same goes for the place counts behind address suggestions.
+"""
+import datetime
+import random
+from contextlib import contextmanager
+
+from werkzeug.security import generate_password_hash
+
+from geo import grid_cell, route_corridor
+from models import RideStatus, departure_bucket, normalize_city
+from places import deferred_place_sync
+from ratings import rebuild_rating_aggregates
+from stats import rebuild_user_stats
+
+SEED_PASSWORD = 'password'
+BATCH_SIZE = 50000  # rides per transaction
+SEATS = 4
+
+CITIES = {
+    'Warszawa': (52.2297, 21.0122),
+    'Kraków': (50.0647, 19.9450),
+    'Łódź': (51.7592, 19.4560),
+    'Wrocław': (51.1079, 17.0385),
+    'Poznań': (52.4064, 16.9252),
+    'Gdańsk': (54.3520, 18.6466),
+    'Szczecin': (53.4285, 14.5528),
+    'Bydgoszcz': (53.1235, 18.0084),
+    'Lublin': (51.2465, 22.5684),
+    'Białystok': (53.1325, 23.1688),
+    'Katowice': (50.2649, 19.0238),
+    'Rzeszów': (50.0412, 21.9991),
+}
+
+# Share of seeded rides in each status.
+STATUS_WEIGHTS = {
+    RideStatus.PLANNED: 0.80,
+    RideStatus.IN_PROGRESS: 0.05,
+    RideStatus.COMPLETED: 0.10,
+    RideStatus.CANCELLED: 0.05,
+}
+
+USER_COLUMNS = ('id', 'username', 'email', 'password_hash', 'university', 'average_rating',
+                'rating_count', 'rating_sum', 'created_at', 'version')
+RIDE_COLUMNS = ('id', 'driver_id', 'from_address', 'from_lat', 'from_lng', 'to_address', 'to_lat', 'to_lng',
+                'start_city', 'end_city', 'start_city_norm', 'end_city_norm', 'from_cell', 'to_cell',
+                'corridor_min_lat', 'corridor_max_lat', 'corridor_min_lng', 'corridor_max_lng',
+                'departure_time', 'departure_bucket', 'price_per_seat', 'seats_available', 'status',
+                'created_at', 'version')
+PARTICIPANT_COLUMNS = ('id', 'ride_id', 'passenger_id', 'joined_at')
+RATING_COLUMNS = ('id', 'ride_id', 'user_id', 'rater_id', 'stars', 'created_at')
+
+
+def sqlite_datetime(value):
+    # The text format SQLAlchemy's SQLite DateTime type stores and compares against.
+    return value.isoformat(' ', 'microseconds')
+
+def insert_rows(connection, table, columns, rows):
+    if rows:
+        placeholders = ', '.join('?' * len(columns))
+        connection.exec_driver_sql(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows)
+
+def next_id(connection, table):
+    # Past the ids of archived and deleted rows too, which AUTOINCREMENT keeps in
+    # sqlite_sequence.
+    return connection.exec_driver_sql(
+        f"SELECT max(coalesce((SELECT max(id) FROM {table}), 0), "
+        f"coalesce((SELECT seq FROM sqlite_sequence WHERE name = '{table}'), 0)) + 1").scalar()
+
+@contextmanager
+def deferred_indexes(engine, tables):
+    """Drop the explicit indexes of ``tables`` for the duration of the block and
+    recreate them afterwards (also when the block fails). Indexes backing UNIQUE
+    constraints are kept."""
+    placeholders = ', '.join('?' * len(tables))
+    with engine.begin() as connection:
+        indexes = connection.exec_driver_sql(
+            f"SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL "
+            f"AND tbl_name IN ({placeholders})", tuple(tables)).all()
+        for name, _ in indexes:
+            connection.exec_driver_sql(f'DROP INDEX {name}')
+    try:
+        yield
+    finally:
+        with engine.begin() as connection:
+            for _, sql in indexes:
+                connection.exec_driver_sql(sql)
+
+@contextmanager
+def unsynchronized(connection):
+    # Nothing is lost that the seed could not regenerate if the machine crashes mid-load.
+    previous = connection.exec_driver_sql('PRAGMA synchronous').scalar()
+    connection.exec_driver_sql('PRAGMA synchronous = OFF')
+    connection.commit()
+    try:
+        yield connection
+    finally:
+        connection.rollback()
+        connection.exec_driver_sql(f'PRAGMA synchronous = {previous}')
+        connection.commit()
+
+
+def user_rows(first_id, count, now, password_hash, prefix='user'):
+    created_at = sqlite_datetime(now)
+    return [(id, f'{prefix}{id}', f'{prefix}{id}@example.com', password_hash, 'Seed University',
+             0.0, 0, 0, created_at, 1)
+            for id in range(first_id, first_id + count)]
+
+class Generator:
+    """Yields rides and the participants and ratings that go with them, one batch at a
+    time. Every ride gets on average participants/rides passengers (at most SEATS,
+    never its driver); completed rides are rated by their passengers until
+    ``ratings`` is reached."""
+
+    def __init__(self, rng, now, users, first_user, rides, participants, ratings):
+        self.rng = rng
+        self.now = now
+        self.created_at = sqlite_datetime(now)
+        self.users = users
+        self.first_user = first_user
+        self.per_ride = min(participants / rides, SEATS) if rides else 0
+        completed = self.per_ride * rides * STATUS_WEIGHTS[RideStatus.COMPLETED]
+        self.rate_probability = min(1.0, ratings / completed) if completed else 0.0
+        self.ratings_left = ratings
+        self.statuses = [status.name for status in STATUS_WEIGHTS]
+        self.cumulative = []
+        total = 0.0
+        for weight in STATUS_WEIGHTS.values():
+            total += weight
+            self.cumulative.append(total)
+        self.cities = [(name, normalize_city(name), lat, lng) for name, (lat, lng) in CITIES.items()]
+
+    def passenger_count(self):
+        whole = int(self.per_ride)
+        return whole + (self.rng.random() < self.per_ride - whole)
+
+    def batch(self, first_ride, count, first_participant, first_rating):
+        rng = self.rng
+        rides, participants, ratings = [], [], []
+        participant_id, rating_id = first_participant, first_rating
+        for ride_id in range(first_ride, first_ride + count):
+            start, end = rng.sample(self.cities, 2)
+            draw = rng.random()
+            status = next((s for s, c in zip(self.statuses, self.cumulative) if draw < c), self.statuses[-1])
+            planned = status == 'PLANNED'
+            offset = rng.uniform(1, 30) if planned else -rng.uniform(0, 30)
+            departure = (self.now + datetime.timedelta(days=offset)).replace(microsecond=0)
+            driver = self.first_user + rng.randrange(self.users)
+            from_lat, from_lng = start[2] + rng.uniform(-0.05, 0.05), start[3] + rng.uniform(-0.05, 0.05)
+            to_lat, to_lng = end[2] + rng.uniform(-0.05, 0.05), end[3] + rng.uniform(-0.05, 0.05)
+
+            passengers = set()
+            wanted = min(self.passenger_count(), self.users - 1)
+            while len(passengers) < wanted:
+                passenger = self.first_user + rng.randrange(self.users)
+                if passenger != driver:
+                    passengers.add(passenger)
+            for passenger in sorted(passengers):
+                participants.append((participant_id, ride_id, passenger, self.created_at))
+                participant_id += 1
+                if status == 'COMPLETED' and self.ratings_left and rng.random() < self.rate_probability:
+                    stars = rng.choice((1, 2, 3, 3, 3, 4, 4, 4, 4, 5, 5, 5, 5, 5))
+                    ratings.append((rating_id, ride_id, driver, passenger, stars, self.created_at))
+                    rating_id += 1
+                    self.ratings_left -= 1
+
+            rides.append((
+                ride_id, driver,
+                f'{start[0]}, ul. Przykładowa {rng.randint(1, 200)}', from_lat, from_lng,
+                f'{end[0]}, ul. Testowa {rng.randint(1, 200)}', to_lat, to_lng,
+                start[0], end[0], start[1], end[1], grid_cell(from_lat, from_lng), grid_cell(to_lat, to_lng),
+                *route_corridor(from_lat, from_lng, to_lat, to_lng),
+                sqlite_datetime(departure), departure_bucket(departure), float(rng.randint(10, 120)), SEATS - len(passengers), status,
+                self.created_at, 1,
+            ))
+        return rides, participants, ratings
+
+
+def seed(engine, users, rides, participants, ratings, rng_seed=0, password=SEED_PASSWORD, log=None):
+    """Add ``users`` users (user<id> / user<id>@example.com, all with ``password``),
+    ``rides`` rides between CITIES and about ``participants`` seat reservations and
+    up to ``ratings`` driver ratings, then rebuild the rating counters and user
+    statistics. Returns the number of rows written per table."""
+    rng = random.Random(rng_seed)
+    now = datetime.datetime.utcnow()
+    written = {'users': users, 'rides': rides, 'participants': 0, 'ratings': 0}
+    tables = ('user_model', 'ride_model', 'ride_participant_model', 'rating_model')
+
+    with deferred_indexes(engine, tables), deferred_place_sync(engine), \
+            engine.connect() as connection, unsynchronized(connection):
+        with connection.begin():
+            first_user = next_id(connection, 'user_model')
+            insert_rows(connection, 'user_model', USER_COLUMNS,
+                        user_rows(first_user, users, now, generate_password_hash(password)))
+
+        generator = Generator(rng, now, users, first_user, rides, participants, ratings)
+        for start in range(0, rides, BATCH_SIZE):
+            with connection.begin():
+                ride_rows, participant_rows, rating_rows = generator.batch(
+                    next_id(connection, 'ride_model'), min(BATCH_SIZE, rides - start),
+                    next_id(connection, 'ride_participant_model'), next_id(connection, 'rating_model'))
+                insert_rows(connection, 'ride_model', RIDE_COLUMNS, ride_rows)
+                insert_rows(connection, 'ride_participant_model', PARTICIPANT_COLUMNS, participant_rows)
+                insert_rows(connection, 'rating_model', RATING_COLUMNS, rating_rows)
+            written['participants'] += len(participant_rows)
+            written['ratings'] += len(rating_rows)
+            if log:
+                log(f"{start + len(ride_rows)}/{rides} rides")
+
+        with connection.begin():
+            if written['ratings']:
+                rebuild_rating_aggregates(connection)
+            rebuild_user_stats(connection)
+    return written
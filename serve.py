@@ -0,0 +1,221 @@
+"""Production entry point: a gunicorn master that loads the app once and forks workers.
+
+    python serve.py --workers 4 --bind 0.0.0.0:8000 --pidfile /run/flask-api.pid
+    python serve.py reload --pidfile /run/flask-api.pid
+
+The master imports the app (asgi.py under uvicorn workers, or run.py under threaded
+WSGI workers) before forking and moves everything it allocated out of the garbage
+collector's reach, so workers share those pages copy-on-write instead of importing,
+and slowly dirtying, a copy each. A worker disposes of the inherited engine's pool
+first thing, so no SQLite connection crosses a fork.
+
+Workers are recycled after about --max-requests requests (jittered so they do not all
+restart together) or, with --max-memory, once their private memory passes the limit;
+either way the worker finishes its requests first and the master forks a fresh one.
+(Uvicorn only counts a response whose client is still connected after the last body
+message, so clients that send ``Connection: close`` may not count under asgi.)
+``kill -HUP`` replaces the workers the same way, but with the code loaded before the
+fork; ``reload`` upgrades the code with no downtime: it starts a new master beside the
+old one on the same socket (USR2), waits for its workers and stops the old master
+gracefully. Background jobs start in every worker and run in the one holding
+BACKGROUND_LOCK.
+
+Every worker keeps its own search cache and event hub: use the redis search cache
+backend with several workers, and note that an event stream only sees the changes
+made through its own worker.
+"""
+import time
+
+STARTED = time.perf_counter()
+
+import argparse
+import gc
+import importlib
+import logging
+import os
+import signal
+import sys
+
+from gunicorn.app.base import BaseApplication
+
+from config import env_int
+
+WORKER_CLASSES = {'asgi': 'uvicorn_worker.UvicornWorker', 'wsgi': 'gthread'}
+MEMORY_CHECK_INTERVAL = 30
+RELOAD_SETTLE = 1
+
+MiB = 1024 * 1024
+
+
+def memory_summary():
+    from metrics import process_memory
+
+    memory = process_memory()
+    if not memory:
+        return "memory n/a"
+    return "RSS {rss:.1f} MiB, PSS {pss:.1f} MiB, private {private:.1f} MiB".format(
+        **{key: value / MiB for key, value in memory.items()})
+
+
+def flask_app():
+    from run import app
+
+    return app
+
+def default_background_lock(app):
+    from app_setup import db
+
+    with app.app_context():
+        url = db.engine.url
+    if url.get_backend_name() == 'sqlite' and url.database and url.database != ':memory:':
+        return url.database + '.background.lock'
+    os.makedirs(app.instance_path, exist_ok=True)
+    return os.path.join(app.instance_path, 'background.lock')
+
+
+def pre_fork(server, worker):
+    worker.forked_at = time.perf_counter()
+
+def post_fork(server, worker):
+    from app_setup import db
+
+    app = flask_app()
+    with app.app_context():
+        # close=False: the pooled connections belong to the master; just forget them.
+        db.engine.dispose(close=False)
+
+def post_worker_init(worker):
+    from background import PeriodicTask, start_background_tasks
+
+    app = flask_app()
+    # The uvicorn worker starts them again on lifespan startup, which is a no-op.
+    start_background_tasks(app)
+    limit = worker.app.args.max_memory
+    if limit:
+        PeriodicTask(app, 'memory-limit', MEMORY_CHECK_INTERVAL, memory_check(worker, limit * MiB)).start()
+    worker.log.info("Worker %s ready in %.0f ms: %s", worker.pid,
+                    (time.perf_counter() - worker.forked_at) * 1000, memory_summary())
+
+def memory_check(worker, limit):
+    from metrics import process_memory
+
+    def check(app):
+        private = process_memory().get('private', 0)
+        if private > limit:
+            worker.log.info("Worker %s recycled: %.1f MiB private memory over the %.1f MiB limit",
+                            worker.pid, private / MiB, limit / MiB)
+            os.kill(worker.pid, signal.SIGTERM)
+    return check
+
+
+class Server(BaseApplication):
+    def __init__(self, args):
+        self.args = args
+        super().__init__()
+
+    def load_config(self):
+        args = self.args
+        settings = {
+            'bind': args.bind,
+            'workers': args.workers,
+            'worker_class': WORKER_CLASSES[args.serve],
+            'threads': args.threads,
+            'preload_app': True,
+            'max_requests': args.max_requests,
+            'max_requests_jitter': args.max_requests_jitter,
+            'timeout': args.timeout,
+            'graceful_timeout': args.graceful_timeout,
+            'keepalive': args.keepalive,
+            'pidfile': args.pidfile,
+            'proc_name': 'flask-api',
+            'pre_fork': pre_fork,
+            'post_fork': post_fork,
+            'post_worker_init': post_worker_init,
+        }
+        for key, value in settings.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # Runs in the master before the first fork; gunicorn has set up its logger.
+        log = logging.getLogger('gunicorn.error')
+        started = time.perf_counter()
+        app = importlib.import_module('asgi' if self.args.serve == 'asgi' else 'run').app
+        flask = flask_app()
+        flask.config['BACKGROUND_LOCK'] = flask.config['BACKGROUND_LOCK'] or default_background_lock(flask)
+        if self.args.workers > 1 and flask.config['SEARCH_CACHE_BACKEND'] == 'memory':
+            log.warning("%d workers with the in-memory search cache: a write clears the cache of its own "
+                        "worker only, others may serve results up to %ss old",
+                        self.args.workers, flask.config['SEARCH_CACHE_TTL'])
+        gc.collect()
+        gc.freeze()
+        now = time.perf_counter()
+        log.info("App loaded in %.2fs (%.2fs after start): %s", now - started, now - STARTED, memory_summary())
+        return app
+
+
+def read_pid(path):
+    try:
+        with open(path) as file:
+            return int(file.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+def children(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as file:
+            return len(file.read().split())
+    except OSError:
+        return None
+
+def reload(args):
+    old = read_pid(args.pidfile)
+    if not old:
+        sys.exit(f"No running master in {args.pidfile}")
+    workers = children(old)
+    os.kill(old, signal.SIGUSR2)
+    deadline = time.monotonic() + args.reload_timeout
+    new = 0
+    while time.monotonic() < deadline:
+        # The new master writes <pidfile>.2 and renames it once the old one is gone.
+        new = read_pid(args.pidfile + '.2')
+        if new and (workers is None or (children(new) or 0) >= workers):
+            break
+        time.sleep(0.1)
+    else:
+        sys.exit(f"The new master did not come up within {args.reload_timeout}s; master {old} left running")
+    # Forked workers need a moment to finish initialising (more where their number
+    # cannot be read); the old ones keep serving meanwhile.
+    time.sleep(RELOAD_SETTLE if workers is not None else 5 * RELOAD_SETTLE)
+    os.kill(old, signal.SIGTERM)
+    print(f"Master {new} serving, master {old} stopping gracefully")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the API with a preloading, pre-forking gunicorn master")
+    parser.add_argument('command', nargs='?', choices=('start', 'reload'), default='start',
+                        help="reload: start a master with the current code beside the one in --pidfile, "
+                             "then stop the old one")
+    parser.add_argument('--bind', default=os.environ.get('BIND', '127.0.0.1:8000'))
+    parser.add_argument('--workers', type=int, default=env_int('WEB_CONCURRENCY', os.cpu_count() or 2))
+    parser.add_argument('--serve', choices=sorted(WORKER_CLASSES), default=os.environ.get('SERVE', 'asgi'))
+    parser.add_argument('--threads', type=int, default=env_int('THREADS', 8), help="Per worker, wsgi only")
+    parser.add_argument('--max-requests', type=int, default=env_int('MAX_REQUESTS', 10000),
+                        help="Recycle a worker after this many requests (0: never)")
+    parser.add_argument('--max-requests-jitter', type=int, default=env_int('MAX_REQUESTS_JITTER', 1000))
+    parser.add_argument('--max-memory', type=int, default=env_int('MAX_WORKER_MEMORY', 0),
+                        help="Recycle a worker whose private memory passes this many MiB (0: never)")
+    parser.add_argument('--timeout', type=int, default=30)
+    parser.add_argument('--graceful-timeout', type=int, default=30)
+    parser.add_argument('--keepalive', type=int, default=5)
+    parser.add_argument('--pidfile', default=os.environ.get('PIDFILE'))
+    parser.add_argument('--reload-timeout', type=float, default=60)
+    args = parser.parse_args(argv)
+
+    if args.command == 'reload':
+        if not args.pidfile:
+            parser.error("reload needs --pidfile")
+        return reload(args)
+    Server(args).run()
+
+if __name__ == '__main__':
+    sys.exit(main())
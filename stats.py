@@ -0,0 +1,96 @@
+"""Per-user ride statistics kept in ``user_stats``.
+
+A ride counts once it is finished: for its driver as driven (with its passengers and
+the revenue they paid) when COMPLETED, or as cancelled when CANCELLED; for each of its
+passengers as taken when COMPLETED. record_rides() adds (or, for a deleted ride,
+takes away) the rides it is given by their current status with two upserts, inside
+the caller's transaction. Archived rides keep counting; rebuild_user_stats()
+recounts the live and the archive tables.
+"""
+from sqlalchemy import bindparam, delete, func, select, text
+
+from models import RideStatus, UserModel, UserStatsModel
+
+FINISHED = (RideStatus.COMPLETED, RideStatus.CANCELLED)
+COUNTERS = ('rides_driven', 'rides_cancelled', 'passengers_carried', 'revenue', 'rides_taken')
+
+LIVE = ('ride_model', 'ride_participant_model')
+ARCHIVE = ('ride_archive', 'ride_participant_archive')
+
+
+def _upsert(columns, select_sql):
+    # Plain SQL: SQLAlchemy does not cache the compiled form of an ON CONFLICT insert,
+    # and compiling it costs more than running it.
+    updates = ', '.join(f'{column} = {column} + excluded.{column}' for column in columns)
+    return f"""
+        INSERT INTO user_stats (user_id, {', '.join(columns)})
+        {select_sql}
+        ON CONFLICT (user_id) DO UPDATE SET {updates}"""
+
+def totals_statements(rides, participants, by_ride=False):
+    """The two upserts adding :sign times the finished rides of ``rides`` (all of them,
+    or with ``by_ride`` the ``:ride_ids`` ones) to user_stats: drivers, then passengers."""
+    # By id, the unary + keeps SQLite from scanning a status index instead of looking
+    # the rides up.
+    status = '+r.status' if by_ride else 'r.status'
+    ride_filter = 'AND r.id IN :ride_ids' if by_ride else ''
+    participant_filter = 'WHERE ride_id IN :ride_ids' if by_ride else ''
+    carried = "CASE WHEN r.status = 'COMPLETED' THEN coalesce(p.passengers, 0) ELSE 0 END"
+    drivers = _upsert(COUNTERS[:4], f"""
+        SELECT r.driver_id, :sign * sum(r.status = 'COMPLETED'), :sign * sum(r.status = 'CANCELLED'),
+               :sign * sum({carried}), :sign * sum({carried} * r.price_per_seat)
+        FROM {rides} AS r LEFT JOIN (
+            SELECT ride_id, count(*) AS passengers FROM {participants} {participant_filter} GROUP BY ride_id
+        ) AS p ON p.ride_id = r.id
+        WHERE {status} IN ('COMPLETED', 'CANCELLED') {ride_filter}
+        GROUP BY r.driver_id""")
+    passengers = _upsert(COUNTERS[4:], f"""
+        SELECT pp.passenger_id, :sign * count(*)
+        FROM {participants} AS pp JOIN {rides} AS r ON r.id = pp.ride_id
+        WHERE {status} = 'COMPLETED' {ride_filter}
+        GROUP BY pp.passenger_id""")
+    statements = [text(drivers), text(passengers)]
+    if by_ride:
+        statements = [statement.bindparams(bindparam('ride_ids', expanding=True)) for statement in statements]
+    return statements
+
+RECORD_RIDES = totals_statements(*LIVE, by_ride=True)
+
+def record_rides(session, ride_ids, sign=1):
+    """Add the finished rides among ``ride_ids`` to the stats of their drivers and
+    passengers (``sign=-1`` takes them away). Does not commit."""
+    if ride_ids:
+        for statement in RECORD_RIDES:
+            session.execute(statement, {'ride_ids': list(ride_ids), 'sign': sign})
+
+def rebuild_user_stats(connection):
+    """Recount user_stats from the live and the archived rides. Returns the number
+    of users with statistics."""
+    connection.execute(delete(UserStatsModel))
+    for tables in (LIVE, ARCHIVE):
+        for statement in totals_statements(*tables):
+            connection.execute(statement, {'sign': 1})
+    return connection.execute(select(func.count()).select_from(UserStatsModel)).scalar()
+
+def user_stats_query(user_id):
+    # One primary-key lookup on each table, however many rides the user has.
+    return (
+        select(UserModel.id, UserModel.average_rating, UserModel.rating_count,
+               *(func.coalesce(getattr(UserStatsModel, column), 0).label(column) for column in COUNTERS))
+        .outerjoin(UserStatsModel, UserStatsModel.user_id == UserModel.id)
+        .where(UserModel.id == user_id)
+    )
+
+def user_stats(row):
+    finished = row.rides_driven + row.rides_cancelled
+    return {
+        'user_id': row.id,
+        'rides_driven': row.rides_driven,
+        'rides_cancelled': row.rides_cancelled,
+        'cancellation_rate': row.rides_cancelled / finished if finished else 0.0,
+        'passengers_carried': row.passengers_carried,
+        'revenue': round(float(row.revenue), 2),
+        'rides_taken': row.rides_taken,
+        'average_rating': row.average_rating or 0.0,
+        'rating_count': row.rating_count,
+    }
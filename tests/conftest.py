@@ -0,0 +1,63 @@
+import datetime
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from app_setup import create_app, db
+from models import RideModel, RideParticipantModel, RideStatus, UserModel
+
+CITIES = {'Kraków': (50.0647, 19.9450), 'Warszawa': (52.2297, 21.0122)}
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'test.db'}",
+        'PASSWORD_HASH_POOL': False,
+    })
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def add_user(name):
+    user = UserModel(username=name, email=f'{name}@example.com', password_hash='x')
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+def add_ride(driver_id, start='Kraków', end='Warszawa', departure=None, seats=4, status=RideStatus.PLANNED,
+             **columns):
+    (from_lat, from_lng), (to_lat, to_lng) = CITIES[start], CITIES[end]
+    ride = RideModel(driver_id=driver_id, from_address=f'{start} Główny', from_lat=from_lat, from_lng=from_lng,
+                     to_address=f'{end} Centralny', to_lat=to_lat, to_lng=to_lng, start_city=start, end_city=end,
+                     departure_time=departure or datetime.datetime.utcnow() + datetime.timedelta(days=1),
+                     price_per_seat=20.0, seats_available=seats, status=status, **columns)
+    db.session.add(ride)
+    db.session.commit()
+    return ride.id
+
+def add_participant(ride_id, passenger_id):
+    db.session.add(RideParticipantModel(ride_id=ride_id, passenger_id=passenger_id))
+    db.session.commit()
+
+@contextmanager
+def count_queries():
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
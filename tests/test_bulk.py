@@ -0,0 +1,46 @@
+import sqlite3
+
+from sqlalchemy import event
+
+from app_setup import db
+from conftest import add_ride, add_user
+from models import RideModel, RideParticipantModel
+
+
+def test_participants_bulk_on_a_missing_ride_is_404_even_when_every_item_is_invalid(client):
+    response = client.post('/api/rides/999/participants/bulk', json={'passenger_ids': ['x', True]})
+    assert response.status_code == 404
+
+def test_participants_bulk_reports_invalid_items(client):
+    ride_id = add_ride(add_user('driver'))
+    response = client.post(f'/api/rides/{ride_id}/participants/bulk', json={'passenger_ids': ['x']})
+    assert response.status_code == 400
+    assert response.get_json()['errors'] == [{'index': 0, 'errors': {'passenger_id': "Invalid value: 'x'"}}]
+
+def test_participants_bulk_reports_a_passenger_who_joined_meanwhile(client):
+    ride_id = add_ride(add_user('driver'), seats=4)
+    first, second = add_user('first'), add_user('second')
+
+    def join_first(conn, cursor, statement, parameters, context, executemany):
+        # Right before the seats are taken: the batch has already read the participants.
+        if statement.startswith('UPDATE ride_model ') and not joined:
+            joined.append(statement)
+            with sqlite3.connect(db.engine.url.database) as other:
+                other.execute('INSERT INTO ride_participant_model (ride_id, passenger_id) VALUES (?, ?)',
+                              (ride_id, first))
+
+    joined = []
+    event.listen(db.engine, 'before_cursor_execute', join_first)
+    try:
+        response = client.post(f'/api/rides/{ride_id}/participants/bulk', json={'passenger_ids': [first, second]})
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', join_first)
+
+    assert joined
+    assert response.status_code == 201
+    body = response.get_json()
+    assert len(body['created']) == 1
+    assert body['errors'] == [{'index': 0, 'errors': {'passenger_id': 'Passenger already joined this ride'}}]
+    db.session.expire_all()
+    assert db.session.get(RideModel, ride_id).seats_available == 3
+    assert RideParticipantModel.query.filter_by(ride_id=ride_id).count() == 2
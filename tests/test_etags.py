@@ -0,0 +1,79 @@
+import sqlite3
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from app_setup import db
+from conftest import add_ride, add_user
+from etags import version_etag
+from models import RideModel, RideParticipantModel, UserModel
+
+
+@contextmanager
+def concurrent_bump(table, row_id):
+    """Bump the row's version from another connection right before this one's first
+    UPDATE of ``table``: the write lands after the If-Match check has passed."""
+    def bump(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith(f'UPDATE {table} ') and not bumped:
+            bumped.append(statement)
+            with sqlite3.connect(db.engine.url.database) as other:
+                other.execute(f'UPDATE {table} SET version = version + 1 WHERE id = ?', (row_id,))
+
+    bumped = []
+    event.listen(db.engine, 'before_cursor_execute', bump)
+    try:
+        yield bumped
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', bump)
+
+def profile(**fields):
+    return dict(username='ala', email='ala@example.com', password='secret-password', **fields)
+
+
+def test_patch_with_stale_etag_is_412(client):
+    user_id = add_user('ala')
+    etag = client.get(f'/api/users/{user_id}').headers['ETag']
+
+    first = client.patch(f'/api/users/{user_id}', json=profile(university='AGH'), headers={'If-Match': etag})
+    assert first.status_code == 200
+    assert first.headers['ETag'] != etag
+
+    second = client.patch(f'/api/users/{user_id}', json=profile(university='UJ'), headers={'If-Match': etag})
+    assert second.status_code == 412
+    assert db.session.get(UserModel, user_id).university == 'AGH'
+
+def test_patch_racing_another_write_is_412(client):
+    user_id = add_user('ala')
+    etag = client.get(f'/api/users/{user_id}').headers['ETag']
+
+    with concurrent_bump('user_model', user_id) as bumped:
+        response = client.patch(f'/api/users/{user_id}', json=profile(university='AGH'), headers={'If-Match': etag})
+    assert bumped
+    assert response.status_code == 412
+    db.session.expire_all()
+    assert db.session.get(UserModel, user_id).university is None
+
+def test_join_racing_another_write_is_412(client):
+    driver_id, passenger_id = add_user('driver'), add_user('passenger')
+    ride_id = add_ride(driver_id, seats=2)
+    etag = version_etag('ride', ride_id, 1)
+
+    with concurrent_bump('ride_model', ride_id) as bumped:
+        response = client.post(f'/api/rides/{ride_id}/join/', json={'passenger_id': passenger_id},
+                               headers={'If-Match': etag})
+    assert bumped
+    assert response.status_code == 412
+    db.session.expire_all()
+    assert db.session.get(RideModel, ride_id).seats_available == 2
+    assert not RideParticipantModel.query.filter_by(ride_id=ride_id).count()
+
+def test_cancel_with_current_etag(client):
+    driver_id = add_user('driver')
+    ride_id = add_ride(driver_id)
+
+    stale = client.patch(f'/api/rides/{ride_id}/cancel', json={'driver_id': driver_id},
+                         headers={'If-Match': version_etag('ride', ride_id, 0)})
+    assert stale.status_code == 412
+    response = client.patch(f'/api/rides/{ride_id}/cancel', json={'driver_id': driver_id},
+                            headers={'If-Match': version_etag('ride', ride_id, 1)})
+    assert response.status_code == 200
@@ -0,0 +1,26 @@
+from conftest import add_user
+
+
+def metric(client, line):
+    with client.get('/metrics') as response:
+        samples = dict(sample.rsplit(' ', 1) for sample in response.get_data(as_text=True).splitlines()
+                       if not sample.startswith('#'))
+    return float(samples.get(line, 0))
+
+def test_series_are_split_by_method(client):
+    add_user('ala')
+    with client.get('/api/users/') as response:
+        assert response.status_code == 200
+    with client.post('/api/users/', json={}) as response:
+        assert response.status_code == 400
+
+    assert metric(client, 'db_queries_per_request_count{endpoint="/api/users/",method="GET"}') == 1
+    assert metric(client, 'db_queries_per_request_sum{endpoint="/api/users/",method="GET"}') >= 1
+    assert metric(client, 'db_queries_per_request_sum{endpoint="/api/users/",method="POST"}') == 0
+
+def test_statements_of_a_streamed_body_count(client):
+    add_user('ala')
+    with client.get('/api/users/?stream=ndjson') as response:
+        assert b'"ala"' in response.get_data()
+
+    assert metric(client, 'db_queries_per_request_sum{endpoint="/api/users/",method="GET"}') >= 1
@@ -0,0 +1,49 @@
+import itertools
+
+import pytest
+
+from conftest import add_participant, add_ride, add_user, count_queries
+from search_cache import search_cache
+
+# Every list endpoint loads its rows with their driver / passenger names in one query,
+# so the number of statements does not depend on the number of rows.
+ENDPOINTS = {
+    'Rides.get': lambda ids: '/api/rides/?origin=Kraków',
+    'UserRides.get': lambda ids: f"/api/users/{ids['driver']}/rides",
+    'RideParticipants.get': lambda ids: f"/api/rides/{ids['ride']}/participants",
+    'AllParticipants.get': lambda ids: '/api/participants/',
+}
+
+names = itertools.count()
+
+
+def add_rows(ids, rides, passengers):
+    # More rides of the driver, more passengers on the driver's first ride.
+    for _ in range(rides):
+        add_ride(ids['driver'])
+    for _ in range(passengers):
+        add_participant(ids['ride'], add_user(f'passenger{next(names)}'))
+
+def statements_for(client, url):
+    search_cache().backend.clear()
+    with count_queries() as statements:
+        response = client.get(url)
+    assert response.status_code == 200
+    payload = response.get_json()
+    return len(statements), len(payload['items'] if isinstance(payload, dict) else payload)
+
+
+@pytest.mark.parametrize('endpoint', sorted(ENDPOINTS))
+def test_statements_do_not_grow_with_rows(client, endpoint):
+    ids = {'driver': add_user('driver')}
+    ids['ride'] = add_ride(ids['driver'])
+    add_rows(ids, 0, 1)
+    url = ENDPOINTS[endpoint](ids)
+
+    one, returned = statements_for(client, url)
+    assert returned == 1
+
+    add_rows(ids, 49, 49)
+    fifty, returned = statements_for(client, url)
+    assert returned == 50
+    assert fifty == one
@@ -0,0 +1,42 @@
+import threading
+import time
+
+import pytest
+from sqlalchemy import func, select
+
+from app_setup import db
+from conftest import add_ride, add_user
+from models import RideModel, RideParticipantModel
+
+PASSENGERS = 60
+
+
+@pytest.mark.parametrize('seats', [1, 3])
+def test_concurrent_joins_never_oversell(app, seats, record_property):
+    ride_id = add_ride(add_user('driver'), seats=seats)
+    passengers = [add_user(f'passenger{i}') for i in range(PASSENGERS)]
+    start = threading.Barrier(PASSENGERS)
+    statuses = []
+
+    def join(passenger_id):
+        client = app.test_client()
+        start.wait()
+        response = client.post(f'/api/rides/{ride_id}/join/', json={'passenger_id': passenger_id})
+        statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=join, args=(passenger,)) for passenger in passengers]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    record_property('joins_per_second', round(PASSENGERS / elapsed))
+
+    db.session.expire_all()
+    assert len(statuses) == PASSENGERS
+    assert not [status for status in statuses if status >= 500]
+    assert statuses.count(201) == seats
+    assert db.session.get(RideModel, ride_id).seats_available == 0
+    assert db.session.execute(
+        select(func.count()).select_from(RideParticipantModel).filter_by(ride_id=ride_id)).scalar() == seats
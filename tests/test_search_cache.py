@@ -0,0 +1,85 @@
+import datetime
+import threading
+
+from app_setup import create_app
+from conftest import add_ride, add_user
+from search_cache import MemoryBackend, RedisBackend, SearchCache, search_cache
+
+
+class FakeRedis:
+    """The part of redis-py RedisBackend uses, over a dict. Values come back as bytes,
+    like from a real server."""
+
+    def __init__(self):
+        self.values = {}
+        self.expiry = {}
+
+    def get(self, key):
+        value = self.values.get(key)
+        return value.encode() if isinstance(value, str) else value
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+        self.expiry[key] = ex
+
+    def incr(self, key):
+        self.values[key] = str(int(self.values.get(key, 0)) + 1)
+        return int(self.values[key])
+
+
+DEPARTURE = datetime.datetime(2026, 11, 1, 8, 30)
+
+
+def test_redis_backend_set_invalidate_miss():
+    client = FakeRedis()
+    cache = SearchCache(RedisBackend(client), ttl=30)
+    key = cache.key('kraków', 'warszawa', DEPARTURE.date(), '20:')
+    page = [[{'id': 1, 'start_city': 'Kraków'}], 200, {'ETag': '"rides-1"'}]
+
+    assert cache.get(key) is None
+    cache.set(key, page)
+    assert client.expiry['rides:' + key] == 30
+    assert cache.get(key) == page
+
+    # A ride in the bucket changed: the next search builds a new key and misses.
+    cache.invalidate(SearchCache.buckets_for('Kraków', 'Warszawa', DEPARTURE))
+    fresh = cache.key('kraków', 'warszawa', DEPARTURE.date(), '20:')
+    assert fresh != key
+    assert cache.get(fresh) is None
+    assert cache.stats() == {'hits': 1, 'misses': 2, 'hit_ratio': 1 / 3}
+
+def test_invalidation_only_touches_the_ride_buckets():
+    cache = SearchCache(RedisBackend(FakeRedis()))
+    other = cache.key('gdańsk', 'warszawa', None, '')
+    cache.set(other, [])
+    cache.invalidate(SearchCache.buckets_for('Kraków', 'Warszawa', DEPARTURE))
+    assert cache.key('gdańsk', 'warszawa', None, '') == other
+    assert cache.get(other) == []
+
+def test_hit_and_miss_counts_under_threads():
+    cache = SearchCache(MemoryBackend())
+    cache.set('hit', 1)
+    threads = [threading.Thread(target=lambda: [cache.get(k) for k in ('hit', 'miss') * 2000]) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert cache.stats()['hits'] == cache.stats()['misses'] == 16000
+
+def test_renaming_a_driver_refreshes_cached_searches(client):
+    driver_id = add_user('ala')
+    add_ride(driver_id)
+    search = lambda: client.get('/api/rides/?origin=Kraków').get_json()
+    assert search()[0]['driver_name'] == 'ala'
+
+    response = client.patch(f'/api/users/{driver_id}', json={
+        'username': 'ola', 'email': 'ala@example.com', 'password': 'secret-password'})
+    assert response.status_code == 200
+    assert search()[0]['driver_name'] == 'ola'
+
+def test_each_app_builds_its_own_cache(app, tmp_path):
+    other = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'other.db'}", 'SEARCH_CACHE_TTL': 5})
+    with other.app_context():
+        assert search_cache().ttl == 5
+    assert search_cache() is not other.extensions['search_cache']
+    assert search_cache().ttl == app.config['SEARCH_CACHE_TTL']
@@ -0,0 +1,37 @@
+import datetime
+
+import pytest
+from sqlalchemy import text
+
+from api import RIDE_ORDER, ride_search_query
+from app_setup import db
+from pagination import DEFAULT_PAGE_SIZE
+
+DAY = datetime.datetime(2026, 11, 1)
+
+# (origin, destination, day) of every search shape, and the index that should serve it.
+SHAPES = {
+    'origin and destination': (('kraków', 'warszawa', None), 'ix_ride_search'),
+    'origin, destination and date': (('kraków', 'warszawa', DAY), 'ix_ride_search'),
+    'origin': (('kraków', None, None), 'ix_ride_origin_departure'),
+    'origin and date': (('kraków', None, DAY), 'ix_ride_origin_departure'),
+    'destination': ((None, 'warszawa', None), 'ix_ride_destination_departure'),
+    'destination and date': ((None, 'warszawa', DAY), 'ix_ride_destination_departure'),
+    'date': ((None, None, DAY), 'ix_ride_departure'),
+    'no filter': ((None, None, None), 'ix_ride_departure'),
+}
+
+
+def query_plan(query):
+    sql = query.compile(db.engine, compile_kwargs={'literal_binds': True})
+    return [row[-1] for row in db.session.execute(text(f'EXPLAIN QUERY PLAN {sql}'))]
+
+
+@pytest.mark.parametrize('shape', SHAPES)
+def test_search_page_reads_an_index_in_order(app, shape):
+    params, index = SHAPES[shape]
+    plan = query_plan(ride_search_query(*params).order_by(*RIDE_ORDER).limit(DEFAULT_PAGE_SIZE))
+
+    assert any(step.startswith('SEARCH ride_model USING INDEX ' + index + ' ')
+               or step == 'SCAN ride_model USING INDEX ' + index for step in plan), plan
+    assert not any('TEMP B-TREE' in step for step in plan), plan
@@ -0,0 +1,25 @@
+import random
+import time
+
+from sqlalchemy.exc import OperationalError
+
+from app_setup import db
+
+LOCK_RETRIES = 6
+LOCK_BACKOFF = 0.01
+
+
+def is_locked_error(error):
+    return 'database is locked' in str(error.orig)
+
+def retry_on_locked(fn, *args, retries=LOCK_RETRIES, backoff=LOCK_BACKOFF, **kwargs):
+    """Run a unit of work, rolling back and retrying with jittered exponential backoff
+    while SQLite reports that another writer holds the lock."""
+    for attempt in range(retries + 1):
+        try:
+            return fn(*args, **kwargs)
+        except OperationalError as error:
+            db.session.rollback()
+            if attempt == retries or not is_locked_error(error):
+                raise
+            time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))